@@ -1,48 +1,124 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, make_response, request
 from flask_cors import CORS
-import json
-import os
+import click
 import uuid
 from datetime import datetime
+from storage import JsonStore
+from jsoncodec import JSONProvider, stream_chunks
+from compression import Compressor
+import metrics
+from cache import RESPONSE_CACHE_BYTES, LRUCache
+from repository import BACKEND, COLLECTIONS, DATA_DIR, DuplicateKeyError, JsonRepository, create_repository
+from queries import QueryError, parse_list_query, parse_stream
+from batch import BatchError, parse_batch
+from milestones import MilestoneError, MilestoneNotFound
+from conditional import PreconditionFailed, conditional, matching_etag, record_etag, version_key
+from sync import SyncError
+from reminders import ReminderScheduler
 
 app = Flask(__name__)
-CORS(app)
-
-# File paths for our JSON data storage
-DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
-TASKS_FILE = os.path.join(DATA_DIR, 'tasks.json')
-GOALS_FILE = os.path.join(DATA_DIR, 'goals.json')
-USERS_FILE = os.path.join(DATA_DIR, 'users.json')
-SETTINGS_FILE = os.path.join(DATA_DIR, 'settings.json')
-
-# Create data directory if it doesn't exist
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-
-# Helper function to convert datetime to string for JSON serialization
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return json.JSONEncoder.default(self, obj)
-
-app.json_encoder = JSONEncoder
-
-# Helper functions for file operations
-def read_json_file(file_path):
-    if not os.path.exists(file_path):
-        return []
-    with open(file_path, 'r') as f:
-        return json.load(f)
-
-def write_json_file(file_path, data):
-    with open(file_path, 'w') as f:
-        json.dump(data, f, cls=JSONEncoder, indent=2)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'Last-Modified'])
+
+# Storage backend, chosen with TASKX_BACKEND (see repository.py). Every route
+# below goes through it, so all backends behave the same.
+repository = create_repository()
+
+# Every repository call is timed for GET /metrics
+metrics.instrument(repository)
+
+# Version counters behind the ETag / Last-Modified headers of the read routes
+versions = repository.versions
+
+# Change notifications pushed to GET /events subscribers
+events = repository.events
+
+# Due date reminders pushed on the same streams (see reminders.py); set
+# TASKX_REMINDER_INTERVAL=0 to turn them off. The scheduler starts with the
+# first stream, so CLI commands and the benchmark client never run it.
+reminders = ReminderScheduler(repository)
+
+# Serialized bodies of the read routes, reused until the versions behind
+# their ETag change (see conditional.py)
+response_cache = LRUCache(RESPONSE_CACHE_BYTES) if RESPONSE_CACHE_BYTES else None
+
+# orjson-backed when available; also handles datetimes and ObjectIds
+app.json = JSONProvider(app)
+
+# Request timing and the slow-request profiler (see metrics.py). Registered
+# before the compressor so its after_request hook runs last.
+request_metrics = metrics.RequestMetrics(app)
+
+# gzip / brotli for JSON bodies above a size threshold (see compression.py)
+compressor = Compressor(app)
+
+# Helper function for list responses; the cursor for the next page (if any)
+# travels in a header so the body stays a plain array
+def list_response(records, next_cursor):
+    response = jsonify(records)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# Helper function for single-record responses. The strong ETag names this
+# version of the record: send it back in If-Match to make a PATCH
+# conditional, or in If-None-Match to revalidate a GET. A compressed body
+# carries it with the encoding appended, which matches as well; the 304
+# repeats the tag the client sent.
+def record_response(record, status=200):
+    if request.method == 'GET' and 'If-None-Match' in request.headers:
+        etag = matching_etag(request.if_none_match, record, weak=True)
+        if etag is not None:
+            response = make_response('', 304)
+            response.set_etag(etag)
+            return response
+    response = jsonify(record)
+    response.status_code = status
+    response.set_etag(record_etag(record))
+    return response
+
+# Fields a PATCH may not remove, as the POST and PUT routes require them
+REQUIRED_FIELDS = {
+    'tasks': ('title',),
+    'goals': ('title',),
+    'users': ('email', 'name')
+}
+
+# Helper function for the PATCH routes. The body holds just the fields to
+# change (null removes a field); with If-Match the update only happens if
+# the record is still the version the client last saw, else 412.
+def patch_response(name, label, id):
+    data = request.json
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    removed = [field for field in REQUIRED_FIELDS[name] if field in data and data[field] is None]
+    if removed:
+        return jsonify({'error': '%s cannot be removed' % ', '.join(removed)}), 400
+    
+    if_match = request.if_match if 'If-Match' in request.headers else None
+    try:
+        record = repository.patch(name, id, data, if_match)
+    except PreconditionFailed as e:
+        response = jsonify({'error': '%s was changed by another request' % label})
+        response.set_etag(record_etag(e.record))
+        return response, 412
+    except DuplicateKeyError:
+        return jsonify({'error': 'User with this email already exists'}), 400
+    if record is None:
+        return jsonify({'error': '%s not found' % label}), 404
+    return record_response(record)
+
+# Helper function for streamed list responses (?stream=json or ?stream=ndjson).
+# Records are read from the repository and serialized as they are sent, so
+# memory use does not grow with the size of the list.
+def stream_response(records, stream):
+    if stream == 'ndjson':
+        return Response(stream_chunks(records, ndjson=True), mimetype='application/x-ndjson')
+    return Response(stream_chunks(records), mimetype='application/json')
 
 # Initialize database with sample data if empty
 def init_db():
-    # Check if tasks file is empty
-    if not os.path.exists(TASKS_FILE) or os.path.getsize(TASKS_FILE) == 0:
+    # Check if there are no tasks yet
+    if repository.count('tasks') == 0:
         sample_tasks = [
             {
                 '_id': str(uuid.uuid4()),
@@ -78,11 +154,11 @@ def init_db():
                 'updated_at': datetime.utcnow()
             }
         ]
-        write_json_file(TASKS_FILE, sample_tasks)
+        repository.import_records('tasks', sample_tasks)
         print("Initialized database with sample tasks")
     
-    # Check if users file is empty
-    if not os.path.exists(USERS_FILE) or os.path.getsize(USERS_FILE) == 0:
+    # Check if there are no users yet
+    if repository.count('users') == 0:
         default_user = {
             '_id': 'default_user',
             'name': 'Swaraj Patil',
@@ -95,11 +171,11 @@ def init_db():
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow()
         }
-        write_json_file(USERS_FILE, [default_user])
+        repository.import_records('users', [default_user])
         print("Initialized database with default user")
     
-    # Check if goals file is empty
-    if not os.path.exists(GOALS_FILE) or os.path.getsize(GOALS_FILE) == 0:
+    # Check if there are no goals yet
+    if repository.count('goals') == 0:
         sample_goals = [
             {
                 '_id': str(uuid.uuid4()),
@@ -154,11 +230,11 @@ def init_db():
                 'updated_at': datetime.utcnow()
             }
         ]
-        write_json_file(GOALS_FILE, sample_goals)
+        repository.import_records('goals', sample_goals)
         print("Initialized database with sample goals")
         
-    # Check if settings file is empty
-    if not os.path.exists(SETTINGS_FILE) or os.path.getsize(SETTINGS_FILE) == 0:
+    # Check if there are no settings yet
+    if repository.count('settings') == 0:
         default_settings = {
             '_id': str(uuid.uuid4()),
             'user_id': 'default_user',
@@ -169,302 +245,369 @@ def init_db():
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow()
         }
-        write_json_file(SETTINGS_FILE, [default_settings])
+        repository.import_records('settings', [default_settings])
         print("Initialized database with default settings")
 
 # Task Routes
 @app.route('/tasks', methods=['GET'])
+@conditional(versions, lambda: [version_key('tasks', request.args.get('user_id'))], cache=response_cache)
 def get_tasks():
-    tasks = read_json_file(TASKS_FILE)
-    return jsonify(tasks)
+    try:
+        query = parse_list_query(request.args)
+        stream = parse_stream(request.args, query)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if stream:
+        return stream_response(repository.iter_find('tasks', query), stream)
+    return list_response(*repository.find('tasks', query))
 
 @app.route('/tasks/<id>', methods=['GET'])
 def get_task(id):
-    tasks = read_json_file(TASKS_FILE)
-    task = next((t for t in tasks if t['_id'] == id), None)
+    task = repository.get('tasks', id)
     if task:
-        return jsonify(task)
+        return record_response(task)
     return jsonify({'error': 'Task not found'}), 404
 
 @app.route('/tasks', methods=['POST'])
 def add_task():
     task_data = request.json
-    task_data['_id'] = str(uuid.uuid4())  # Generate a unique ID
-    task_data['created_at'] = datetime.utcnow()
-    task_data['updated_at'] = datetime.utcnow()
     
     # Validate required fields
     if 'title' not in task_data:
         return jsonify({'error': 'Title is required'}), 400
     
-    # Add to tasks list
-    tasks = read_json_file(TASKS_FILE)
-    tasks.append(task_data)
-    write_json_file(TASKS_FILE, tasks)
-    
-    return jsonify(task_data), 201
+    return record_response(repository.create('tasks', task_data), 201)
 
 @app.route('/tasks/<id>', methods=['PUT'])
 def update_task(id):
-    tasks = read_json_file(TASKS_FILE)
-    task_index = next((i for i, t in enumerate(tasks) if t['_id'] == id), None)
-    
-    if task_index is None:
-        return jsonify({'error': 'Task not found'}), 404
-    
     task_data = request.json
-    task_data['_id'] = id  # Ensure ID remains the same
-    task_data['updated_at'] = datetime.utcnow()
     
     # Validate required fields
     if 'title' not in task_data:
         return jsonify({'error': 'Title is required'}), 400
     
-    # Update task
-    tasks[task_index] = task_data
-    write_json_file(TASKS_FILE, tasks)
+    # Replace the task, keeping its ID and creation time
+    updated_task = repository.replace('tasks', id, task_data)
+    if updated_task is None:
+        return jsonify({'error': 'Task not found'}), 404
     
-    return jsonify(task_data)
+    return record_response(updated_task)
+
+@app.route('/tasks/<id>', methods=['PATCH'])
+def patch_task(id):
+    return patch_response('tasks', 'Task', id)
 
 @app.route('/tasks/<id>', methods=['DELETE'])
 def delete_task(id):
-    tasks = read_json_file(TASKS_FILE)
-    initial_count = len(tasks)
-    tasks = [t for t in tasks if t['_id'] != id]
-    
-    if len(tasks) < initial_count:
-        write_json_file(TASKS_FILE, tasks)
+    if repository.delete('tasks', id):
         return jsonify({'message': 'Task deleted successfully'})
     
     return jsonify({'error': 'Task not found'}), 404
 
+@app.route('/tasks/batch', methods=['POST'])
+def batch_tasks():
+    try:
+        operations = parse_batch(request.json)
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'results': repository.batch('tasks', 'Task', operations)})
+
 # Goal Routes
 @app.route('/goals', methods=['GET'])
+@conditional(versions, lambda: [version_key('goals', request.args.get('user_id'))], cache=response_cache)
 def get_goals():
-    goals = read_json_file(GOALS_FILE)
-    return jsonify(goals)
+    try:
+        query = parse_list_query(request.args)
+        stream = parse_stream(request.args, query)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if stream:
+        return stream_response(repository.iter_find('goals', query), stream)
+    return list_response(*repository.find('goals', query))
 
 @app.route('/goals/<id>', methods=['GET'])
 def get_goal(id):
-    goals = read_json_file(GOALS_FILE)
-    goal = next((g for g in goals if g['_id'] == id), None)
+    goal = repository.get('goals', id)
     if goal:
-        return jsonify(goal)
+        return record_response(goal)
     return jsonify({'error': 'Goal not found'}), 404
 
 @app.route('/goals', methods=['POST'])
 def add_goal():
     goal_data = request.json
-    goal_data['_id'] = str(uuid.uuid4())  # Generate a unique ID
-    goal_data['created_at'] = datetime.utcnow()
-    goal_data['updated_at'] = datetime.utcnow()
     
     # Validate required fields
     if 'title' not in goal_data:
         return jsonify({'error': 'Title is required'}), 400
     
-    # Add to goals list
-    goals = read_json_file(GOALS_FILE)
-    goals.append(goal_data)
-    write_json_file(GOALS_FILE, goals)
-    
-    return jsonify(goal_data), 201
+    return record_response(repository.create('goals', goal_data), 201)
 
 @app.route('/goals/<id>', methods=['PUT'])
 def update_goal(id):
-    goals = read_json_file(GOALS_FILE)
-    goal_index = next((i for i, g in enumerate(goals) if g['_id'] == id), None)
-    
-    if goal_index is None:
-        return jsonify({'error': 'Goal not found'}), 404
-    
     goal_data = request.json
-    goal_data['_id'] = id  # Ensure ID remains the same
-    goal_data['updated_at'] = datetime.utcnow()
     
     # Validate required fields
     if 'title' not in goal_data:
         return jsonify({'error': 'Title is required'}), 400
     
-    # Update goal
-    goals[goal_index] = goal_data
-    write_json_file(GOALS_FILE, goals)
+    # Replace the goal, keeping its ID and creation time
+    updated_goal = repository.replace('goals', id, goal_data)
+    if updated_goal is None:
+        return jsonify({'error': 'Goal not found'}), 404
     
-    return jsonify(goal_data)
+    return record_response(updated_goal)
+
+@app.route('/goals/<id>', methods=['PATCH'])
+def patch_goal(id):
+    return patch_response('goals', 'Goal', id)
 
 @app.route('/goals/<id>', methods=['DELETE'])
 def delete_goal(id):
-    goals = read_json_file(GOALS_FILE)
-    initial_count = len(goals)
-    goals = [g for g in goals if g['_id'] != id]
-    
-    if len(goals) < initial_count:
-        write_json_file(GOALS_FILE, goals)
+    if repository.delete('goals', id):
         return jsonify({'message': 'Goal deleted successfully'})
     
     return jsonify({'error': 'Goal not found'}), 404
 
+@app.route('/goals/batch', methods=['POST'])
+def batch_goals():
+    try:
+        operations = parse_batch(request.json)
+    except BatchError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'results': repository.batch('goals', 'Goal', operations)})
+
+# Milestone Routes. Each changes one milestone in place and returns it with
+# the goal's recomputed progress, rather than the whole goal.
+def milestone_response(id, op, milestone_id=None, data=None, status=200):
+    try:
+        result = repository.update_milestones(id, op, milestone_id, data)
+    except MilestoneNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except MilestoneError as e:
+        return jsonify({'error': str(e)}), 400
+    if result is None:
+        return jsonify({'error': 'Goal not found'}), 404
+    
+    goal, milestone = result
+    response = {'_id': goal['_id'], 'progress': goal['progress'], 'updated_at': goal['updated_at']}
+    if milestone is None:
+        response['milestones'] = goal['milestones']
+    else:
+        response['milestone'] = milestone
+    return jsonify(response), status
+
+@app.route('/goals/<id>/milestones', methods=['POST'])
+def add_milestone(id):
+    return milestone_response(id, 'add', data=request.json, status=201)
+
+@app.route('/goals/<id>/milestones/<milestone_id>', methods=['PATCH'])
+def update_milestone(id, milestone_id):
+    return milestone_response(id, 'update', milestone_id, request.json)
+
+@app.route('/goals/<id>/milestones/<milestone_id>', methods=['DELETE'])
+def delete_milestone(id, milestone_id):
+    return milestone_response(id, 'delete', milestone_id)
+
+@app.route('/goals/<id>/milestones/order', methods=['PUT'])
+def reorder_milestones(id):
+    order = request.json.get('order') if isinstance(request.json, dict) else None
+    return milestone_response(id, 'reorder', data=order)
+
 # User Routes
 @app.route('/users', methods=['GET'])
+@conditional(versions, lambda: ['users'], cache=response_cache)
 def get_users():
-    users = read_json_file(USERS_FILE)
+    try:
+        stream = parse_stream(request.args)
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if stream:
+        return stream_response(repository.iter_find('users', parse_list_query({})), stream)
+    users = repository.all('users')
     return jsonify(users)
 
 @app.route('/users/<id>', methods=['GET'])
 def get_user(id):
-    users = read_json_file(USERS_FILE)
-    user = next((u for u in users if u['_id'] == id), None)
-    
-    if not user:
-        # Try finding by email
-        user = next((u for u in users if u.get('email') == id), None)
-        
+    # Users can be looked up by ID or by email
+    user = repository.find_user(id)
     if user:
-        return jsonify(user)
+        return record_response(user)
     return jsonify({'error': 'User not found'}), 404
 
 @app.route('/users', methods=['POST'])
 def add_user():
     user_data = request.json
-    user_data['_id'] = str(uuid.uuid4())  # Generate a unique ID
-    user_data['created_at'] = datetime.utcnow()
-    user_data['updated_at'] = datetime.utcnow()
     
     # Validate required fields
     if 'email' not in user_data or 'name' not in user_data:
         return jsonify({'error': 'Email and name are required'}), 400
-        
-    # Check if user already exists
-    users = read_json_file(USERS_FILE)
-    existing_user = next((u for u in users if u.get('email') == user_data['email']), None)
     
-    if existing_user:
+    try:
+        user = repository.create('users', user_data)
+    except DuplicateKeyError:
         return jsonify({'error': 'User with this email already exists'}), 400
-        
-    users.append(user_data)
-    write_json_file(USERS_FILE, users)
     
-    return jsonify(user_data), 201
+    return record_response(user, 201)
 
 @app.route('/users/<id>', methods=['PUT'])
 def update_user(id):
-    users = read_json_file(USERS_FILE)
-    user_index = next((i for i, u in enumerate(users) if u['_id'] == id), None)
+    user_data = request.json
     
-    if user_index is None:
-        return jsonify({'error': 'User not found'}), 404
+    # Validate required fields
+    if 'email' not in user_data or 'name' not in user_data:
+        return jsonify({'error': 'Email and name are required'}), 400
     
-    user_data = request.json
-    user_data['_id'] = id  # Ensure ID remains the same
-    user_data['updated_at'] = datetime.utcnow()
+    try:
+        updated_user = repository.replace('users', id, user_data)
+    except DuplicateKeyError:
+        return jsonify({'error': 'User with this email already exists'}), 400
     
-    # Update user
-    users[user_index] = user_data
-    write_json_file(USERS_FILE, users)
+    if updated_user is None:
+        return jsonify({'error': 'User not found'}), 404
     
-    return jsonify(user_data)
+    return record_response(updated_user)
+
+@app.route('/users/<id>', methods=['PATCH'])
+def patch_user(id):
+    return patch_response('users', 'User', id)
+
+@app.route('/users/<id>', methods=['DELETE'])
+def delete_user(id):
+    if repository.delete('users', id):
+        return jsonify({'message': 'User deleted successfully'})
+    return jsonify({'error': 'User not found'}), 404
 
 # Settings Routes
 @app.route('/settings/<user_id>', methods=['GET'])
+@conditional(versions, lambda user_id: [version_key('settings', user_id)], cache=response_cache)
 def get_settings(user_id):
-    settings = read_json_file(SETTINGS_FILE)
-    user_settings = next((s for s in settings if s.get('user_id') == user_id), None)
-    
-    if user_settings:
-        return jsonify(user_settings)
-    
-    # If settings don't exist, create default settings
-    default_settings = {
-        '_id': str(uuid.uuid4()),
-        'user_id': user_id,
-        'theme': 'light',
-        'notifications': True,
-        'autoSave': True,
-        'dataSync': False,
-        'created_at': datetime.utcnow(),
-        'updated_at': datetime.utcnow()
-    }
-    
-    settings.append(default_settings)
-    write_json_file(SETTINGS_FILE, settings)
-    
-    return jsonify(default_settings)
+    # Users without settings get the defaults
+    return jsonify(repository.get_settings(user_id))
 
 @app.route('/settings/<user_id>', methods=['PUT'])
 def update_settings(user_id):
-    settings = read_json_file(SETTINGS_FILE)
-    settings_index = next((i for i, s in enumerate(settings) if s.get('user_id') == user_id), None)
-    
-    settings_data = request.json
-    settings_data['updated_at'] = datetime.utcnow()
-    
-    if settings_index is not None:
-        # Update existing settings
-        settings_data['_id'] = settings[settings_index]['_id']  # Keep the same ID
-        settings[settings_index] = settings_data
-    else:
-        # Create new settings
-        settings_data['_id'] = str(uuid.uuid4())
-        settings_data['user_id'] = user_id
-        settings_data['created_at'] = datetime.utcnow()
-        settings.append(settings_data)
-    
-    write_json_file(SETTINGS_FILE, settings)
-    return jsonify(settings_data)
+    # Only the fields sent are changed
+    return jsonify(repository.update_settings(user_id, request.json))
+
+# Sync Routes
+@app.route('/sync', methods=['GET'])
+def get_sync():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    
+    try:
+        return jsonify(repository.changes(user_id, request.args.get('since')))
+    except SyncError as e:
+        return jsonify({'error': str(e)}), 400
+
+# Event Routes
+@app.route('/events', methods=['GET'])
+def get_events():
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'user_id is required'}), 400
+    
+    reminders.start()
+    subscriber = events.subscribe(user_id)
+    response = Response(events.stream(subscriber), mimetype='text/event-stream')
+    # The stream unsubscribes when it ends, but only once it has started; a
+    # response closed before the server iterates it would leak the subscriber
+    response.call_on_close(lambda: events.unsubscribe(subscriber))
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx and similar proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 # Statistics Routes
 @app.route('/statistics/<user_id>', methods=['GET'])
+@conditional(versions, lambda user_id: [version_key('tasks', user_id), version_key('goals', user_id)],
+             cache=response_cache)
 def get_statistics(user_id):
-    # Get tasks
-    tasks = read_json_file(TASKS_FILE)
-    user_tasks = [t for t in tasks if t.get('user_id') == user_id]
-    
-    # Get task statistics
-    total_tasks = len(user_tasks)
-    completed_tasks = len([t for t in user_tasks if t.get('completed')])
-    pending_tasks = total_tasks - completed_tasks
-    
-    # Get goals
-    goals = read_json_file(GOALS_FILE)
-    user_goals = [g for g in goals if g.get('user_id') == user_id]
-    
-    # Get goal statistics
-    total_goals = len(user_goals)
-    completed_goals = len([g for g in user_goals if g.get('completed')])
-    in_progress_goals = total_goals - completed_goals
-    
-    # Get tasks by category
-    category_counts = {}
-    for task in user_tasks:
-        category = task.get('category', 'Uncategorized')
-        category_counts[category] = category_counts.get(category, 0) + 1
-    
-    tasks_by_category = [{'_id': category, 'count': count} for category, count in category_counts.items()]
-    
-    # Get tasks by priority
-    priority_counts = {}
-    for task in user_tasks:
-        priority = task.get('priority', 'medium')
-        priority_counts[priority] = priority_counts.get(priority, 0) + 1
-    
-    tasks_by_priority = [{'_id': priority, 'count': count} for priority, count in priority_counts.items()]
-    
-    statistics = {
-        'tasks': {
-            'total': total_tasks,
-            'completed': completed_tasks,
-            'pending': pending_tasks,
-            'by_category': tasks_by_category,
-            'by_priority': tasks_by_priority
-        },
-        'goals': {
-            'total': total_goals,
-            'completed': completed_goals,
-            'in_progress': in_progress_goals
+    # Counters are maintained as tasks and goals change, so this is a lookup
+    return jsonify(repository.statistics(user_id))
+
+# Health Routes
+@app.route('/health', methods=['GET'])
+def get_health():
+    # The pool metrics help size TASKX_MONGO_MAX_POOL_SIZE against the number
+    # of worker threads
+    return jsonify({
+        'status': 'ok',
+        'backend': BACKEND,
+        'pool': repository.pool_stats(),
+        'caches': {
+            'responses': response_cache.stats() if response_cache is not None else None,
+            'compression': compressor.cache.stats()
         }
-    }
-    
-    return jsonify(statistics)
+    })
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    caches = {'compression': compressor.cache.stats()}
+    if response_cache is not None:
+        caches['responses'] = response_cache.stats()
+    body = metrics.render(BACKEND, caches, repository.pool_stats())
+    return Response(body, content_type=metrics.CONTENT_TYPE)
+
+# The slowest requests seen by the profiler (TASKX_SLOW_REQUEST_MS), with the
+# time they spent per stage
+@app.route('/metrics/slow', methods=['GET'])
+def get_slow_requests():
+    if request_metrics.slow_requests is None:
+        return jsonify({'error': 'The slow request profiler is off; set TASKX_SLOW_REQUEST_MS'}), 404
+    return jsonify(request_metrics.slow_requests.slowest())
+
+@app.cli.command('verify-statistics')
+@click.option('--rebuild', is_flag=True, help='Replace the counters with the recomputed values.')
+def verify_statistics(rebuild):
+    """Recompute the statistics counters and report any drift."""
+    drift = repository.verify_statistics(rebuild=rebuild)
+    for user_id, path, stored, actual in drift:
+        click.echo('%s %s: stored %d, actual %d' % (user_id, '.'.join(map(str, path)), stored, actual))
+    click.echo('%d counters drifted%s' % (len(drift), ', rebuilt' if rebuild and drift else ''))
+
+@app.cli.command('rebuild-progress')
+def rebuild_progress():
+    """Store the milestone progress of goals saved before the server computed it."""
+    click.echo('%d goals updated' % repository.rebuild_progress())
+
+@app.cli.command('explain-queries')
+@click.option('--user-id', default='default_user', show_default=True, help='User the sample queries are run for.')
+def explain_queries(user_id):
+    """Show the query plans behind the main routes and flag full scans."""
+    try:
+        plans = repository.explain_queries(user_id)
+    except NotImplementedError:
+        click.echo('The %s backend serves every query from in-memory indexes' % BACKEND)
+        return
+    
+    for label, plan, full_scan in plans:
+        click.echo('%s %s: %s' % ('SCAN' if full_scan else 'ok  ', label, plan))
+    scans = sum(1 for _, _, full_scan in plans if full_scan)
+    click.echo('%d of %d queries scan a whole collection' % (scans, len(plans)))
+    if scans:
+        raise SystemExit(1)
+
+@app.cli.command('import-json')
+@click.option('--data-dir', default=DATA_DIR, show_default=True, help='Directory holding the JSON data files.')
+def import_json(data_dir):
+    """Copy the JSON data files into the configured backend."""
+    source = JsonRepository(JsonStore(data_dir))
+    for name in COLLECTIONS:
+        existing = repository.count(name)
+        if existing:
+            click.echo('%s: skipped, the backend already holds %d records' % (name, existing))
+            continue
+        records = source.all(name)
+        repository.import_records(name, records)
+        click.echo('%s: imported %d records' % (name, len(records)))
 
 # Initialize database before starting the app
 if __name__ == '__main__':
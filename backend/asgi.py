@@ -0,0 +1,98 @@
+import asyncio
+import json
+import os
+from urllib.parse import parse_qs
+
+from a2wsgi import WSGIMiddleware
+
+import app as backend
+
+# ASGI entry point for production:
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+#
+# The regular routes are the Flask app's, run on a bounded thread pool so the
+# blocking file and MongoDB I/O stays off the event loop. GET /events is served
+# natively on the loop: an open stream costs a queue instead of a thread, so
+# one process can hold thousands of them. The storage backend is picked with
+# TASKX_BACKEND, as for app.py.
+
+WORKER_THREADS = int(os.environ.get('TASKX_WORKER_THREADS', '32'))
+
+backend.init_db()
+
+wsgi_app = WSGIMiddleware(backend.app, workers=WORKER_THREADS)
+
+async def send_json(send, status, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')]
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+async def events_route(scope, receive, send):
+    user_id = parse_qs(scope['query_string'].decode()).get('user_id', [None])[0]
+    if not user_id:
+        await send_json(send, 400, {'error': 'user_id is required'})
+        return
+
+    backend.reminders.start()
+    subscriber = backend.events.subscribe_async(user_id)
+    watcher = None
+    # The stream only unsubscribes once it has started (and an async
+    # generator left by an exception is finalized whenever the loop gets to
+    # it), so the subscriber is also dropped here
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                (b'access-control-allow-origin', b'*')
+            ]
+        })
+
+        # End the stream as soon as the client goes away instead of at the
+        # next heartbeat
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            subscriber.close()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        async for chunk in backend.events.async_stream(subscriber):
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        if not watcher.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        backend.events.unsubscribe(subscriber)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            backend.reminders.stop()
+            # Write out whatever the JSON store has not flushed yet
+            await asyncio.get_running_loop().run_in_executor(None, backend.repository.close)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/events' and scope['method'] == 'GET':
+        await events_route(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+if __name__ == '__main__':
+    import uvicorn
+    print("Starting ASGI server on http://localhost:5000")
+    uvicorn.run(app, host='0.0.0.0', port=5000)
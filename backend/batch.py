@@ -0,0 +1,42 @@
+# Shared request handling for the /tasks/batch and /goals/batch routes. A
+# batch is a list of operations, either sent bare or as {"operations": [...]}:
+#
+#   {"op": "create", "data": {...}}
+#   {"op": "update", "_id": "...", "data": {...}}
+#   {"op": "delete", "_id": "..."}
+#   {"op": "complete", "_id": "...", "completed": true}
+#
+# Each operation gets its own entry in the response, in request order.
+
+BATCH_OPS = ('create', 'update', 'delete', 'complete')
+MAX_BATCH_SIZE = 1000
+
+class BatchError(ValueError):
+    pass
+
+def parse_batch(payload):
+    operations = payload.get('operations') if isinstance(payload, dict) else payload
+    if not isinstance(operations, list):
+        raise BatchError('Expected a list of operations')
+    if len(operations) > MAX_BATCH_SIZE:
+        raise BatchError('A batch may contain at most %d operations' % MAX_BATCH_SIZE)
+    return operations
+
+# Returns an error message for a malformed operation, or None
+def check_operation(operation):
+    if not isinstance(operation, dict) or operation.get('op') not in BATCH_OPS:
+        return 'Operation must be one of: %s' % ', '.join(BATCH_OPS)
+    if operation['op'] != 'create' and not operation.get('_id'):
+        return '_id is required'
+    if operation['op'] in ('create', 'update'):
+        data = operation.get('data')
+        if not isinstance(data, dict):
+            return 'data is required'
+        if 'title' not in data:
+            return 'Title is required'
+    return None
+
+def batch_result(status, **fields):
+    result = {'status': status}
+    result.update(fields)
+    return result
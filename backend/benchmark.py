@@ -0,0 +1,494 @@
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Benchmarks for the API routes, in two steps:
+#
+#   python benchmark.py generate --backend json --data-dir /tmp/bench --users 100 --tasks 200 --goals 20
+#   python benchmark.py run --backend json --data-dir /tmp/bench --users 100 --tasks 200 --goals 20 \
+#       --client server --concurrency 1,8,32 --output results.json --baseline baseline.json
+#
+# `generate` fills a backend with a reproducible data set: N users with M
+# tasks and K goals each (goals carry milestones). Ids follow a fixed scheme,
+# so `run` only needs the same sizes to find its way around.
+#
+# `run` drives every route through the Flask test client (in this process)
+# or a real server started on a free port: `server` is the production ASGI
+# entry point (`uvicorn asgi:app`), `wsgi` the plain Flask app under
+# Werkzeug's threaded WSGI server, for comparison with a WSGI deployment. At
+# each concurrency level, every worker thread plays sessions for random users:
+# reads of every list and document route, followed by writes that create,
+# update and delete their own records, so the data set ends where it started.
+# Per-route p50/p95/p99 latency, throughput and peak RSS are written as JSON.
+# Given a baseline (an earlier output file), the p95s and throughputs are
+# compared and the exit status is 1 when any of them regressed beyond the
+# tolerance.
+#
+# `--backend memory` or `mongomock` with `--generate` runs entirely in one
+# process (test client only). GET /events is left out: a stream has no latency
+# to speak of.
+
+CATEGORIES = ['Work', 'Personal', 'Health', 'Finance', 'Learning', 'Home']
+PRIORITIES = ['low', 'medium', 'high']
+THEMES = ['light', 'dark']
+BASE_TIME = datetime(2025, 1, 1)
+
+def user_id(u):
+    return 'bench-user-%d' % u
+
+def user_email(u):
+    return 'user%d@bench.test' % u
+
+def task_id(u, t):
+    return 'bench-task-%d-%d' % (u, t)
+
+def goal_id(u, g):
+    return 'bench-goal-%d-%d' % (u, g)
+
+def due_date(rng):
+    return (BASE_TIME + timedelta(days=rng.randrange(365))).strftime('%Y-%m-%d')
+
+def sentence(rng, words):
+    vocabulary = ['plan', 'review', 'draft', 'call', 'update', 'prepare', 'check', 'write', 'send', 'fix',
+                  'meeting', 'report', 'budget', 'notes', 'slides', 'invoice', 'workout', 'course', 'garden']
+    return ' '.join(rng.choice(vocabulary) for _ in range(words)).capitalize()
+
+# Yields (collection, records) in chunks, so large data sets are never held in
+# memory all at once
+def generate_records(args):
+    rng = random.Random(args.seed)
+    for first in range(0, args.users, 100):
+        users, settings, tasks, goals = [], [], [], []
+        for u in range(first, min(first + 100, args.users)):
+            created = BASE_TIME + timedelta(minutes=u)
+            users.append({'_id': user_id(u), 'name': 'Bench User %d' % u, 'email': user_email(u),
+                          'created_at': created, 'updated_at': created})
+            settings.append({'_id': 'bench-settings-%d' % u, 'user_id': user_id(u), 'theme': rng.choice(THEMES),
+                             'notifications': True, 'autoSave': True, 'dataSync': False,
+                             'created_at': created, 'updated_at': created})
+            for t in range(args.tasks):
+                created = BASE_TIME + timedelta(minutes=u * args.tasks + t)
+                tasks.append({
+                    '_id': task_id(u, t),
+                    'title': sentence(rng, 4),
+                    'description': sentence(rng, 16),
+                    'completed': rng.random() < 0.3,
+                    'category': rng.choice(CATEGORIES),
+                    'priority': rng.choice(PRIORITIES),
+                    'dueDate': due_date(rng),
+                    'user_id': user_id(u),
+                    'created_at': created,
+                    'updated_at': created
+                })
+            for g in range(args.goals):
+                created = BASE_TIME + timedelta(minutes=u * args.goals + g)
+                goals.append({
+                    '_id': goal_id(u, g),
+                    'title': sentence(rng, 3),
+                    'description': sentence(rng, 12),
+                    'dueDate': due_date(rng),
+                    'color': '#1976d2',
+                    'category': rng.choice(CATEGORIES),
+                    'completed': rng.random() < 0.2,
+                    'user_id': user_id(u),
+                    'milestones': [{'id': m + 1, 'title': sentence(rng, 3), 'completed': rng.random() < 0.5,
+                                    'dueDate': due_date(rng)} for m in range(args.milestones)],
+                    'created_at': created,
+                    'updated_at': created
+                })
+        yield 'users', users
+        yield 'settings', settings
+        yield 'tasks', tasks
+        yield 'goals', goals
+
+# The backend is configured through the same environment variables as the
+# app, so they are set before repository.py or app.py is first imported
+def configure_backend(args):
+    os.environ['TASKX_BACKEND'] = 'mongo' if args.backend == 'mongomock' else args.backend
+    if args.data_dir:
+        os.environ['TASKX_DATA_DIR'] = args.data_dir
+        os.environ.setdefault('TASKX_SQLITE_PATH', os.path.join(args.data_dir, 'taskx.db'))
+    if args.backend == 'mongomock':
+        import mongomock
+        import database
+        database.MongoClient = mongomock.MongoClient
+
+def generate(args, repository=None):
+    if repository is None:
+        configure_backend(args)
+        from repository import create_repository
+        repository = create_repository(os.environ['TASKX_BACKEND'], os.environ.get('TASKX_DATA_DIR'))
+        owned = True
+    else:
+        owned = False
+
+    if repository.count('tasks') or repository.count('users'):
+        print('The %s backend already holds data; generate into an empty one' % args.backend)
+        return 1
+
+    started = time.perf_counter()
+    counts = {}
+    for name, records in generate_records(args):
+        repository.import_records(name, records)
+        counts[name] = counts.get(name, 0) + len(records)
+    if owned:
+        repository.close()
+    print('Generated %s in %.1fs' % (', '.join('%d %s' % (n, name) for name, n in counts.items()),
+                                     time.perf_counter() - started))
+    return 0
+
+# Helper function for paths that need the _id of a record the session created
+def created(results, label):
+    return results[label]['_id']
+
+# One session: the requests a user makes, as (label, method, path, body). The
+# label is the route template the latencies are grouped under. Paths that
+# depend on an earlier response are callables taking the results so far.
+def session(rng, args):
+    u = rng.randrange(args.users)
+    uid = user_id(u)
+    task = task_id(u, rng.randrange(args.tasks)) if args.tasks else None
+    goal = goal_id(u, rng.randrange(args.goals)) if args.goals else None
+    new_task = {'title': 'Benchmark task', 'category': rng.choice(CATEGORIES), 'priority': 'medium',
+                'dueDate': due_date(rng), 'completed': False, 'user_id': uid}
+    new_goal = {'title': 'Benchmark goal', 'category': rng.choice(CATEGORIES), 'dueDate': due_date(rng),
+                'completed': False, 'milestones': [], 'user_id': uid}
+    new_user = {'name': 'Benchmark user', 'email': 'bench-%s@bench.test' % rng.getrandbits(64)}
+
+    steps = [
+        ('GET /tasks', 'GET', '/tasks?user_id=%s' % uid, None),
+        ('GET /tasks?completed&sort&limit', 'GET', '/tasks?user_id=%s&completed=false&sort=dueDate&limit=50' % uid, None),
+        ('GET /tasks?category', 'GET', '/tasks?user_id=%s&category=%s' % (uid, rng.choice(CATEGORIES)), None),
+        ('GET /goals', 'GET', '/goals?user_id=%s' % uid, None),
+        ('GET /users', 'GET', '/users', None),
+        ('GET /users/<email>', 'GET', '/users/%s' % user_email(u), None),
+        ('GET /settings/<user_id>', 'GET', '/settings/%s' % uid, None),
+        ('GET /statistics/<user_id>', 'GET', '/statistics/%s' % uid, None),
+        ('GET /sync', 'GET', '/sync?user_id=%s' % uid, None),
+        ('GET /health', 'GET', '/health', None),
+        ('PUT /settings/<user_id>', 'PUT', '/settings/%s' % uid, {'theme': rng.choice(THEMES)}),
+        ('POST /tasks', 'POST', '/tasks', new_task),
+        ('PUT /tasks/<id>', 'PUT', lambda r: '/tasks/%s' % created(r, 'POST /tasks'), dict(new_task, completed=True)),
+        ('PATCH /tasks/<id>', 'PATCH', lambda r: '/tasks/%s' % created(r, 'POST /tasks'), {'completed': False}),
+        ('DELETE /tasks/<id>', 'DELETE', lambda r: '/tasks/%s' % created(r, 'POST /tasks'), None),
+        ('POST /tasks/batch', 'POST', '/tasks/batch', {'operations': [{'op': 'create', 'data': new_task}] * 2}),
+        ('POST /goals', 'POST', '/goals', new_goal),
+        ('PUT /goals/<id>', 'PUT', lambda r: '/goals/%s' % created(r, 'POST /goals'), dict(new_goal, completed=True)),
+        ('DELETE /goals/<id>', 'DELETE', lambda r: '/goals/%s' % created(r, 'POST /goals'), None),
+        ('POST /users', 'POST', '/users', new_user),
+        ('PUT /users/<id>', 'PUT', lambda r: '/users/%s' % created(r, 'POST /users'), dict(new_user, name='Renamed')),
+        ('DELETE /users/<id>', 'DELETE', lambda r: '/users/%s' % created(r, 'POST /users'), None)
+    ]
+    if task:
+        steps.insert(1, ('GET /tasks/<id>', 'GET', '/tasks/%s' % task, None))
+    if goal:
+        steps.insert(1, ('GET /goals/<id>', 'GET', '/goals/%s' % goal, None))
+    return steps
+
+# Undoes the batch creates, outside the measured requests
+def cleanup(send, results):
+    batch = results.get('POST /tasks/batch')
+    if batch:
+        operations = [{'op': 'delete', '_id': result['_id']} for result in batch['results'] if result.get('_id')]
+        send('POST', '/tasks/batch', {'operations': operations})
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, method, path, body):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+class HTTPTransport:
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def send(self, method, path, body):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        self.connection.request(method, path, body=data, headers=headers)
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        self.connection.close()
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(math.ceil(p / 100.0 * len(values))) - 1))]
+
+def summarize(samples, errors):
+    routes = {}
+    for label in sorted(set(samples) | set(errors)):
+        values = sorted(samples.get(label, []))
+        routes[label] = {
+            'count': len(values),
+            'errors': errors.get(label, 0),
+            'mean_ms': round(sum(values) / len(values) * 1000, 3) if values else None,
+            'p50_ms': round(percentile(values, 50) * 1000, 3) if values else None,
+            'p95_ms': round(percentile(values, 95) * 1000, 3) if values else None,
+            'p99_ms': round(percentile(values, 99) * 1000, 3) if values else None
+        }
+    return routes
+
+# Runs `sessions` sessions spread over `concurrency` threads
+def run_level(make_transport, args, concurrency):
+    samples = {}
+    errors = {}
+    lock = threading.Lock()
+    remaining = [args.sessions]
+
+    def worker(index):
+        rng = random.Random('%s-%d-%d' % (args.seed, concurrency, index))
+        transport = make_transport()
+        mine = {}
+        failed = {}
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+                results = {}
+                for label, method, path, body in session(rng, args):
+                    if callable(path):
+                        try:
+                            path = path(results)
+                        except (KeyError, TypeError):
+                            # The create it depends on failed
+                            failed[label] = failed.get(label, 0) + 1
+                            continue
+                    started = time.perf_counter()
+                    status, data = transport.send(method, path, body)
+                    elapsed = time.perf_counter() - started
+                    if status >= 400:
+                        failed[label] = failed.get(label, 0) + 1
+                        continue
+                    mine.setdefault(label, []).append(elapsed)
+                    if method == 'POST':
+                        results[label] = json.loads(data)
+                cleanup(transport.send, results)
+        finally:
+            transport.close()
+            with lock:
+                for label, values in mine.items():
+                    samples.setdefault(label, []).extend(values)
+                for label, n in failed.items():
+                    errors[label] = errors.get(label, 0) + n
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in samples.values())
+    return {
+        'concurrency': concurrency,
+        'sessions': args.sessions,
+        'requests': total,
+        'errors': sum(errors.values()),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(total / elapsed, 1) if elapsed else None,
+        'routes': summarize(samples, errors)
+    }
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(args):
+    port = free_port()
+    env = dict(os.environ)
+    if args.client == 'wsgi':
+        command = ['-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1', '--port', str(port),
+                   '--with-threads', '--no-reload', '--no-debugger']
+    else:
+        command = ['-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning']
+    # Werkzeug logs every request to stderr, which would drown the report
+    process = subprocess.Popen(
+        [sys.executable] + command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stderr=subprocess.DEVNULL if args.client == 'wsgi' else None
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The server exited with status %d' % process.returncode)
+        try:
+            transport = HTTPTransport(port)
+            status, _ = transport.send('GET', '/health', None)
+            transport.close()
+            if status == 200:
+                return process, port
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('The server did not start within 30 seconds')
+
+# Peak resident set size in MiB, from /proc on Linux
+def peak_rss_mb(pid=None):
+    if pid is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return round(rss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return None
+
+# Lists (metric, baseline, current, change) for every p95 and throughput that
+# got worse by more than the tolerance. Routes with few samples are skipped.
+def compare(baseline, current, tolerance):
+    regressions = []
+    levels = {level['concurrency']: level for level in baseline['levels']}
+    for level in current['levels']:
+        before = levels.get(level['concurrency'])
+        if before is None:
+            continue
+        name = 'c=%d' % level['concurrency']
+        if before['throughput_rps'] and level['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(('%s throughput_rps' % name, before['throughput_rps'], level['throughput_rps']))
+        for label, stats in level['routes'].items():
+            old = before['routes'].get(label)
+            if not old or not old['p95_ms'] or not stats['p95_ms'] or min(old['count'], stats['count']) < 10:
+                continue
+            if stats['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+                regressions.append(('%s %s p95_ms' % (name, label), old['p95_ms'], stats['p95_ms']))
+    return regressions
+
+def run(args):
+    configure_backend(args)
+    levels = [int(c) for c in args.concurrency.split(',')]
+    server = None
+    if args.client in ('server', 'wsgi'):
+        if args.generate or args.backend in ('memory', 'mongomock'):
+            print('A server run needs data generated beforehand into a json, sqlite or mongo backend')
+            return 1
+        server, port = start_server(args)
+        make_transport = lambda: HTTPTransport(port)
+    else:
+        import app
+        if args.generate and generate(args, app.repository):
+            return 1
+        make_transport = lambda: TestClientTransport(app.app)
+
+    results = {
+        'meta': {
+            'backend': args.backend,
+            'client': args.client,
+            'users': args.users,
+            'tasks_per_user': args.tasks,
+            'goals_per_user': args.goals,
+            'milestones_per_goal': args.milestones,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'started_at': datetime.utcnow().isoformat() + 'Z'
+        },
+        'levels': []
+    }
+    try:
+        for concurrency in levels:
+            level = run_level(make_transport, args, concurrency)
+            results['levels'].append(level)
+            print('concurrency %3d: %6d requests, %4d errors, %8.1f req/s' % (
+                concurrency, level['requests'], level['errors'], level['throughput_rps'] or 0))
+        results['peak_rss_mb'] = peak_rss_mb(server.pid if server else None)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.verbose:
+        for level in results['levels']:
+            print('\nconcurrency %d' % level['concurrency'])
+            for label, stats in level['routes'].items():
+                print('  %-36s p50 %8s  p95 %8s  p99 %8s ms  (%d, %d errors)' % (
+                    label, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['count'], stats['errors']))
+    print('peak RSS: %s MiB' % results['peak_rss_mb'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results written to %s' % args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        for metric, before, after in regressions:
+            print('REGRESSION %s: %s -> %s' % (metric, before, after))
+        if regressions:
+            return 1
+        print('No regressions against %s (tolerance %d%%)' % (args.baseline, args.tolerance * 100))
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Data generator and load benchmark for the API routes')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name in ('generate', 'run'):
+        command = commands.add_parser(name)
+        command.add_argument('--backend', choices=['json', 'memory', 'sqlite', 'mongo', 'mongomock'], default='json')
+        command.add_argument('--data-dir', help='data directory (json) or directory of taskx.db (sqlite)')
+        command.add_argument('--users', type=int, default=100)
+        command.add_argument('--tasks', type=int, default=100, help='tasks per user')
+        command.add_argument('--goals', type=int, default=10, help='goals per user')
+        command.add_argument('--milestones', type=int, default=5, help='milestones per goal')
+        command.add_argument('--seed', type=int, default=42)
+    run_parser = commands.choices['run']
+    run_parser.add_argument('--client', choices=['test', 'server', 'wsgi'], default='test',
+                            help='Flask test client in this process, uvicorn asgi:app in a child process, '
+                                 'or the Flask app under Werkzeug\'s threaded WSGI server in a child process')
+    run_parser.add_argument('--concurrency', default='1,8,32', help='comma-separated thread counts')
+    run_parser.add_argument('--sessions', type=int, default=100, help='sessions per concurrency level')
+    run_parser.add_argument('--generate', action='store_true', help='generate the data set first (test client only)')
+    run_parser.add_argument('--output', help='write the results as JSON')
+    run_parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    run_parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, as a fraction')
+    run_parser.add_argument('--verbose', action='store_true', help='print per-route latencies')
+    args = parser.parse_args()
+
+    if args.backend in ('json', 'sqlite') and not args.data_dir:
+        # The data set has to outlive this command unless it is generated and
+        # used in the same run; the app's own data directory is never used
+        if args.command == 'generate' or not args.generate:
+            parser.error('--data-dir is required for the %s backend' % args.backend)
+        args.data_dir = tempfile.mkdtemp(prefix='taskx-bench-')
+        print('Using data directory %s' % args.data_dir)
+    if args.command == 'generate':
+        if args.backend in ('memory', 'mongomock'):
+            print('The %s backend lives in one process; use `run --generate` instead' % args.backend)
+            return 1
+        return generate(args)
+    return run(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
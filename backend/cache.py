@@ -0,0 +1,57 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Memory budget of the cache of serialized read responses (see conditional.py);
+# 0 turns it off
+RESPONSE_CACHE_BYTES = int(os.environ.get('TASKX_RESPONSE_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+# Least-recently-used cache bounded by the total size of its values. Every
+# entry is stored with a version (an ETag, a checksum); a lookup with any
+# other version is a miss, and storing a new version replaces the old one, so
+# an entry never outlives the data it was built from.
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> (version, value, size), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            self.entries[key] = (version, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,97 @@
+import gzip
+import os
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+import metrics
+from cache import LRUCache
+from conditional import coded_etag
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response compression for the JSON routes. The encoding is negotiated from
+# Accept-Encoding (brotli when the `brotli` package is installed, else gzip),
+# and bodies below COMPRESS_MIN_SIZE are sent as they are, since the headers
+# would outweigh the saving.
+COMPRESS_MIN_SIZE = int(os.environ.get('TASKX_COMPRESS_MIN_SIZE', '1024'))
+
+# Compressed bodies of responses with an ETag are kept up to this many bytes,
+# so polling an unchanged list costs a lookup instead of a recompression
+COMPRESS_CACHE_BYTES = int(os.environ.get('TASKX_COMPRESS_CACHE_BYTES', str(16 * 1024 * 1024)))
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson')
+
+# Moderate levels: these run on every request, not once at build time
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+ENCODERS = OrderedDict()
+if brotli is not None:
+    ENCODERS['br'] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+# mtime=0 keeps the output identical for identical bodies
+ENCODERS['gzip'] = lambda data: gzip.compress(data, GZIP_LEVEL, mtime=0)
+
+def encode(encoding, data):
+    with metrics.timed('codec', encoding):
+        return ENCODERS[encoding](data)
+
+# Installed with Compressor(app); compresses responses in an after_request
+# hook. Streamed responses (see stream_response in app.py) and event streams
+# are left alone.
+class Compressor:
+    def __init__(self, app=None, min_size=COMPRESS_MIN_SIZE, cache_bytes=COMPRESS_CACHE_BYTES):
+        self.min_size = min_size
+        # (path, query string, etag, encoding) -> compressed body, stored with
+        # a checksum of the uncompressed body as its version
+        self.cache = LRUCache(cache_bytes)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.compress)
+
+    def compress(self, response):
+        if response.status_code == 304:
+            # A 304 carries the Vary header the full response would have
+            response.vary.add('Accept-Encoding')
+            return response
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(list(ENCODERS))
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        etag, weak = response.get_etag()
+        if etag is None:
+            body = encode(encoding, data)
+        else:
+            body = self.cached((request.path, request.query_string, etag, encoding), data)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # A strong ETag promises identical bytes, so each encoding gets its
+        # own (see coded_etag in conditional.py). A weak one only promises
+        # the same content, which every encoding has.
+        if etag is not None and not weak:
+            response.set_etag(coded_etag(etag, encoding))
+        return response
+
+    # The body is checked against a checksum as well as the ETag, so a change
+    # that did not bump a version counter never gets a stale body
+    def cached(self, key, data):
+        crc = zlib.crc32(data)
+        body = self.cache.get(key, crc)
+        if body is None:
+            body = encode(key[-1], data)
+            self.cache.put(key, crc, body, len(body))
+        return body
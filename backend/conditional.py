@@ -0,0 +1,154 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+from jsoncodec import default
+
+# Version counters behind the ETag / Last-Modified headers of the read routes.
+# Every collection has a counter, and so does every (collection, user_id)
+# pair; a mutation bumps the collection's counter and those of the users
+# whose records it touched. A GET whose validators still match is answered
+# with 304 before any data is read or serialized.
+
+def version_key(name, user_id=None):
+    return name if user_id is None else '%s:%s' % (name, user_id)
+
+def version_keys(name, records):
+    keys = [name]
+    for record in records:
+        if record is not None and record.get('user_id') is not None:
+            key = version_key(name, record['user_id'])
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+# In-process counters for the JSON backend. They only mean something inside
+# this process, so the ETags carry a random token: after a restart (or on
+# another worker) old ETags simply stop matching.
+class VersionTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token = uuid.uuid4().hex[:8]
+        self.versions = {}
+        self.collections = {}
+
+    def watch(self, name, collection):
+        self.collections[name] = collection
+        collection.listeners.append(lambda old, new: self.bump(name, old, new))
+
+    def bump(self, name, *records):
+        now = time.time()
+        with self.lock:
+            for key in version_keys(name, records):
+                version = self.versions.get(key, (0, None))[0]
+                self.versions[key] = (version + 1, now)
+
+    # Returns a (version, modified timestamp) pair per key
+    def get(self, keys):
+        # Make sure the collections are loaded and have caught up with other
+        # processes, so the counters reflect what a read would return
+        for name in set(key.split(':', 1)[0] for key in keys):
+            self.collections[name].count()
+        with self.lock:
+            return [self.versions.get(key, (0, None)) for key in keys]
+
+# Route decorator. `keys` receives the view arguments and returns the version
+# keys the response depends on; the query string is folded into the ETag so
+# every filtered view gets its own.
+#
+# With a `cache` (an LRUCache, see cache.py) the serialized body is kept
+# under the path and query string with the ETag as its version. The ETag
+# changes whenever one of the counters does, so a cached response is served
+# until the user's data changes and never after. Versions are read before the
+# view runs, so a body can only be newer than its ETag, never older.
+def conditional(tracker, keys, cache=None):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = tracker.get(keys(*args, **kwargs))
+            parts = [tracker.token] + [str(version) for version, _ in versions]
+            parts.append('%08x' % zlib.crc32(request.query_string))
+            etag = '-'.join(part for part in parts if part)
+            modified = max((m for _, m in versions if m is not None), default=None)
+            # Last-Modified only has second resolution. While the second of the
+            # last change is still running, another change can land in it
+            # without moving the header, so it is left out until then and
+            # revalidation goes by the ETag.
+            last_modified = None
+            if modified is not None and int(modified) < int(time.time()):
+                last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+
+            # If-None-Match takes precedence: when it is sent, If-Modified-Since
+            # is ignored. A date matches only if the last change's second is
+            # over and not after it, so no later change can share its second.
+            if 'If-None-Match' in request.headers:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                fresh = (last_modified is not None and request.if_modified_since is not None
+                         and last_modified <= request.if_modified_since)
+            cache_key = (request.path, request.query_string)
+            cached = cache.get(cache_key, etag) if cache is not None and not fresh else None
+            if fresh:
+                response = make_response('', 304)
+            elif cached is not None:
+                body, headers = cached
+                response = current_app.response_class(body, headers=headers)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if cache is not None and not response.is_streamed:
+                    body = response.get_data()
+                    headers = [(k, v) for k, v in response.headers if k != 'Content-Length']
+                    cache.put(cache_key, etag, (body, headers), len(body))
+
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # Let browsers keep the body but revalidate it on every request
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+# Strong ETag of a single record, used by GET /<collection>/<id> and checked
+# against If-Match by PATCH. It hashes the content with sorted keys, so it
+# does not depend on the order a backend returns the fields in.
+def record_etag(record):
+    data = json.dumps(record, default=default, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=8).hexdigest()
+
+# The compressor gives each encoding of a strong ETag its own tag, with the
+# content coding appended (see compression.py): the bytes differ, so a strong
+# ETag must too. A client may send any of them back for the same record.
+ETAG_CODINGS = ('br', 'gzip')
+
+def coded_etag(etag, encoding):
+    return '%s-%s' % (etag, encoding)
+
+# The tag in `etags` (a request's If-Match or If-None-Match) that names this
+# record in some encoding, or None. If-None-Match compares weakly.
+def matching_etag(etags, record, weak=False):
+    etag = record_etag(record)
+    for tag in [etag] + [coded_etag(etag, encoding) for encoding in ETAG_CODINGS]:
+        if etags.contains_weak(tag) if weak else etags.contains(tag):
+            return tag
+    return None
+
+# Raised by a repository's patch() when If-Match names another version
+class PreconditionFailed(Exception):
+    def __init__(self, record):
+        super().__init__('Precondition failed')
+        self.record = record
+
+# `if_match` is request.if_match, or None when the header was not sent
+def check_if_match(if_match, record):
+    if if_match is not None and matching_etag(if_match, record) is None:
+        raise PreconditionFailed(record)
@@ -1,261 +1,814 @@
-from flask import Flask, jsonify, request
-from flask_pymongo import PyMongo
-from flask_cors import CORS
+from pymongo import (ASCENDING, DeleteOne, IndexModel, InsertOne, MongoClient, ReadPreference, ReplaceOne,
+                     ReturnDocument, UpdateOne)
+from pymongo.errors import BulkWriteError, DuplicateKeyError as MongoDuplicateKeyError, OperationFailure
 from bson.objectid import ObjectId
-import json
-from datetime import datetime
+from bson.errors import InvalidId
+from pymongo.common import MAX_POOL_SIZE
+from pymongo.monitoring import CommandListener, ConnectionPoolListener
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+from batch import batch_result, check_operation
+from conditional import check_if_match, version_keys
+from events import EventBroker
+import metrics
+from milestones import apply_operation, goal_progress, milestone_list, with_progress
+from queries import DATE_FIELDS, encode_cursor, parse_dates, parse_list_query
+from repository import (AUDIT_LIST_QUERIES, DEFAULT_SETTINGS, STREAM_BATCH_SIZE, Repository, client_fields,
+                        patch_changes, settings_fields)
+from stats import (apply_delta, contribution_delta, diff_counters, format_statistics,
+                   from_mongo_document, goal_contribution, task_contribution, to_mongo_document,
+                   to_mongo_path)
+from storage import DuplicateKeyError
+from sync import SYNC_COLLECTIONS, SyncError, sync_response
 
-# MongoDB connection setup
-app = Flask(__name__)
-CORS(app)
+# MongoDB configuration; the database name comes from the URI
+MONGO_URI = os.environ.get('TASKX_MONGO_URI', 'mongodb://localhost:27017/taskmanager')
 
-# MongoDB configuration
-app.config["MONGO_URI"] = "mongodb://localhost:27017/taskmanager"
-mongo = PyMongo(app)
+# Connection pool, timeout and wire compression settings. An option whose
+# variable is unset is left to the URI, then to PyMongo's default.
+CLIENT_OPTIONS = {
+    'maxPoolSize': 'TASKX_MONGO_MAX_POOL_SIZE',
+    'minPoolSize': 'TASKX_MONGO_MIN_POOL_SIZE',
+    'waitQueueTimeoutMS': 'TASKX_MONGO_WAIT_QUEUE_TIMEOUT_MS',
+    'serverSelectionTimeoutMS': 'TASKX_MONGO_SERVER_SELECTION_TIMEOUT_MS',
+    'compressors': 'TASKX_MONGO_COMPRESSORS'
+}
 
-# Helper function to convert MongoDB ObjectId to string for JSON serialization
-class JSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return json.JSONEncoder.default(self, obj)
+# Where GET /tasks, /goals and /statistics read from. Secondaries may lag
+# behind the primary, so those reads can miss the latest writes; every other
+# read and all writes go to the primary.
+READ_PREFERENCE = os.environ.get('TASKX_MONGO_READ_PREFERENCE', 'primary')
 
-app.json_encoder = JSONEncoder
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
 
-# Task Routes
-@app.route('/tasks', methods=['GET'])
-def get_tasks():
-    tasks = list(mongo.db.tasks.find())
-    return jsonify(tasks)
+# How each task or goal counts towards the statistics counters
+CONTRIBUTIONS = {'tasks': task_contribution, 'goals': goal_contribution}
 
-@app.route('/tasks/<id>', methods=['GET'])
-def get_task(id):
-    task = mongo.db.tasks.find_one({'_id': ObjectId(id)})
-    if task:
-        return jsonify(task)
-    return jsonify({'error': 'Task not found'}), 404
+# The fields each task or goal contribution depends on. verify_statistics
+# groups the records on them inside MongoDB, so only one document per distinct
+# combination comes back instead of every record. A missing field is left out
+# of the group key, so the contribution falls back to the same defaults.
+COUNTER_FIELDS = {
+    'tasks': ('user_id', 'completed', 'category', 'priority'),
+    'goals': ('user_id', 'completed')
+}
 
-@app.route('/tasks', methods=['POST'])
-def add_task():
-    task_data = request.json
-    task_data['created_at'] = datetime.utcnow()
-    task_data['updated_at'] = datetime.utcnow()
-    
-    # Validate required fields
-    if 'title' not in task_data:
-        return jsonify({'error': 'Title is required'}), 400
-        
-    result = mongo.db.tasks.insert_one(task_data)
-    task_data['_id'] = str(result.inserted_id)
-    
-    return jsonify(task_data), 201
+# Indexes created on startup, one list of (keys, options) per collection.
+# They cover the list filters, the email and settings lookups, the sync
+# queries and the statistics counters. The due date indexes carry
+# `completed` so open tasks in a due date range are found without fetching
+# the documents; the one without user_id serves the reminder scheduler.
+INDEXES = {
+    'tasks': [
+        (['user_id', 'completed'], {}),
+        (['user_id', 'category'], {}),
+        (['user_id', 'priority'], {}),
+        (['user_id', 'dueDate', 'completed'], {}),
+        (['dueDate', 'completed'], {}),
+        (['user_id', '_seq'], {})
+    ],
+    'goals': [
+        (['user_id', 'completed'], {}),
+        (['user_id', 'category'], {}),
+        (['user_id', 'dueDate', 'completed'], {}),
+        (['user_id', '_seq'], {})
+    ],
+    'users': [(['email'], {'unique': True})],
+    'settings': [(['user_id'], {'unique': True})],
+    'statistics': [(['user_id'], {'unique': True})],
+    'tombstones': [(['user_id', '_seq'], {})],
+    # Leases left behind by a crashed process are removed by MongoDB
+    'sequence_leases': [(['at'], {'expireAfterSeconds': 3600})]
+}
 
-@app.route('/tasks/<id>', methods=['PUT'])
-def update_task(id):
-    task_data = request.json
-    task_data['updated_at'] = datetime.utcnow()
-    
-    # Validate required fields
-    if 'title' not in task_data:
-        return jsonify({'error': 'Title is required'}), 400
-        
-    result = mongo.db.tasks.update_one(
-        {'_id': ObjectId(id)},
-        {'$set': task_data}
-    )
-    
-    if result.matched_count:
-        updated_task = mongo.db.tasks.find_one({'_id': ObjectId(id)})
-        return jsonify(updated_task)
-    return jsonify({'error': 'Task not found'}), 404
+# How long a sequence lease (see MongoRepository.sequence) holds GET /sync
+# back. A write that takes longer is assumed to have died with its process.
+SEQUENCE_LEASE_SECONDS = 60
 
-@app.route('/tasks/<id>', methods=['DELETE'])
-def delete_task(id):
-    result = mongo.db.tasks.delete_one({'_id': ObjectId(id)})
-    if result.deleted_count:
-        return jsonify({'message': 'Task deleted successfully'})
-    return jsonify({'error': 'Task not found'}), 404
+logger = logging.getLogger(__name__)
 
-# Goal Routes
-@app.route('/goals', methods=['GET'])
-def get_goals():
-    goals = list(mongo.db.goals.find())
-    return jsonify(goals)
+# BSON dates have millisecond precision. Timestamps are truncated up front so
+# the record a write returns matches what later reads return.
+def utcnow():
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
 
-@app.route('/goals/<id>', methods=['GET'])
-def get_goal(id):
-    goal = mongo.db.goals.find_one({'_id': ObjectId(id)})
-    if goal:
-        return jsonify(goal)
-    return jsonify({'error': 'Goal not found'}), 404
+# Helper function to read CLIENT_OPTIONS from the environment
+def client_options():
+    options = {}
+    for option, variable in CLIENT_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            # e.g. TASKX_MONGO_COMPRESSORS=zstd,snappy (needs the zstandard or
+            # python-snappy package; unavailable compressors are skipped)
+            options[option] = value if option == 'compressors' else int(value)
+    return options
 
-@app.route('/goals', methods=['POST'])
-def add_goal():
-    goal_data = request.json
-    goal_data['created_at'] = datetime.utcnow()
-    goal_data['updated_at'] = datetime.utcnow()
-    
-    # Validate required fields
-    if 'title' not in goal_data:
-        return jsonify({'error': 'Title is required'}), 400
-        
-    result = mongo.db.goals.insert_one(goal_data)
-    goal_data['_id'] = str(result.inserted_id)
+# Connection pool metrics, fed by PyMongo's pool events. A checkout runs on
+# the thread that needs the connection, so its wait is timed per thread.
+class PoolMonitor(ConnectionPoolListener):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        # Known once the client has created its first pool
+        self.max_pool_size = None
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'connections_open': self.open,
+                'connections_checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'failed_checkouts': self.failed_checkouts,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+                'max_pool_size': self.max_pool_size
+            }
+    
+    def waited(self):
+        started = getattr(self.local, 'started', None)
+        self.local.started = None
+        return time.monotonic() - started if started is not None else 0.0
+    
+    def connection_check_out_started(self, event):
+        self.local.started = time.monotonic()
+    
+    def connection_checked_out(self, event):
+        wait = self.waited()
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+    
+    def connection_check_out_failed(self, event):
+        wait = self.waited()
+        with self.lock:
+            self.failed_checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+    
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_out -= 1
     
-    return jsonify(goal_data), 201
+    def connection_created(self, event):
+        with self.lock:
+            self.open += 1
+    
+    def connection_closed(self, event):
+        with self.lock:
+            self.open -= 1
+    
+    def connection_ready(self, event):
+        pass
+    
+    def pool_created(self, event):
+        # The event only lists options that differ from the defaults
+        self.max_pool_size = event.options.get('maxPoolSize', MAX_POOL_SIZE)
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
 
-@app.route('/goals/<id>', methods=['PUT'])
-def update_goal(id):
-    goal_data = request.json
-    goal_data['updated_at'] = datetime.utcnow()
-    
-    # Validate required fields
-    if 'title' not in goal_data:
-        return jsonify({'error': 'Title is required'}), 400
-        
-    result = mongo.db.goals.update_one(
-        {'_id': ObjectId(id)},
-        {'$set': goal_data}
-    )
-    
-    if result.matched_count:
-        updated_goal = mongo.db.goals.find_one({'_id': ObjectId(id)})
-        return jsonify(updated_goal)
-    return jsonify({'error': 'Goal not found'}), 404
+# Times every command sent to the server for GET /metrics (see metrics.py).
+# The events fire on the thread that ran the command, so the time also shows
+# up in that request's profile.
+class CommandMonitor(CommandListener):
+    def started(self, event):
+        pass
+    
+    def succeeded(self, event):
+        metrics.observe('mongo', event.command_name, event.duration_micros / 1e6)
+    
+    def failed(self, event):
+        metrics.observe('mongo', event.command_name, event.duration_micros / 1e6)
 
-@app.route('/goals/<id>', methods=['DELETE'])
-def delete_goal(id):
-    result = mongo.db.goals.delete_one({'_id': ObjectId(id)})
-    if result.deleted_count:
-        return jsonify({'message': 'Goal deleted successfully'})
-    return jsonify({'error': 'Goal not found'}), 404
+# Helper function to turn an _id from a URL or cursor back into the stored
+# type; records seeded from the sample data keep their string ids
+def to_object_id(id):
+    try:
+        return ObjectId(id)
+    except (InvalidId, TypeError):
+        return id
 
-# User Routes
-@app.route('/users', methods=['GET'])
-def get_users():
-    users = list(mongo.db.users.find())
-    return jsonify(users)
+# Helper function to hand a document to the routes with a string _id. The
+# _seq sync stamp is internal (changes() reads it from the documents), so
+# records look the same as on the other backends.
+def to_record(document):
+    if document is None:
+        return None
+    record = dict(document, _id=str(document['_id']))
+    record.pop('_seq', None)
+    return record
 
-@app.route('/users/<id>', methods=['GET'])
-def get_user(id):
-    user = mongo.db.users.find_one({'_id': ObjectId(id)})
-    if user:
-        return jsonify(user)
-    return jsonify({'error': 'User not found'}), 404
+# Version counters behind the ETag / Last-Modified headers, kept in the
+# versions collection so every worker process sees the same values
+class MongoVersionTracker:
+    token = ''
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def bump(self, name, *records):
+        requests = [UpdateOne({'_id': key}, {'$inc': {'version': 1}, '$currentDate': {'modified': True}}, upsert=True)
+                    for key in version_keys(name, records)]
+        self.db.versions.bulk_write(requests, ordered=False)
+    
+    def get(self, keys):
+        documents = {doc['_id']: doc for doc in self.db.versions.find({'_id': {'$in': keys}})}
+        versions = []
+        for key in keys:
+            doc = documents.get(key)
+            if doc is None:
+                versions.append((0, None))
+            else:
+                versions.append((doc['version'], doc['modified'].replace(tzinfo=timezone.utc).timestamp()))
+        return versions
+
+# Helper function to translate a parsed list query into find() arguments, so
+# filtering, sorting and paging all happen inside MongoDB
+def build_find(query):
+    criteria = dict(query['filters'])
+    if query['completed'] is not None:
+        criteria['completed'] = True if query['completed'] else {'$ne': True}
+    
+    if query['due_after'] is not None or query['due_before'] is not None:
+        # $gt '' also skips tasks without a due date
+        due_date = {'$gt': query['due_after'] or ''}
+        if query['due_before'] is not None:
+            due_date['$lt'] = query['due_before']
+        criteria['dueDate'] = due_date
+    
+    direction = -1 if query['descending'] else 1
+    sort = [('_id', direction)]
+    if query['sort']:
+        sort.insert(0, (query['sort'], direction))
+    
+    cursor = query['cursor']
+    if cursor:
+        op = '$lt' if query['descending'] else '$gt'
+        last_id = to_object_id(cursor['_id'])
+        field = query['sort']
+        if not field:
+            after = {'_id': {op: last_id}}
+        else:
+            value = cursor.get('value')
+            if field in DATE_FIELDS and value is not None:
+                value = datetime.fromisoformat(value)
+            if value is None:
+                # Missing values sort before everything else
+                after = [{field: None, '_id': {op: last_id}}]
+                if not query['descending']:
+                    after.append({field: {'$ne': None}})
+            else:
+                after = [{field: {op: value}}, {field: value, '_id': {op: last_id}}]
+                if query['descending']:
+                    after.append({field: None})
+            after = {'$or': after}
+        criteria = {'$and': [criteria, after]}
+    
+    projection = None
+    if query['fields']:
+        projection = {field: 1 for field in query['fields']}
+    
+    return criteria, projection, sort
 
-@app.route('/users', methods=['POST'])
-def add_user():
-    user_data = request.json
-    user_data['created_at'] = datetime.utcnow()
-    user_data['updated_at'] = datetime.utcnow()
-    
-    # Validate required fields
-    if 'email' not in user_data or 'name' not in user_data:
-        return jsonify({'error': 'Email and name are required'}), 400
+# Helper function to list the stages of a query plan, outermost first
+def plan_stages(plan):
+    # Plans run by the slot-based engine nest the classic plan one level down
+    plan = plan.get('queryPlan', plan)
+    stages = [plan['stage']]
+    children = plan.get('inputStages', [])
+    if 'inputStage' in plan:
+        children = [plan['inputStage']]
+    for child in children:
+        stages.extend(plan_stages(child))
+    return stages
+
+# Repository over MongoDB (see repository.py for the interface). Statistics
+# are counters in the statistics collection; the change sequence behind
+# GET /sync is a counter document, a _seq field on every task and goal and a
+# tombstones collection.
+class MongoRepository(Repository):
+    def __init__(self, db, client=None, pool=None, read_preference=ReadPreference.PRIMARY):
+        self.db = db
+        self.client = client
+        self.pool = pool
+        # The database handle for the reads that may go to a secondary
+        self.reads = db.with_options(read_preference=read_preference)
+        self.versions = MongoVersionTracker(db)
+        # Change notifications are published by the process that made the
+        # change, so with several workers a stream only sees the changes made
+        # through its own worker
+        self.events = EventBroker()
+    
+    @classmethod
+    def connect(cls, uri=MONGO_URI, read_preference=READ_PREFERENCE):
+        if read_preference not in READ_PREFERENCES:
+            raise ValueError('Unknown TASKX_MONGO_READ_PREFERENCE: %s' % read_preference)
+        pool = PoolMonitor()
+        client = MongoClient(uri, event_listeners=[pool, CommandMonitor()], **client_options())
+        repository = cls(client.get_default_database(), client, pool, READ_PREFERENCES[read_preference])
+        repository.ensure_indexes()
+        return repository
+    
+    # Creating an index that already exists is a no-op, so this runs on every
+    # start. A failure (e.g. duplicate emails already stored, or a user
+    # without the createIndex privilege) is logged rather than fatal.
+    def ensure_indexes(self):
+        for name, indexes in INDEXES.items():
+            models = [IndexModel([(field, ASCENDING) for field in keys], **options) for keys, options in indexes]
+            try:
+                self.db[name].create_indexes(models)
+            except OperationFailure as e:
+                logger.warning('Could not create indexes on %s: %s', name, e)
+    
+    # Reserves `count` numbers of the change sequence for the write made
+    # inside the block and yields the first (None for count=0). A number is
+    # handed out before the write that carries it becomes visible, so until
+    # the block ends a lease tells changes() not to report a sequence at or
+    # past it. The lease's floor is read from the counter before reserving,
+    # so it is never above the numbers reserved.
+    @contextmanager
+    def sequence(self, count=1):
+        if not count:
+            yield None
+            return
+        counter = self.db.counters.find_one({'_id': 'sync'})
+        floor = (counter['seq'] if counter else 0) + 1
+        lease = self.db.sequence_leases.insert_one({'floor': floor, 'at': utcnow()}).inserted_id
+        try:
+            yield self.next_seq(count)
+        finally:
+            self.db.sequence_leases.delete_one({'_id': lease})
+    
+    # Reserves `count` numbers of the change sequence and returns the first.
+    # Writes go through sequence(), which also takes out the lease.
+    def next_seq(self, count=1):
+        counter = self.db.counters.find_one_and_update(
+            {'_id': 'sync'},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['seq'] - count + 1
+    
+    # Records a list of (old, new) changes: bumps the version counters,
+    # notifies /events subscribers and, for tasks and goals, leaves
+    # tombstones and folds the changes into the statistics counters
+    def record_changes(self, name, changes):
+        if not changes:
+            return
+        self.versions.bump(name, *[record for change in changes for record in change])
+        if name != 'users':
+            for old, new in changes:
+                self.events.record_changed(name, old, new)
+        
+        contribution = CONTRIBUTIONS.get(name)
+        if contribution is None:
+            return
         
-    # Check if user already exists
-    existing_user = mongo.db.users.find_one({'email': user_data['email']})
-    if existing_user:
-        return jsonify({'error': 'User with this email already exists'}), 400
+        # Deleted records, and records handed to another user, leave a tombstone
+        # for their previous owner so GET /sync can report them
+        tombstones = [{'collection': name, 'record_id': str(old['_id']), 'user_id': old['user_id']}
+                      for old, new in changes
+                      if old is not None and old.get('user_id') is not None
+                      and (new is None or new.get('user_id') != old['user_id'])]
+        if tombstones:
+            with self.sequence(len(tombstones)) as seq:
+                for offset, tombstone in enumerate(tombstones):
+                    tombstone['_seq'] = seq + offset
+                self.db.tombstones.insert_many(tombstones)
         
-    result = mongo.db.users.insert_one(user_data)
-    user_data['_id'] = str(result.inserted_id)
+        deltas = {}
+        for old, new in changes:
+            for user_id, delta in contribution_delta(contribution, old, new).items():
+                user_delta = deltas.setdefault(user_id, {})
+                for path, n in delta.items():
+                    user_delta[path] = user_delta.get(path, 0) + n
+        
+        requests = []
+        for user_id, delta in deltas.items():
+            delta = {to_mongo_path(path): n for path, n in delta.items() if n}
+            if delta:
+                requests.append(UpdateOne({'user_id': user_id}, {'$inc': delta}, upsert=True))
+        if requests:
+            self.db.statistics.bulk_write(requests, ordered=False)
     
-    return jsonify(user_data), 201
-
-@app.route('/users/<id>', methods=['PUT'])
-def update_user(id):
-    user_data = request.json
-    user_data['updated_at'] = datetime.utcnow()
-    
-    # Validate required fields
-    if 'email' not in user_data or 'name' not in user_data:
-        return jsonify({'error': 'Email and name are required'}), 400
+    def check_email(self, email, id=None):
+        if email is not None and self.db.users.find_one({'email': email, '_id': {'$ne': id}}, {'_id': 1}):
+            raise DuplicateKeyError('Duplicate value for email: %s' % email)
+    
+    def list_cursor(self, name, query):
+        criteria, projection, sort = build_find(query)
+        cursor = self.reads[name].find(criteria, projection)
+        if query['sort'] or query['cursor'] or query['limit']:
+            cursor = cursor.sort(sort)
+        if query['limit']:
+            # Fetch one extra record to learn whether there is a next page
+            cursor = cursor.limit(query['limit'] + 1)
+        return cursor
+    
+    def find(self, name, query):
+        records = [to_record(document) for document in self.list_cursor(name, query)]
+        metrics.count_records(name, len(records))
+        next_cursor = None
+        if query['limit'] and len(records) > query['limit']:
+            records = records[:query['limit']]
+            next_cursor = encode_cursor(query, records[-1])
+        return records, next_cursor
+    
+    def iter_find(self, name, query):
+        for document in self.list_cursor(name, query).batch_size(STREAM_BATCH_SIZE):
+            yield to_record(document)
+    
+    def all(self, name):
+        return [to_record(document) for document in self.db[name].find()]
+    
+    def get(self, name, id):
+        return to_record(self.db[name].find_one({'_id': to_object_id(id)}))
+    
+    def get_by(self, name, field, value):
+        return to_record(self.db[name].find_one({field: value}))
+    
+    def count(self, name):
+        return self.db[name].count_documents({})
+    
+    def create(self, name, data):
+        record = with_progress(name, client_fields(data))
+        record['created_at'] = utcnow()
+        record['updated_at'] = utcnow()
+        if name == 'users':
+            self.check_email(record.get('email'))
         
-    result = mongo.db.users.update_one(
-        {'_id': ObjectId(id)},
-        {'$set': user_data}
-    )
-    
-    if result.matched_count:
-        updated_user = mongo.db.users.find_one({'_id': ObjectId(id)})
-        return jsonify(updated_user)
-    return jsonify({'error': 'User not found'}), 404
-
-@app.route('/users/<id>', methods=['DELETE'])
-def delete_user(id):
-    result = mongo.db.users.delete_one({'_id': ObjectId(id)})
-    if result.deleted_count:
-        return jsonify({'message': 'User deleted successfully'})
-    return jsonify({'error': 'User not found'}), 404
-
-# Settings Routes
-@app.route('/settings/<user_id>', methods=['GET'])
-def get_settings(user_id):
-    settings = mongo.db.settings.find_one({'user_id': user_id})
-    if settings:
-        return jsonify(settings)
-    return jsonify({'error': 'Settings not found'}), 404
-
-@app.route('/settings/<user_id>', methods=['PUT'])
-def update_settings(user_id):
-    settings_data = request.json
-    settings_data['updated_at'] = datetime.utcnow()
-    
-    result = mongo.db.settings.update_one(
-        {'user_id': user_id},
-        {'$set': settings_data},
-        upsert=True
-    )
-    
-    updated_settings = mongo.db.settings.find_one({'user_id': user_id})
-    return jsonify(updated_settings)
-
-# Statistics Routes
-@app.route('/statistics/<user_id>', methods=['GET'])
-def get_statistics(user_id):
-    # Get task statistics
-    total_tasks = mongo.db.tasks.count_documents({'user_id': user_id})
-    completed_tasks = mongo.db.tasks.count_documents({'user_id': user_id, 'completed': True})
-    pending_tasks = total_tasks - completed_tasks
-    
-    # Get goal statistics
-    total_goals = mongo.db.goals.count_documents({'user_id': user_id})
-    completed_goals = mongo.db.goals.count_documents({'user_id': user_id, 'completed': True})
-    in_progress_goals = total_goals - completed_goals
-    
-    # Get tasks by category
-    pipeline = [
-        {'$match': {'user_id': user_id}},
-        {'$group': {'_id': '$category', 'count': {'$sum': 1}}}
-    ]
-    tasks_by_category = list(mongo.db.tasks.aggregate(pipeline))
-    
-    # Get tasks by priority
-    pipeline = [
-        {'$match': {'user_id': user_id}},
-        {'$group': {'_id': '$priority', 'count': {'$sum': 1}}}
-    ]
-    tasks_by_priority = list(mongo.db.tasks.aggregate(pipeline))
-    
-    statistics = {
-        'tasks': {
-            'total': total_tasks,
-            'completed': completed_tasks,
-            'pending': pending_tasks,
-            'by_category': tasks_by_category,
-            'by_priority': tasks_by_priority
-        },
-        'goals': {
-            'total': total_goals,
-            'completed': completed_goals,
-            'in_progress': in_progress_goals
-        }
-    }
-    
-    return jsonify(statistics)
-
-if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+        with self.sequence(1 if name in SYNC_COLLECTIONS else 0) as seq:
+            if seq is not None:
+                record['_seq'] = seq
+            try:
+                self.db[name].insert_one(record)
+            except MongoDuplicateKeyError:
+                raise DuplicateKeyError('Duplicate value for email: %s' % record.get('email'))
+        self.record_changes(name, [(None, record)])
+        return to_record(record)
+    
+    def replace(self, name, id, data):
+        id = to_object_id(id)
+        existing = self.db[name].find_one({'_id': id}, {'created_at': 1})
+        if existing is None:
+            return None
+        
+        record = with_progress(name, client_fields(data))
+        if 'created_at' in existing:
+            record['created_at'] = existing['created_at']
+        record['updated_at'] = utcnow()
+        if name == 'users':
+            self.check_email(record.get('email'), id)
+        
+        # The previous version is needed to adjust the statistics counters
+        with self.sequence(1 if name in SYNC_COLLECTIONS else 0) as seq:
+            if seq is not None:
+                record['_seq'] = seq
+            try:
+                old = self.db[name].find_one_and_replace({'_id': id}, record,
+                                                         return_document=ReturnDocument.BEFORE)
+            except MongoDuplicateKeyError:
+                raise DuplicateKeyError('Duplicate value for email: %s' % record.get('email'))
+        if old is None:
+            return None
+        record['_id'] = id
+        self.record_changes(name, [(old, record)])
+        return to_record(record)
+    
+    # Only the changed fields are sent, with $set and $unset. The update
+    # applies only if the document still has the updated_at (and _seq) it
+    # was read with; if another write got in first, the document is read
+    # again, so an If-Match check always sees the latest version.
+    def patch(self, name, id, data, if_match=None):
+        id = to_object_id(id)
+        while True:
+            old = self.db[name].find_one({'_id': id})
+            if old is None:
+                return None
+            check_if_match(if_match, to_record(old))
+            fields, unset = patch_changes(name, old, data)
+            if not fields and not unset:
+                return to_record(old)
+            fields['updated_at'] = utcnow()
+            if name == 'users' and 'email' in fields:
+                self.check_email(fields['email'], id)
+            query = {'_id': id, 'updated_at': old.get('updated_at')}
+            if name in SYNC_COLLECTIONS:
+                query['_seq'] = old.get('_seq')
+            update = {'$set': fields}
+            if unset:
+                update['$unset'] = {field: '' for field in unset}
+            
+            with self.sequence(1 if name in SYNC_COLLECTIONS else 0) as seq:
+                if seq is not None:
+                    fields['_seq'] = seq
+                try:
+                    result = self.db[name].update_one(query, update)
+                except MongoDuplicateKeyError:
+                    raise DuplicateKeyError('Duplicate value for email: %s' % fields.get('email'))
+            if result.matched_count:
+                record = dict(old, **fields)
+                for field in unset:
+                    del record[field]
+                self.record_changes(name, [(old, record)])
+                return to_record(record)
+    
+    def delete(self, name, id):
+        old = self.db[name].find_one_and_delete({'_id': to_object_id(id)})
+        if old is None:
+            return False
+        self.record_changes(name, [(old, None)])
+        return True
+    
+    # The targeted documents are fetched up front, so every operation gets
+    # its own result, the batch goes out as a single bulk_write and the
+    # counters are adjusted in one pass
+    def batch(self, name, label, operations):
+        collection = self.db[name]
+        results = [None] * len(operations)
+        ids = [to_object_id(op['_id']) for op in operations
+               if check_operation(op) is None and op['op'] != 'create']
+        current = {}
+        if ids:
+            current = {doc['_id']: doc for doc in collection.find({'_id': {'$in': ids}})}
+        
+        requests = []
+        pending = []  # (operation index, old, new) for every queued request
+        # The lease covers the whole batch, up to the bulk_write that makes it visible
+        with self.sequence(len(operations)) as seq:
+            for index, operation in enumerate(operations):
+                error = check_operation(operation)
+                if error:
+                    results[index] = batch_result(400, error=error)
+                    continue
+                
+                if operation['op'] == 'create':
+                    record = with_progress(name, client_fields(operation['data']))
+                    record['_id'] = ObjectId()
+                    record['created_at'] = utcnow()
+                    record['updated_at'] = utcnow()
+                    record['_seq'] = seq + index
+                    requests.append(InsertOne(record))
+                    pending.append((index, None, record))
+                    continue
+                
+                id = to_object_id(operation['_id'])
+                old = current.get(id)
+                if old is None:
+                    results[index] = batch_result(404, _id=operation['_id'], error='%s not found' % label)
+                    continue
+                
+                if operation['op'] == 'delete':
+                    requests.append(DeleteOne({'_id': id}))
+                    new = None
+                elif operation['op'] == 'update':
+                    record = with_progress(name, client_fields(operation['data']))
+                    if 'created_at' in old:
+                        record['created_at'] = old['created_at']
+                    record['updated_at'] = utcnow()
+                    record['_seq'] = seq + index
+                    requests.append(ReplaceOne({'_id': id}, record))
+                    new = dict(record, _id=id)
+                else:
+                    changes = {
+                        'completed': bool(operation.get('completed', True)),
+                        'updated_at': utcnow(),
+                        '_seq': seq + index
+                    }
+                    requests.append(UpdateOne({'_id': id}, {'$set': changes}))
+                    new = dict(old, **changes)
+                current[id] = new
+                pending.append((index, old, new))
+            
+            failed = {}
+            if requests:
+                try:
+                    collection.bulk_write(requests, ordered=False)
+                except BulkWriteError as e:
+                    failed = {error['index']: error['errmsg'] for error in e.details['writeErrors']}
+        
+        changes = []
+        for position, (index, old, new) in enumerate(pending):
+            record = to_record(new if new is not None else old)
+            if position in failed:
+                results[index] = batch_result(500, _id=record['_id'], error=failed[position])
+                continue
+            changes.append((old, new))
+            if old is None:
+                results[index] = batch_result(201, _id=record['_id'], record=record)
+            elif new is None:
+                results[index] = batch_result(200, _id=record['_id'])
+            else:
+                results[index] = batch_result(200, _id=record['_id'], record=record)
+        self.record_changes(name, changes)
+        
+        return results
+    
+    # Timestamps that arrive as ISO strings are stored as dates, like those of
+    # records created through the API: MongoDB only compares values of the
+    # same BSON type, so cursor paging on them would skip mixed records
+    def import_records(self, name, records):
+        records = [with_progress(name, parse_dates(dict(record))) for record in records]
+        if not records:
+            return
+        with self.sequence(len(records) if name in SYNC_COLLECTIONS else 0) as seq:
+            if seq is not None:
+                for offset, record in enumerate(records):
+                    record['_seq'] = seq + offset
+            self.db[name].insert_many(records)
+        self.record_changes(name, [(None, record) for record in records])
+    
+    # Only the milestone that changed is written: $push to add, a positional
+    # $set to update, $pull to delete (reordering sets the whole array). The
+    # update only applies if the goal's _seq is still the one the operation
+    # was computed from; otherwise another write got in first, and the goal
+    # is read again and the operation retried.
+    def update_milestones(self, id, op, milestone_id=None, data=None):
+        id = to_object_id(id)
+        while True:
+            old = self.db.goals.find_one({'_id': id})
+            if old is None:
+                return None
+            milestones, milestone = apply_operation(milestone_list(old), op, milestone_id, data)
+            changes = {'progress': goal_progress(milestones), 'updated_at': utcnow()}
+            query = {'_id': id, '_seq': old.get('_seq')}
+            update = {'$set': changes}
+            if not isinstance(old.get('milestones'), list) or op in ('reorder', 'refresh'):
+                changes['milestones'] = milestones
+            elif op == 'add':
+                update['$push'] = {'milestones': milestone}
+            elif op == 'update':
+                query['milestones.id'] = milestone['id']
+                for field, value in milestone.items():
+                    changes['milestones.$.' + field] = value
+            else:
+                update['$pull'] = {'milestones': {'id': milestone['id']}}
+            
+            with self.sequence() as seq:
+                changes['_seq'] = seq
+                matched = self.db.goals.update_one(query, update).matched_count
+            if matched:
+                record = dict(old, milestones=milestones, progress=changes['progress'],
+                              updated_at=changes['updated_at'], _seq=changes['_seq'])
+                self.record_changes('goals', [(old, record)])
+                return to_record(record), milestone
+    
+    def get_settings(self, user_id):
+        settings = self.db.settings.find_one({'user_id': user_id})
+        if settings is None:
+            # Upserting keeps two concurrent first requests from creating two
+            # documents; only the one that inserted reports the change
+            now = utcnow()
+            result = self.db.settings.update_one(
+                {'user_id': user_id},
+                {'$setOnInsert': dict(DEFAULT_SETTINGS, created_at=now, updated_at=now)},
+                upsert=True
+            )
+            settings = self.db.settings.find_one({'user_id': user_id})
+            if result.upserted_id is not None:
+                self.record_changes('settings', [(None, settings)])
+        return to_record(settings)
+    
+    def update_settings(self, user_id, data):
+        changes = settings_fields(data)
+        now = utcnow()
+        changes['updated_at'] = now
+        defaults = {k: v for k, v in DEFAULT_SETTINGS.items() if k not in changes}
+        defaults['created_at'] = now
+        
+        settings = self.db.settings.find_one_and_update(
+            {'user_id': user_id},
+            {'$set': changes, '$setOnInsert': defaults},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        # Only an insert sets both timestamps to `now`
+        created = settings.get('created_at') == settings['updated_at']
+        self.record_changes('settings', [(None if created else settings, settings)])
+        return to_record(settings)
+    
+    def changes(self, user_id, since):
+        if since:
+            try:
+                since = int(since)
+            except ValueError:
+                raise SyncError('Invalid since value')
+        
+        # The sequence handed back is a low-water mark: every change at or below
+        # it is visible to the queries below. A number is reserved before the
+        # write carrying it lands, so while a sequence lease is live the mark
+        # stays under its floor; otherwise a slow write could end up at or
+        # below the `since` of the next sync and never be reported. The mark
+        # is read before the data, so a change made while the queries run is
+        # reported again on the next sync (clients apply changes by _id).
+        counter = self.db.counters.find_one({'_id': 'sync'})
+        issued = counter['seq'] if counter else 0
+        cutoff = utcnow() - timedelta(seconds=SEQUENCE_LEASE_SECONDS)
+        lease = self.db.sequence_leases.find_one({'at': {'$gt': cutoff}}, sort=[('floor', ASCENDING)])
+        current = min(issued, lease['floor'] - 1) if lease else issued
+        changed = {}
+        deleted = {}
+        
+        if not since or since > issued:
+            # First sync, or a sequence this database never handed out
+            for name in SYNC_COLLECTIONS:
+                changed[name] = [to_record(doc) for doc in self.db[name].find({'user_id': user_id})]
+            return sync_response(str(current), True, changed, deleted)
+        
+        for name in SYNC_COLLECTIONS:
+            documents = self.db[name].find({'user_id': user_id, '_seq': {'$gt': since}}).sort('_seq', 1)
+            changed[name] = [to_record(doc) for doc in documents]
+        
+        tombstones = self.db.tombstones.find({'user_id': user_id, '_seq': {'$gt': since}}).sort('_seq', 1)
+        for tombstone in tombstones:
+            name = tombstone['collection']
+            # A record that came back to this user since is reported as changed
+            if tombstone['record_id'] not in set(record['_id'] for record in changed[name]):
+                deleted.setdefault(name, []).append(tombstone['record_id'])
+        
+        return sync_response(str(current), False, changed, deleted)
+    
+    def statistics(self, user_id):
+        # Counters are maintained as tasks and goals change, so this is a
+        # single document lookup
+        counters = self.reads.statistics.find_one({'user_id': user_id})
+        return format_statistics(from_mongo_document(counters))
+    
+    def verify_statistics(self, rebuild=False):
+        actual = {}
+        for name, fields in COUNTER_FIELDS.items():
+            pipeline = [{'$group': {'_id': {field: '$' + field for field in fields}, 'count': {'$sum': 1}}}]
+            for group in self.db[name].aggregate(pipeline):
+                record = group['_id']
+                if record.get('user_id') is None:
+                    continue
+                delta = {path: n * group['count'] for path, n in CONTRIBUTIONS[name](record).items()}
+                apply_delta(actual.setdefault(record['user_id'], {}), delta)
+        stored = {doc['user_id']: from_mongo_document(doc) for doc in self.db.statistics.find()}
+        drift = diff_counters(stored, actual)
+        
+        if rebuild and drift:
+            for user_id in set(stored) | set(actual):
+                if user_id in actual:
+                    self.db.statistics.replace_one(
+                        {'user_id': user_id},
+                        to_mongo_document(user_id, actual[user_id]),
+                        upsert=True
+                    )
+                else:
+                    self.db.statistics.delete_one({'user_id': user_id})
+        return drift
+    
+    def explain_queries(self, user_id):
+        cursors = []
+        for name, queries in AUDIT_LIST_QUERIES.items():
+            for args in queries:
+                args = dict(args, user_id=user_id)
+                cursors.append(('GET /%s?%s' % (name, urlencode(args)), self.list_cursor(name, parse_list_query(args))))
+            cursors.append(('GET /sync (%s)' % name,
+                            self.db[name].find({'user_id': user_id, '_seq': {'$gt': 0}}).sort('_seq', 1)))
+        cursors.append(('GET /sync (tombstones)',
+                        self.db.tombstones.find({'user_id': user_id, '_seq': {'$gt': 0}}).sort('_seq', 1)))
+        cursors.append(('GET /users/<email>', self.db.users.find({'email': 'user@example.com'})))
+        cursors.append(('GET /settings/<user_id>', self.db.settings.find({'user_id': user_id})))
+        cursors.append(('GET /statistics/<user_id>', self.db.statistics.find({'user_id': user_id})))
+        
+        plans = []
+        for label, cursor in cursors:
+            stages = plan_stages(cursor.explain()['queryPlanner']['winningPlan'])
+            plans.append((label, ' < '.join(stages), 'COLLSCAN' in stages))
+        return plans
+    
+    def pool_stats(self):
+        return self.pool.stats() if self.pool is not None else None
+    
+    def close(self):
+        if self.client is not None:
+            self.client.close()
@@ -0,0 +1,163 @@
+import asyncio
+import queue
+import threading
+import time
+
+from jsoncodec import dumps
+
+# In-process pub/sub behind GET /events. Every open stream is a subscriber
+# with a bounded queue; publishing never blocks, and a subscriber whose queue
+# is full is dropped (its stream ends and the browser reconnects and resyncs)
+# rather than slowing down the mutation that published.
+
+EVENT_QUEUE_SIZE = 100
+HEARTBEAT_INTERVAL = 15
+
+# Events are queued as (name, data) pairs: 'change' for record changes,
+# 'reminder' for the due date reminders of reminders.py
+def format_event(name, event):
+    return 'event: %s\ndata: %s\n\n' % (name, dumps(event))
+
+class Subscriber:
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+
+    # Returns False when the queue is full
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+# Subscriber for a stream served from an asyncio event loop (see asgi.py).
+# Events are handed over to the loop, which drops the subscriber itself when
+# its queue is full.
+class AsyncSubscriber:
+    def __init__(self, broker, user_id, queue_size, loop):
+        self.broker = broker
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.loop = loop
+        self.closed = False
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+            return True
+        except RuntimeError:
+            # The loop has been closed
+            return False
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+    # Ends the stream, e.g. when the client disconnected
+    def close(self):
+        self.closed = True
+        if not self.queue.full():
+            self.queue.put_nowait(None)
+
+class EventBroker:
+    def __init__(self, queue_size=EVENT_QUEUE_SIZE, poll_interval=None):
+        self.lock = threading.Lock()
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.collections = []
+        # When set, collections are checked this often for changes written
+        # by other processes, so their events reach this process's streams
+        self.poll_interval = poll_interval
+        self._poller = None
+
+    def watch(self, name, collection):
+        self.collections.append(collection)
+        collection.listeners.append(lambda old, new: self.record_changed(name, old, new))
+
+    def record_changed(self, name, old, new):
+        if new is None:
+            self.publish(old.get('user_id'), {'collection': name, 'op': 'deleted', '_id': str(old['_id'])})
+            return
+        op = 'created' if old is None else 'updated'
+        self.publish(new.get('user_id'), {'collection': name, 'op': op, '_id': str(new['_id'])})
+        if old is not None and old.get('user_id') != new.get('user_id'):
+            # Handed to another user: it is gone as far as the old owner knows
+            self.publish(old.get('user_id'), {'collection': name, 'op': 'deleted', '_id': str(old['_id'])})
+
+    def publish(self, user_id, event, name='change'):
+        if user_id is None:
+            return
+        with self.lock:
+            subscribers = list(self.subscribers.get(user_id, ()))
+        for subscriber in subscribers:
+            if not subscriber.put((name, event)):
+                subscriber.closed = True
+                self.unsubscribe(subscriber)
+
+    def has_subscribers(self, user_id):
+        return user_id in self.subscribers
+
+    def subscribe(self, user_id):
+        return self._add(Subscriber(user_id, self.queue_size))
+
+    # Must be called from the event loop that will serve the stream
+    def subscribe_async(self, user_id):
+        return self._add(AsyncSubscriber(self, user_id, self.queue_size, asyncio.get_running_loop()))
+
+    def _add(self, subscriber):
+        user_id = subscriber.user_id
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+            if self.poll_interval and self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='event-poller', daemon=True)
+                self._poller.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            subscribers = self.subscribers.get(subscriber.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[subscriber.user_id]
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if self.subscribers:
+                for collection in self.collections:
+                    collection.count()
+
+    # Generator for the body of a text/event-stream response
+    def stream(self, subscriber, heartbeat=HEARTBEAT_INTERVAL):
+        try:
+            yield 'retry: 3000\n\n'
+            while not subscriber.closed:
+                try:
+                    event = subscriber.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    # Comments keep proxies from closing an idle connection
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_event(*event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def async_stream(self, subscriber, heartbeat=HEARTBEAT_INTERVAL):
+        try:
+            yield 'retry: 3000\n\n'
+            while not subscriber.closed:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is not None:
+                    yield format_event(*event)
+        finally:
+            self.unsubscribe(subscriber)
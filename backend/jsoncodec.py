@@ -0,0 +1,105 @@
+import json
+import uuid
+from datetime import datetime
+
+from flask.json.provider import JSONProvider as BaseJSONProvider
+
+import metrics
+
+# JSON encoding for HTTP responses and the data files. orjson is used when it
+# is installed (it serializes datetimes and UUIDs natively and is several
+# times faster on large lists); the standard library is the fallback. Both
+# produce compact output with datetimes as ISO 8601 strings.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from bson import ObjectId
+except ImportError:  # pymongo is only needed for the MongoDB backend
+    ObjectId = None
+
+# Helper function for the types the encoder does not know natively: MongoDB
+# ObjectIds, plus datetimes and UUIDs with the standard library
+def default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID) or (ObjectId is not None and isinstance(obj, ObjectId)):
+        return str(obj)
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+# Naive datetimes are UTC throughout (datetime.utcnow(), MongoDB), so
+# responses mark them as such; the data files keep them as they are
+def default_utc(obj):
+    if isinstance(obj, datetime) and obj.tzinfo is None:
+        return obj.isoformat() + '+00:00'
+    return default(obj)
+
+if orjson is not None:
+    OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumpb(obj, naive_utc=False):
+        options = OPTIONS | orjson.OPT_NAIVE_UTC if naive_utc else OPTIONS
+        try:
+            return orjson.dumps(obj, default=default, option=options)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the standard library handles
+            return dumpb_stdlib(obj, naive_utc)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumpb(obj, naive_utc=False):
+        return dumpb_stdlib(obj, naive_utc)
+
+    def loads(data):
+        return json.loads(data)
+
+def dumpb_stdlib(obj, naive_utc=False):
+    return json.dumps(obj, default=default_utc if naive_utc else default, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+def dumps(obj, naive_utc=False):
+    return dumpb(obj, naive_utc).decode('utf-8')
+
+# Size of the chunks a streamed list is sent in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Generator for the body of a streamed list response: a JSON array, or one
+# record per line for NDJSON. Only one chunk is held in memory at a time.
+def stream_chunks(records, ndjson=False):
+    chunk = bytearray() if ndjson else bytearray(b'[')
+    first = True
+    for record in records:
+        if not ndjson and not first:
+            chunk += b','
+        first = False
+        chunk += dumpb(record, naive_utc=True)
+        if ndjson:
+            chunk += b'\n'
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk = bytearray()
+    if not ndjson:
+        chunk += b']'
+    if chunk:
+        yield bytes(chunk)
+
+# Flask JSON provider, installed with `app.json = JSONProvider(app)`. It backs
+# jsonify() and request.json, and skips the bytes -> str -> bytes round trip
+# for response bodies.
+class JSONProvider(BaseJSONProvider):
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, naive_utc=True)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with metrics.timed('codec', 'serialize'):
+            body = dumpb(obj, naive_utc=True) + b'\n'
+        return self._app.response_class(body, mimetype=self.mimetype)
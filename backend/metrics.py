@@ -0,0 +1,318 @@
+import bisect
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import request
+
+logger = logging.getLogger(__name__)
+
+# Request and storage metrics in the Prometheus text format, served on
+# GET /metrics. Recording a value costs a lock and a bisect, so the hooks
+# below stay on in production.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Latency buckets in seconds, from an in-memory lookup to a slow disk flush
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests slower than this many milliseconds are logged with a breakdown by
+# stage and kept for GET /metrics/slow; 0 turns the profiler off
+SLOW_REQUEST_MS = float(os.environ.get('TASKX_SLOW_REQUEST_MS', '0'))
+
+# Fraction of requests the profiler records stages for
+PROFILE_SAMPLE_RATE = float(os.environ.get('TASKX_PROFILE_SAMPLE_RATE', '1.0'))
+
+# How many of the slowest requests are kept
+SLOW_REQUEST_KEEP = int(os.environ.get('TASKX_SLOW_REQUEST_KEEP', '20'))
+
+# Repository methods timed by instrument(); iter_find is left out since its
+# work happens while the response streams, after the request has been timed
+REPOSITORY_OPERATIONS = (
+    'find', 'all', 'get', 'get_by', 'count', 'create', 'replace', 'delete', 'batch', 'import_records',
+    'patch', 'update_milestones', 'get_settings', 'update_settings', 'changes', 'statistics', 'due_tasks'
+)
+
+# Layers whose stages never contain one another; the rest of a request's
+# time is reported as 'other' (the view itself, the cache, the framework)
+TOP_LAYERS = ('repository', 'codec')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in zip(names, values))
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+# Monotonic counter keyed by a tuple of label values
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield self.name + format_labels(self.labels, labels), value
+
+# Histogram keyed by a tuple of label values. Bucket counts are stored per
+# bucket and made cumulative when rendered.
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # label values -> [per-bucket counts (the last one is +Inf), sum]
+        self.values = {}
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.values.items())
+        names = self.labels + ('le',)
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket' + format_labels(names, labels + (format_value(float(bound)),)), cumulative
+            yield self.name + '_sum' + format_labels(self.labels, labels), total
+            yield self.name + '_count' + format_labels(self.labels, labels), cumulative
+
+# Gauge or counter whose samples are computed when /metrics is scraped
+class Snapshot:
+    def __init__(self, name, type, help, labels=()):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.labels = labels
+        self.values = []
+
+    def add(self, labels, value):
+        self.values.append((labels, value))
+        return self
+
+    def samples(self):
+        for labels, value in self.values:
+            yield self.name + format_labels(self.labels, labels), value
+
+REQUEST_SECONDS = Histogram('taskx_http_request_duration_seconds', 'Time to build the response of an HTTP request.',
+                            ('method', 'route', 'status'))
+RESPONSE_BYTES = Counter('taskx_http_response_bytes_total', 'Bytes sent in response bodies (streamed bodies excluded).',
+                         ('method', 'route'))
+OPERATION_SECONDS = Histogram('taskx_operation_duration_seconds',
+                              'Time spent in storage and serialization operations.', ('layer', 'operation'))
+STORAGE_BYTES = Counter('taskx_storage_bytes_total', 'Bytes read from and written to storage.', ('direction',))
+RECORDS_SCANNED = Counter('taskx_records_scanned_total', 'Records examined by storage queries.', ('collection',))
+RECORDS_RETURNED = Counter('taskx_records_returned_total', 'Records returned by storage queries.', ('collection',))
+
+METRICS = (REQUEST_SECONDS, RESPONSE_BYTES, OPERATION_SECONDS, STORAGE_BYTES, RECORDS_SCANNED, RECORDS_RETURNED)
+
+# Stages of the request being handled on this thread, when it is profiled
+local = threading.local()
+
+def observe(layer, operation, seconds):
+    OPERATION_SECONDS.observe((layer, operation), seconds)
+    stages = getattr(local, 'stages', None)
+    if stages is not None:
+        stages.append((layer, operation, seconds))
+
+@contextmanager
+def timed(layer, operation):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(layer, operation, time.perf_counter() - started)
+
+def count_bytes(direction, size):
+    STORAGE_BYTES.inc((direction,), size)
+
+# `scanned` is only known where the backend does the filtering itself (the
+# JSON backend); run `flask explain-queries` for the others
+def count_records(collection, returned, scanned=None):
+    RECORDS_RETURNED.inc((collection,), returned)
+    if scanned is not None:
+        RECORDS_SCANNED.inc((collection,), scanned)
+
+# Times the repository's methods. Only the outermost call of a thread is
+# recorded, so a batch is not counted again for the creates it runs.
+def instrument(repository):
+    for operation in REPOSITORY_OPERATIONS:
+        setattr(repository, operation, timed_method(getattr(repository, operation), operation))
+    return repository
+
+def timed_method(method, operation):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if getattr(local, 'in_repository', False):
+            return method(*args, **kwargs)
+        local.in_repository = True
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            local.in_repository = False
+            observe('repository', operation, time.perf_counter() - started)
+    return wrapper
+
+# Keeps the slowest profiled requests, each with the time spent per stage
+class SlowRequestLog:
+    def __init__(self, threshold_ms=SLOW_REQUEST_MS, keep=SLOW_REQUEST_KEEP):
+        self.threshold = threshold_ms / 1000.0
+        self.keep = keep
+        self.lock = threading.Lock()
+        # Min-heap of (seconds, sequence number, entry)
+        self.entries = []
+        self.seq = 0
+
+    def record(self, method, path, route, status, seconds, stages):
+        breakdown = {}
+        top = 0.0
+        for layer, operation, stage_seconds in stages:
+            stage = '%s.%s' % (layer, operation)
+            count, total = breakdown.get(stage, (0, 0.0))
+            breakdown[stage] = (count + 1, total + stage_seconds)
+            if layer in TOP_LAYERS:
+                top += stage_seconds
+        breakdown['other'] = (1, max(seconds - top, 0.0))
+        entry = {
+            'method': method,
+            'path': path,
+            'route': route,
+            'status': status,
+            'ms': round(seconds * 1000, 3),
+            'at': time.time(),
+            'stages': [{'stage': stage, 'calls': count, 'ms': round(total * 1000, 3)}
+                       for stage, (count, total) in sorted(breakdown.items(), key=lambda item: -item[1][1])]
+        }
+        logger.warning('Slow request %s %s (%d) took %.1f ms: %s', method, path, status, seconds * 1000,
+                       ', '.join('%s %.1f ms' % (stage['stage'], stage['ms']) for stage in entry['stages']))
+        with self.lock:
+            self.seq += 1
+            if len(self.entries) < self.keep:
+                heapq.heappush(self.entries, (seconds, self.seq, entry))
+            elif seconds > self.entries[0][0]:
+                heapq.heapreplace(self.entries, (seconds, self.seq, entry))
+
+    def slowest(self):
+        with self.lock:
+            return [entry for _, _, entry in sorted(self.entries, key=lambda item: -item[0])]
+
+# Installed with RequestMetrics(app); times every request by its URL rule
+# (never the raw path, which would give every record its own series) and,
+# with TASKX_SLOW_REQUEST_MS set, profiles a sample of them. Register it
+# before Compressor so the bytes counted are the ones sent.
+class RequestMetrics:
+    def __init__(self, app=None, slow_ms=SLOW_REQUEST_MS, sample_rate=PROFILE_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.slow_requests = SlowRequestLog(slow_ms) if slow_ms > 0 else None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def start(self):
+        local.started = time.perf_counter()
+        profiled = self.slow_requests is not None and random.random() < self.sample_rate
+        local.stages = [] if profiled else None
+
+    def finish(self, response):
+        started = getattr(local, 'started', None)
+        if started is None:
+            return response
+        seconds = time.perf_counter() - started
+        stages = local.stages
+        local.started = local.stages = None
+
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_SECONDS.observe((request.method, route, str(response.status_code)), seconds)
+        if not response.is_streamed:
+            RESPONSE_BYTES.inc((request.method, route), response.calculate_content_length() or 0)
+        if stages is not None and seconds >= self.slow_requests.threshold:
+            self.slow_requests.record(request.method, request.full_path.rstrip('?'), route, response.status_code,
+                                      seconds, stages)
+        return response
+
+def cache_metrics(caches):
+    families = [
+        Snapshot('taskx_cache_hits_total', 'counter', 'Cache lookups that found a current entry.', ('cache',)),
+        Snapshot('taskx_cache_misses_total', 'counter', 'Cache lookups that found nothing current.', ('cache',)),
+        Snapshot('taskx_cache_evictions_total', 'counter', 'Entries evicted to stay within the budget.', ('cache',)),
+        Snapshot('taskx_cache_entries', 'gauge', 'Entries held.', ('cache',)),
+        Snapshot('taskx_cache_bytes', 'gauge', 'Bytes held.', ('cache',)),
+        Snapshot('taskx_cache_max_bytes', 'gauge', 'Memory budget.', ('cache',))
+    ]
+    keys = ('hits', 'misses', 'evictions', 'entries', 'bytes', 'max_bytes')
+    for name, stats in sorted(caches.items()):
+        for family, key in zip(families, keys):
+            family.add((name,), stats[key])
+    return families
+
+def pool_metrics(stats):
+    families = []
+    for key, type, help in (
+        ('connections_open', 'gauge', 'Connections open in the MongoDB pool.'),
+        ('connections_checked_out', 'gauge', 'Connections currently in use.'),
+        ('checkouts', 'counter', 'Connections checked out of the pool.'),
+        ('failed_checkouts', 'counter', 'Checkouts that failed or timed out.'),
+        ('wait_seconds_total', 'counter', 'Time spent waiting for a connection.'),
+        ('wait_seconds_max', 'gauge', 'Longest wait for a connection.'),
+        ('max_pool_size', 'gauge', 'Size limit of the pool.')
+    ):
+        if stats.get(key) is not None:
+            name = 'taskx_mongo_pool_' + (key + '_total' if type == 'counter' and not key.endswith('_total') else key)
+            families.append(Snapshot(name, type, help).add((), stats[key]))
+    return families
+
+# Renders every metric, plus the cache and pool figures of the moment
+def render(backend, caches=None, pool=None):
+    families = [Snapshot('taskx_backend_info', 'gauge', 'Storage backend in use.', ('backend',)).add((backend,), 1)]
+    families.extend(METRICS)
+    if caches:
+        families.extend(cache_metrics(caches))
+    if pool:
+        families.extend(pool_metrics(pool))
+    lines = []
+    for family in families:
+        lines.append('# HELP %s %s' % (family.name, family.help))
+        lines.append('# TYPE %s %s' % (family.name, family.type))
+        for name, value in family.samples():
+            lines.append('%s %s' % (name, format_value(value)))
+    return '\n'.join(lines) + '\n'
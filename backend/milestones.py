@@ -0,0 +1,96 @@
+# Milestone operations behind the /goals/<id>/milestones routes. A backend
+# reads the goal, runs the operation on its milestone list here, and writes
+# back only what changed (see update_milestones in the repositories) along
+# with the goal's progress, so clients no longer send whole goals to tick
+# off a milestone.
+#
+# Operations:
+#
+#   add      - appends `data` as a new milestone with the next free id
+#   update   - merges `data` into the milestone (e.g. {"completed": true})
+#   delete   - removes the milestone
+#   reorder  - `data` is the list of every milestone id in the new order
+#   refresh  - changes nothing; rewrites the progress (for older goals)
+
+OPERATIONS = ('add', 'update', 'delete', 'reorder', 'refresh')
+
+class MilestoneError(ValueError):
+    pass
+
+class MilestoneNotFound(MilestoneError):
+    pass
+
+# Percentage of the milestones that are completed, rounded half up as the
+# client used to do it; 0 for a goal without milestones
+def goal_progress(milestones):
+    if not isinstance(milestones, list):
+        return 0
+    milestones = [m for m in milestones if isinstance(m, dict)]
+    if not milestones:
+        return 0
+    completed = sum(1 for m in milestones if m.get('completed'))
+    return (completed * 200 + len(milestones)) // (2 * len(milestones))
+
+# Sets the progress of a goal record about to be stored; other records are
+# returned as they are
+def with_progress(name, record):
+    if name == 'goals':
+        record['progress'] = goal_progress(record.get('milestones'))
+    return record
+
+def milestone_list(goal):
+    milestones = goal.get('milestones')
+    return list(milestones) if isinstance(milestones, list) else []
+
+# Milestone ids arrive from the URL as strings, so they are compared as such
+def find_index(milestones, milestone_id):
+    for index, milestone in enumerate(milestones):
+        if isinstance(milestone, dict) and 'id' in milestone and str(milestone['id']) == str(milestone_id):
+            return index
+    raise MilestoneNotFound('Milestone not found')
+
+def check_fields(data, required=False):
+    if not isinstance(data, dict):
+        raise MilestoneError('Expected a JSON object')
+    if required and 'title' not in data:
+        raise MilestoneError('Title is required')
+    if 'completed' in data and not isinstance(data['completed'], bool):
+        raise MilestoneError('completed must be true or false')
+    return {k: v for k, v in data.items() if k != 'id'}
+
+def next_id(milestones):
+    ids = [m['id'] for m in milestones
+           if isinstance(m, dict) and isinstance(m.get('id'), int) and not isinstance(m['id'], bool)]
+    return max(ids, default=0) + 1
+
+# Returns the new milestone list and the milestone the operation added,
+# changed or removed (None for reorder and refresh)
+def apply_operation(milestones, op, milestone_id=None, data=None):
+    if op == 'add':
+        milestone = dict({'completed': False}, **check_fields(data, required=True))
+        milestone['id'] = next_id(milestones)
+        return milestones + [milestone], milestone
+
+    if op == 'update':
+        fields = check_fields(data)
+        index = find_index(milestones, milestone_id)
+        milestone = dict(milestones[index], **fields)
+        return milestones[:index] + [milestone] + milestones[index + 1:], milestone
+
+    if op == 'delete':
+        index = find_index(milestones, milestone_id)
+        return milestones[:index] + milestones[index + 1:], milestones[index]
+
+    if op == 'reorder':
+        if not isinstance(data, list) or not all(isinstance(id, (int, str)) for id in data):
+            raise MilestoneError('order must be a list of milestone ids')
+        by_id = {str(m.get('id')): m for m in milestones if isinstance(m, dict)}
+        order = [str(id) for id in data]
+        if len(by_id) != len(milestones) or len(order) != len(milestones) or set(order) != set(by_id):
+            raise MilestoneError('order must list every milestone id of the goal once')
+        return [by_id[id] for id in order], None
+
+    if op == 'refresh':
+        return milestones, None
+
+    raise MilestoneError('Unknown milestone operation: %s' % op)
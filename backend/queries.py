@@ -0,0 +1,178 @@
+import base64
+import json
+from datetime import datetime
+
+# Fields GET /tasks and GET /goals can be sorted on. Every sort is tie-broken
+# on _id so the order is total and cursors stay stable.
+SORT_FIELDS = ('created_at', 'updated_at', 'dueDate', 'title')
+DATE_FIELDS = ('created_at', 'updated_at')
+MAX_LIMIT = 1000
+
+class QueryError(ValueError):
+    pass
+
+# Parses the filtering, sorting and pagination parameters shared by the list
+# routes. Both backends consume the resulting dict.
+def parse_list_query(args):
+    query = {
+        'filters': {},
+        'completed': None,
+        'due_after': args.get('due_after'),
+        'due_before': args.get('due_before'),
+        'sort': None,
+        'descending': False,
+        'cursor': None,
+        'limit': None,
+        'fields': None
+    }
+
+    for field in ('user_id', 'category', 'priority'):
+        if args.get(field) is not None:
+            query['filters'][field] = args.get(field)
+
+    completed = args.get('completed')
+    if completed is not None:
+        if completed.lower() not in ('true', 'false'):
+            raise QueryError('completed must be true or false')
+        query['completed'] = completed.lower() == 'true'
+
+    sort = args.get('sort')
+    if sort:
+        query['descending'] = sort.startswith('-')
+        query['sort'] = sort.lstrip('-')
+        if query['sort'] not in SORT_FIELDS:
+            raise QueryError('Cannot sort by %s' % query['sort'])
+
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            query['limit'] = int(limit)
+        except ValueError:
+            raise QueryError('limit must be an integer')
+        if not 1 <= query['limit'] <= MAX_LIMIT:
+            raise QueryError('limit must be between 1 and %d' % MAX_LIMIT)
+
+    cursor = args.get('cursor')
+    if cursor:
+        query['cursor'] = decode_cursor(cursor)
+        if query['cursor'].get('sort') != query['sort']:
+            raise QueryError('Cursor does not match the requested sort')
+
+    fields = args.get('fields')
+    if fields:
+        query['fields'] = [f for f in fields.split(',') if f]
+
+    return query
+
+# Parses the `stream` parameter of the list routes: None, 'json' (a JSON
+# array sent in chunks) or 'ndjson' (one record per line). A stream carries
+# every matching record, so it cannot be paged.
+def parse_stream(args, query=None):
+    stream = args.get('stream')
+    if stream is None:
+        return None
+    if stream not in ('json', 'ndjson'):
+        raise QueryError('stream must be json or ndjson')
+    if query is not None and (query['limit'] or query['cursor']):
+        raise QueryError('stream cannot be combined with limit or cursor')
+    return stream
+
+# Cursors are opaque to clients: the sort key and _id of the last record
+# returned, base64 encoded
+def encode_cursor(query, record):
+    cursor = {'sort': query['sort'], '_id': str(record['_id'])}
+    if query['sort']:
+        cursor['value'] = sort_value(record.get(query['sort']))
+    token = json.dumps(cursor, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(token).decode('ascii')
+
+def decode_cursor(token):
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError):
+        raise QueryError('Invalid cursor')
+    if not isinstance(cursor, dict) or '_id' not in cursor:
+        raise QueryError('Invalid cursor')
+    return cursor
+
+# Turns the timestamps of a record read back from JSON (a data file, a log
+# entry, an SQLite row) into datetimes again, so it is served exactly as it
+# was before being stored. Values that are not ISO strings are left alone.
+def parse_dates(record):
+    for field in DATE_FIELDS:
+        if isinstance(record.get(field), str):
+            try:
+                record[field] = datetime.fromisoformat(record[field])
+            except ValueError:
+                pass
+    return record
+
+# Timestamps are datetimes for freshly written records and ISO strings once
+# they have been through a file, so compare them as strings
+def sort_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def sort_key(query, record):
+    key = []
+    if query['sort']:
+        value = sort_value(record.get(query['sort']))
+        # Missing values sort first, as they do in MongoDB
+        key.append((value is not None, value if value is not None else ''))
+    key.append(str(record['_id']))
+    return key
+
+def matches(query, record):
+    if query['completed'] is not None and bool(record.get('completed')) != query['completed']:
+        return False
+    for field, value in query['filters'].items():
+        if record.get(field) != value:
+            return False
+    due_date = record.get('dueDate')
+    if query['due_after'] is not None and not (due_date and due_date > query['due_after']):
+        return False
+    if query['due_before'] is not None and not (due_date and due_date < query['due_before']):
+        return False
+    return True
+
+# The due date bounds of a query as the (field, after, before) range a
+# sorted index can serve, or None. A missing due_after becomes '' so records
+# without a due date stay out, as in matches().
+def due_range(query):
+    if query['due_after'] is None and query['due_before'] is None:
+        return None
+    return ('dueDate', query['due_after'] or '', query['due_before'])
+
+def project(query, record):
+    if not query['fields']:
+        return record
+    fields = set(query['fields'])
+    fields.add('_id')
+    return {k: v for k, v in record.items() if k in fields}
+
+# Applies a parsed query to records already narrowed down by an index.
+# Returns the page and the cursor for the next one (None on the last page).
+def apply_list_query(query, records):
+    records = [r for r in records if matches(query, r)]
+
+    if query['sort'] or query['cursor'] or query['limit']:
+        records.sort(key=lambda r: sort_key(query, r), reverse=query['descending'])
+
+    cursor = query['cursor']
+    if cursor:
+        anchor = {'_id': cursor['_id']}
+        if query['sort']:
+            anchor[query['sort']] = cursor.get('value')
+        last = sort_key(query, anchor)
+        if query['descending']:
+            records = [r for r in records if sort_key(query, r) < last]
+        else:
+            records = [r for r in records if sort_key(query, r) > last]
+
+    next_cursor = None
+    if query['limit'] and len(records) > query['limit']:
+        records = records[:query['limit']]
+        next_cursor = encode_cursor(query, records[-1])
+
+    return [project(query, r) for r in records], next_cursor
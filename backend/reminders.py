@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Background reminders for tasks coming due. Every REMINDER_INTERVAL seconds
+# the scheduler asks the repository for the open tasks whose due date entered
+# the reminder window (REMINDER_LEAD_HOURS ahead of now) since the previous
+# check. That is a range query on the due date indexes (see due_tasks in
+# repository.py), so each check costs O(log n) plus the reminders it finds
+# instead of a scan of every task.
+#
+# Reminders go out as `reminder` events on the GET /events streams of this
+# process, to users whose settings have notifications on. Due dates are
+# compared as ISO strings in UTC; a date without a time is due at midnight,
+# so with the default lead a task due on the 20th is reminded on the 19th.
+# Nothing is sent for tasks that were already in the window when the
+# scheduler started, so a restart does not repeat reminders.
+
+REMINDER_INTERVAL = float(os.environ.get('TASKX_REMINDER_INTERVAL', '60'))
+REMINDER_LEAD_HOURS = float(os.environ.get('TASKX_REMINDER_LEAD_HOURS', '24'))
+
+logger = logging.getLogger(__name__)
+
+def reminder_event(task):
+    return {
+        'collection': 'tasks',
+        'op': 'due',
+        '_id': str(task['_id']),
+        'title': task.get('title'),
+        'dueDate': task.get('dueDate')
+    }
+
+class ReminderScheduler:
+    def __init__(self, repository, interval=REMINDER_INTERVAL, lead_hours=REMINDER_LEAD_HOURS):
+        self.repository = repository
+        self.events = repository.events
+        self.interval = interval
+        self.lead = timedelta(hours=lead_hours)
+        # End of the window covered by the previous check
+        self.cutoff = None
+        self.sent = 0
+        self._thread = None
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None or self.interval <= 0:
+                return
+            self.cutoff = self._cutoff(datetime.utcnow())
+            self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _cutoff(self, now):
+        return (now + self.lead).isoformat()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # A failed check is retried with the same window next time
+                logger.exception('Reminder check failed')
+
+    # Sends the reminders for tasks that entered the window since the last
+    # check; returns how many were sent
+    def check(self, now=None):
+        cutoff = self._cutoff(now or datetime.utcnow())
+        if self.cutoff is None:
+            self.cutoff = cutoff
+            return 0
+        if cutoff <= self.cutoff:
+            return 0
+        if not self.events.subscribers:
+            # Nobody is listening in this process, so there is no one to remind
+            self.cutoff = cutoff
+            return 0
+
+        tasks = self.repository.due_tasks(self.cutoff, cutoff)
+        self.cutoff = cutoff
+        enabled = {}
+        sent = 0
+        for task in tasks:
+            user_id = task.get('user_id')
+            if not self.events.has_subscribers(user_id):
+                continue
+            if user_id not in enabled:
+                enabled[user_id] = self.repository.notifications_enabled(user_id)
+            if enabled[user_id]:
+                self.events.publish(user_id, reminder_event(task), name='reminder')
+                sent += 1
+        self.sent += sent
+        return sent
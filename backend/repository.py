@@ -0,0 +1,377 @@
+import os
+import uuid
+from datetime import datetime
+
+from batch import batch_result, check_operation
+from conditional import VersionTracker, check_if_match
+from events import EventBroker
+from milestones import apply_operation, goal_progress, milestone_list, with_progress
+from queries import apply_list_query, due_range, parse_list_query
+from stats import StatisticsAggregator
+from storage import DuplicateKeyError, JsonStore
+from sync import ChangeLog
+
+# Which storage the API runs on: 'json' (files in DATA_DIR), 'memory' (the
+# same store without files), 'sqlite' (see sqlitedb.py) or 'mongo'
+# (MongoDB, see database.py)
+BACKEND = os.environ.get('TASKX_BACKEND', 'json')
+DATA_DIR = os.environ.get('TASKX_DATA_DIR', os.path.join(os.path.dirname(__file__), 'data'))
+
+COLLECTIONS = ('tasks', 'goals', 'users', 'settings')
+
+# Records read from the database per round trip when streaming a list
+STREAM_BATCH_SIZE = 500
+
+# What GET /settings/<user_id> returns for a user without settings
+DEFAULT_SETTINGS = {
+    'theme': 'light',
+    'notifications': True,
+    'autoSave': True,
+    'dataSync': False
+}
+
+# Fields the server owns; a PUT cannot change them
+SERVER_FIELDS = ('_id', 'created_at', 'updated_at')
+
+# Typical GET /tasks and GET /goals queries (besides user_id), used by the
+# explain-queries command to audit the query plans
+AUDIT_LIST_QUERIES = {
+    'tasks': [{}, {'completed': 'false'}, {'category': 'Work'}, {'priority': 'high'},
+              {'due_before': '2100-01-01'}, {'sort': 'dueDate', 'limit': '50'}],
+    'goals': [{}, {'completed': 'false'}, {'category': 'Work'}, {'sort': 'dueDate', 'limit': '50'}]
+}
+
+# Everything the routes need from a storage backend. Records are plain dicts
+# with a string _id; `name` is one of COLLECTIONS. Besides these methods a
+# repository provides:
+#
+#   versions  - the tracker behind the ETag / Last-Modified headers
+#   events    - the EventBroker behind GET /events
+#
+# Implementations: JsonRepository below (files or memory), SqliteRepository
+# in sqlitedb.py and MongoRepository in database.py.
+class Repository:
+    # Returns (records, next_cursor) for a parsed list query
+    def find(self, name, query):
+        raise NotImplementedError
+
+    def all(self, name):
+        raise NotImplementedError
+
+    # Iterates over the records of an unpaged list query, for streamed
+    # responses. Backends that keep their data elsewhere override it to read
+    # in batches of STREAM_BATCH_SIZE.
+    def iter_find(self, name, query):
+        return iter(self.find(name, query)[0])
+
+    def get(self, name, id):
+        raise NotImplementedError
+
+    def get_by(self, name, field, value):
+        raise NotImplementedError
+
+    def count(self, name):
+        raise NotImplementedError
+
+    # Assigns _id and the timestamps. Raises DuplicateKeyError for a user
+    # whose email is taken.
+    def create(self, name, data):
+        raise NotImplementedError
+
+    # Replaces every client field of a record, keeping its _id and created_at.
+    # Returns None when there is no such record.
+    def replace(self, name, id, data):
+        raise NotImplementedError
+
+    # Applies a partial update (see patch_changes) and returns the record, or
+    # None when there is no such record. `if_match` is the request's If-Match
+    # header (see conditional.py); when it names another version of the
+    # record, PreconditionFailed is raised and nothing is written.
+    def patch(self, name, id, data, if_match=None):
+        raise NotImplementedError
+
+    def delete(self, name, id):
+        raise NotImplementedError
+
+    # Applies a list of operations (see batch.py); returns one result each
+    def batch(self, name, label, operations):
+        raise NotImplementedError
+
+    # Stores records as they are, _id included (seeding and imports)
+    def import_records(self, name, records):
+        raise NotImplementedError
+
+    # Runs a milestone operation (see milestones.py) on a goal, writing only
+    # its milestones and progress; returns (goal, milestone), or None when
+    # the goal does not exist. Raises MilestoneError for a bad operation.
+    def update_milestones(self, id, op, milestone_id=None, data=None):
+        raise NotImplementedError
+
+    # A user's settings, created from DEFAULT_SETTINGS on first access
+    def get_settings(self, user_id):
+        raise NotImplementedError
+
+    # Merges `data` into the user's settings
+    def update_settings(self, user_id, data):
+        raise NotImplementedError
+
+    # The GET /sync response; raises SyncError for a malformed `since`
+    def changes(self, user_id, since):
+        raise NotImplementedError
+
+    def statistics(self, user_id):
+        raise NotImplementedError
+
+    # Recomputes the statistics counters; returns the drift (see stats.py)
+    def verify_statistics(self, rebuild=False):
+        raise NotImplementedError
+
+    # Returns (route, plan, full_scan) for the queries behind the main
+    # routes. Only backends that plan queries implement it.
+    def explain_queries(self, user_id):
+        raise NotImplementedError
+
+    # Connection pool metrics for GET /health, or None without a pool
+    def pool_stats(self):
+        return None
+
+    def close(self):
+        pass
+
+    # Users are looked up by _id or, failing that, by email
+    def find_user(self, id):
+        return self.get('users', id) or self.get_by('users', 'email', id)
+
+    # Stores the progress of goals written before the server computed it;
+    # returns how many were updated
+    def rebuild_progress(self):
+        updated = 0
+        for goal in self.all('goals'):
+            if goal.get('progress') != goal_progress(goal.get('milestones')):
+                self.update_milestones(goal['_id'], 'refresh')
+                updated += 1
+        return updated
+
+    # Open tasks of every user with a due date after `after` and no later
+    # than `until`, earliest first (for the reminder scheduler). Appending
+    # '\0' turns the list query's exclusive due_before into an inclusive
+    # bound, so consecutive windows neither overlap nor leave gaps.
+    def due_tasks(self, after, until):
+        query = parse_list_query({'completed': 'false', 'due_after': after, 'due_before': until + '\0',
+                                  'sort': 'dueDate'})
+        return self.find('tasks', query)[0]
+
+    # Whether a user's settings allow notifications, without creating the
+    # settings as get_settings would
+    def notifications_enabled(self, user_id):
+        settings = self.get_by('settings', 'user_id', user_id) or DEFAULT_SETTINGS
+        return bool(settings.get('notifications', DEFAULT_SETTINGS['notifications']))
+
+def client_fields(data):
+    return {k: v for k, v in data.items() if k not in SERVER_FIELDS}
+
+def settings_fields(data):
+    return {k: v for k, v in client_fields(data).items() if k != 'user_id'}
+
+# Splits a PATCH body into the fields it sets and the fields it removes
+# (those sent as null), leaving out anything the record already holds, so
+# the backends write only what changed. A goal's progress follows its
+# milestones.
+def patch_changes(name, existing, data):
+    data = client_fields(data)
+    if name == 'goals':
+        data.pop('progress', None)
+    fields = {k: v for k, v in data.items()
+              if v is not None and (k not in existing or existing[k] != v or type(existing[k]) is not type(v))}
+    unset = [k for k, v in data.items() if v is None and k in existing]
+    if name == 'goals' and ('milestones' in fields or 'milestones' in unset):
+        progress = goal_progress(fields.get('milestones'))
+        if progress != existing.get('progress'):
+            fields['progress'] = progress
+    return fields, unset
+
+# Repository over the in-memory JSON store (storage.py). The statistics,
+# version counters, change log and event broker all listen to the
+# collections, so they follow every change no matter which route made it.
+class JsonRepository(Repository):
+    def __init__(self, store):
+        self.store = store
+        # Due dates are sorted per user for the due_before / due_after filters,
+        # and across users for the reminder scheduler
+        self.collections = {
+            'tasks': store.collection('tasks', indexes=['user_id', 'category', 'priority'],
+                                      sorted_indexes=[('user_id', 'dueDate'), (None, 'dueDate')]),
+            'goals': store.collection('goals', indexes=['user_id', 'category'],
+                                      sorted_indexes=[('user_id', 'dueDate')]),
+            'users': store.collection('users', unique=['email']),
+            'settings': store.collection('settings', unique=['user_id'])
+        }
+        tasks, goals = self.collections['tasks'], self.collections['goals']
+
+        # Per-user statistics counters, kept up to date as tasks and goals change
+        self.statistics_counters = StatisticsAggregator()
+        self.statistics_counters.watch(tasks, goals)
+
+        # Version counters behind the ETag / Last-Modified headers
+        self.versions = VersionTracker()
+        for name, collection in self.collections.items():
+            self.versions.watch(name, collection)
+
+        # Change sequence and tombstones behind GET /sync
+        self.changelog = ChangeLog()
+        self.changelog.watch('tasks', tasks)
+        self.changelog.watch('goals', goals)
+
+        # Change notifications for GET /events. With several processes sharing
+        # the data directory, other workers' writes are picked up by polling
+        # the files once a second while anyone is listening.
+        self.events = EventBroker(poll_interval=1.0 if store.shared else None)
+        for name in ('tasks', 'goals', 'settings'):
+            self.events.watch(name, self.collections[name])
+
+    def find(self, name, query):
+        records = self.collections[name].find_where(query['filters'], due_range(query))
+        return apply_list_query(query, records)
+
+    def all(self, name):
+        return self.collections[name].all()
+
+    def get(self, name, id):
+        return self.collections[name].get(id)
+
+    def get_by(self, name, field, value):
+        return self.collections[name].get_by(field, value)
+
+    def count(self, name):
+        return self.collections[name].count()
+
+    def create(self, name, data):
+        record = with_progress(name, client_fields(data))
+        record['_id'] = str(uuid.uuid4())
+        record['created_at'] = datetime.utcnow()
+        record['updated_at'] = datetime.utcnow()
+        return self.collections[name].insert(record)
+
+    def replace(self, name, id, data):
+        collection = self.collections[name]
+        with collection.batch():
+            existing = collection.get(id)
+            if existing is None:
+                return None
+            record = with_progress(name, client_fields(data))
+            record['_id'] = id
+            if 'created_at' in existing:
+                record['created_at'] = existing['created_at']
+            record['updated_at'] = datetime.utcnow()
+            return collection.replace(id, record)
+
+    def patch(self, name, id, data, if_match=None):
+        collection = self.collections[name]
+        with collection.batch():
+            existing = collection.get(id)
+            if existing is None:
+                return None
+            check_if_match(if_match, existing)
+            fields, unset = patch_changes(name, existing, data)
+            if not fields and not unset:
+                return existing
+            fields['updated_at'] = datetime.utcnow()
+            return collection.patch(id, fields, unset)
+
+    def delete(self, name, id):
+        return self.collections[name].delete(id)
+
+    # The whole batch runs under the collection lock and is persisted together
+    def batch(self, name, label, operations):
+        collection = self.collections[name]
+        results = []
+        with collection.batch():
+            for operation in operations:
+                error = check_operation(operation)
+                if error:
+                    results.append(batch_result(400, error=error))
+                    continue
+
+                if operation['op'] == 'create':
+                    record = self.create(name, operation['data'])
+                    results.append(batch_result(201, _id=record['_id'], record=record))
+                    continue
+
+                id = operation['_id']
+                if collection.get(id) is None:
+                    results.append(batch_result(404, _id=id, error='%s not found' % label))
+                elif operation['op'] == 'delete':
+                    collection.delete(id)
+                    results.append(batch_result(200, _id=id))
+                else:
+                    if operation['op'] == 'update':
+                        data = operation['data']
+                    else:
+                        data = dict(collection.get(id), completed=bool(operation.get('completed', True)))
+                    record = self.replace(name, id, data)
+                    results.append(batch_result(200, _id=id, record=record))
+        return results
+
+    def import_records(self, name, records):
+        collection = self.collections[name]
+        with collection.batch():
+            for record in records:
+                collection.insert(with_progress(name, dict(record)))
+
+    # The milestones and progress are patched in place, so in 'wal' mode the
+    # log records just those fields
+    def update_milestones(self, id, op, milestone_id=None, data=None):
+        goals = self.collections['goals']
+        with goals.batch():
+            goal = goals.get(id)
+            if goal is None:
+                return None
+            milestones, milestone = apply_operation(milestone_list(goal), op, milestone_id, data)
+            goal = goals.patch(id, {
+                'milestones': milestones,
+                'progress': goal_progress(milestones),
+                'updated_at': datetime.utcnow()
+            })
+        return goal, milestone
+
+    def get_settings(self, user_id):
+        settings = self.collections['settings']
+        with settings.batch():
+            existing = settings.get_by('user_id', user_id)
+            if existing is not None:
+                return existing
+            return self.create('settings', dict(DEFAULT_SETTINGS, user_id=user_id))
+
+    def update_settings(self, user_id, data):
+        settings = self.collections['settings']
+        with settings.batch():
+            existing = self.get_settings(user_id)
+            record = dict(existing, **settings_fields(data))
+            record['updated_at'] = datetime.utcnow()
+            return settings.replace(existing['_id'], record)
+
+    def changes(self, user_id, since):
+        return self.changelog.changes(user_id, since)
+
+    def statistics(self, user_id):
+        return self.statistics_counters.statistics(user_id)
+
+    def verify_statistics(self, rebuild=False):
+        return self.statistics_counters.verify(rebuild=rebuild)
+
+    def close(self):
+        self.store.close()
+
+def create_repository(backend=BACKEND, data_dir=DATA_DIR):
+    if backend == 'json':
+        return JsonRepository(JsonStore(data_dir))
+    if backend == 'memory':
+        return JsonRepository(JsonStore(None, mode='memory'))
+    if backend == 'sqlite':
+        from sqlitedb import SqliteRepository
+        return SqliteRepository()
+    if backend == 'mongo':
+        # pymongo is only needed for this backend
+        from database import MongoRepository
+        return MongoRepository.connect()
+    raise ValueError('Unknown TASKX_BACKEND: %s' % backend)
@@ -0,0 +1,633 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlencode
+
+from batch import batch_result, check_operation
+from conditional import check_if_match, version_keys
+from events import EventBroker
+from jsoncodec import dumps, loads
+import metrics
+from milestones import apply_operation, goal_progress, milestone_list, with_progress
+from queries import encode_cursor, parse_dates, parse_list_query, project, sort_value
+from repository import (AUDIT_LIST_QUERIES, DATA_DIR, DEFAULT_SETTINGS, STREAM_BATCH_SIZE, Repository,
+                        client_fields, patch_changes, settings_fields)
+from stats import format_statistics
+from storage import DuplicateKeyError
+from sync import SYNC_COLLECTIONS, SyncError, sync_response
+
+# Location of the database file of the sqlite backend
+SQLITE_PATH = os.environ.get('TASKX_SQLITE_PATH', os.path.join(DATA_DIR, 'taskx.db'))
+
+# Every record is stored whole as JSON in `data`; the fields the API filters,
+# sorts or enforces uniqueness on are copied into columns next to it so SQLite
+# can index them. Goal milestones live in their own table, one row each.
+COLUMNS = {
+    'tasks': ('user_id', 'completed', 'category', 'priority', 'dueDate', 'title', 'created_at', 'updated_at'),
+    'goals': ('user_id', 'completed', 'category', 'dueDate', 'title', 'created_at', 'updated_at'),
+    'users': ('email',),
+    'settings': ('user_id',)
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT PRIMARY KEY, user_id TEXT, completed INTEGER NOT NULL DEFAULT 0, category TEXT,
+    priority TEXT, dueDate TEXT, title TEXT, created_at TEXT, updated_at TEXT, seq INTEGER, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_user_completed ON tasks (user_id, completed);
+CREATE INDEX IF NOT EXISTS tasks_user_category ON tasks (user_id, category);
+CREATE INDEX IF NOT EXISTS tasks_user_priority ON tasks (user_id, priority);
+-- The due date indexes replace (user_id, dueDate) ones; tasks_open_due
+-- serves the reminder scheduler, which looks across users
+DROP INDEX IF EXISTS tasks_user_due;
+CREATE INDEX IF NOT EXISTS tasks_user_due_completed ON tasks (user_id, dueDate, completed);
+CREATE INDEX IF NOT EXISTS tasks_open_due ON tasks (completed, dueDate);
+CREATE INDEX IF NOT EXISTS tasks_user_seq ON tasks (user_id, seq);
+
+CREATE TABLE IF NOT EXISTS goals (
+    id TEXT PRIMARY KEY, user_id TEXT, completed INTEGER NOT NULL DEFAULT 0, category TEXT,
+    dueDate TEXT, title TEXT, created_at TEXT, updated_at TEXT, seq INTEGER, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS goals_user_completed ON goals (user_id, completed);
+CREATE INDEX IF NOT EXISTS goals_user_category ON goals (user_id, category);
+DROP INDEX IF EXISTS goals_user_due;
+CREATE INDEX IF NOT EXISTS goals_user_due_completed ON goals (user_id, dueDate, completed);
+CREATE INDEX IF NOT EXISTS goals_user_seq ON goals (user_id, seq);
+
+CREATE TABLE IF NOT EXISTS milestones (
+    goal_id TEXT NOT NULL REFERENCES goals (id) ON DELETE CASCADE, position INTEGER NOT NULL,
+    milestone_id TEXT, title TEXT, completed INTEGER NOT NULL DEFAULT 0, dueDate TEXT, data TEXT NOT NULL,
+    PRIMARY KEY (goal_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, email TEXT UNIQUE, data TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS settings (id TEXT PRIMARY KEY, user_id TEXT UNIQUE, data TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS tombstones (
+    seq INTEGER PRIMARY KEY, collection TEXT NOT NULL, record_id TEXT NOT NULL, user_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tombstones_user_seq ON tombstones (user_id, seq);
+
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+
+CREATE TABLE IF NOT EXISTS versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL, modified REAL NOT NULL);
+'''
+
+def to_json(record):
+    return dumps(record)
+
+# Timestamps come back as datetimes, as they do from MongoDB
+def from_json(data):
+    return parse_dates(loads(data))
+
+# Helper function for the value stored in an indexed column
+def column_value(field, value):
+    if field == 'completed':
+        return 1 if value else 0
+    value = sort_value(value)
+    if isinstance(value, (dict, list)):
+        return to_json(value)
+    return value
+
+MILESTONE_INSERT = ('INSERT INTO milestones (goal_id, position, milestone_id, title, completed, dueDate, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+def milestone_row(goal_id, position, milestone):
+    return (goal_id, position, column_value('id', milestone.get('id')), column_value('title', milestone.get('title')),
+            column_value('completed', milestone.get('completed')), column_value('dueDate', milestone.get('dueDate')),
+            to_json(milestone))
+
+# Helper function to translate a parsed list query into SQL, so filtering,
+# sorting and keyset paging all happen inside SQLite. Only field names the
+# query parser accepts are ever interpolated.
+def build_select(name, query):
+    def column(field):
+        return field if field in COLUMNS[name] else "json_extract(data, '$.%s')" % field
+
+    where = []
+    params = []
+    for field, value in query['filters'].items():
+        where.append('%s = ?' % column(field))
+        params.append(value)
+    if query['completed'] is not None:
+        where.append('completed = ?')
+        params.append(1 if query['completed'] else 0)
+    if query['due_after'] is not None or query['due_before'] is not None:
+        # > '' also skips records without a due date
+        where.append('dueDate > ?')
+        params.append(query['due_after'] or '')
+        if query['due_before'] is not None:
+            where.append('dueDate < ?')
+            params.append(query['due_before'])
+
+    direction = 'DESC' if query['descending'] else 'ASC'
+    op = '<' if query['descending'] else '>'
+    cursor = query['cursor']
+    field = query['sort'] and column(query['sort'])
+    if cursor:
+        if not field:
+            where.append('id %s ?' % op)
+            params.append(cursor['_id'])
+        elif cursor.get('value') is None:
+            # Missing values sort before everything else
+            after = '(%s IS NULL AND id %s ?)' % (field, op)
+            if not query['descending']:
+                after = '(%s OR %s IS NOT NULL)' % (after, field)
+            where.append(after)
+            params.append(cursor['_id'])
+        else:
+            after = '%s %s ? OR (%s = ? AND id %s ?)' % (field, op, field, op)
+            if query['descending']:
+                after += ' OR %s IS NULL' % field
+            where.append('(%s)' % after)
+            params.extend([cursor['value'], cursor['value'], cursor['_id']])
+
+    sql = 'SELECT data FROM %s' % name
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    if query['sort'] or query['cursor'] or query['limit']:
+        order = ['id %s' % direction]
+        if field:
+            order.insert(0, '%s %s' % (field, direction))
+        sql += ' ORDER BY ' + ', '.join(order)
+    if query['limit']:
+        # Fetch one extra record to learn whether there is a next page
+        sql += ' LIMIT %d' % (query['limit'] + 1)
+    return sql, params
+
+# Version counters behind the ETag / Last-Modified headers, kept in the
+# versions table so every worker process sees the same values
+class SqliteVersionTracker:
+    token = ''
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def bump(self, name, *records):
+        now = time.time()
+        with self.repository.transaction() as db:
+            db.executemany(
+                'INSERT INTO versions (key, version, modified) VALUES (?, 1, ?) '
+                'ON CONFLICT (key) DO UPDATE SET version = version + 1, modified = excluded.modified',
+                [(key, now) for key in version_keys(name, records)]
+            )
+
+    def get(self, keys):
+        db = self.repository.connection()
+        rows = db.execute('SELECT key, version, modified FROM versions WHERE key IN (%s)' % ', '.join('?' * len(keys)),
+                          keys).fetchall()
+        found = {key: (version, modified) for key, version, modified in rows}
+        return [found.get(key, (0, None)) for key in keys]
+
+# Repository over a single SQLite database file (see repository.py for the
+# interface). Each thread gets its own connection, and the database runs in
+# WAL mode so readers never wait for the writer. The statements are constant
+# strings with ? parameters, so each connection prepares them once and
+# reuses them from its statement cache.
+#
+# Statistics are plain GROUP BY queries over the indexes; the change
+# sequence behind GET /sync is a counter row, a seq column on tasks and
+# goals and a tombstones table, as in the MongoDB backend.
+class SqliteRepository(Repository):
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+        self.versions = SqliteVersionTracker(self)
+        # Change notifications are published by the process that made the
+        # change, once its transaction has committed
+        self.events = EventBroker()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            # Transactions are managed explicitly (see transaction())
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=256)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            db.execute('PRAGMA foreign_keys = ON')
+            self.local.db = db
+            self.local.pending = []
+        return db
+
+    # Runs the block in one write transaction. Nested blocks join the
+    # enclosing transaction; events are published once it commits.
+    @contextmanager
+    def transaction(self):
+        db = self.connection()
+        if db.in_transaction:
+            yield db
+            return
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.rollback()
+            self.local.pending = []
+            raise
+        db.commit()
+        pending, self.local.pending = self.local.pending, []
+        for name, old, new in pending:
+            self.events.record_changed(name, old, new)
+
+    def next_seq(self, count=1):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO counters (name, value) VALUES ('sync', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (count,)
+            )
+            value = db.execute("SELECT value FROM counters WHERE name = 'sync'").fetchone()[0]
+        return value - count + 1
+
+    # Records a list of (old, new) changes: bumps the version counters,
+    # queues /events notifications and, for tasks and goals, leaves
+    # tombstones for deleted records and records handed to another user
+    def record_changes(self, name, changes):
+        if not changes:
+            return
+        self.versions.bump(name, *[record for change in changes for record in change])
+        if name != 'users':
+            self.local.pending.extend((name, old, new) for old, new in changes)
+        if name not in SYNC_COLLECTIONS:
+            return
+
+        tombstones = [(name, str(old['_id']), old['user_id']) for old, new in changes
+                      if old is not None and old.get('user_id') is not None
+                      and (new is None or new.get('user_id') != old['user_id'])]
+        if tombstones:
+            seq = self.next_seq(len(tombstones))
+            self.connection().executemany(
+                'INSERT INTO tombstones (seq, collection, record_id, user_id) VALUES (?, ?, ?, ?)',
+                [(seq + offset,) + tombstone for offset, tombstone in enumerate(tombstones)]
+            )
+
+    # Reads records back from their rows, attaching the goals' milestones
+    def load(self, name, rows):
+        rows = [row[0] for row in rows]
+        metrics.count_bytes('read', sum(map(len, rows)))
+        records = [from_json(data) for data in rows]
+        if name != 'goals' or not records:
+            return records
+        milestones = {}
+        ids = [record['_id'] for record in records]
+        db = self.connection()
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = db.execute('SELECT goal_id, data FROM milestones WHERE goal_id IN (%s) ORDER BY goal_id, position'
+                              % ', '.join('?' * len(chunk)), chunk)
+            for goal_id, data in rows:
+                milestones.setdefault(goal_id, []).append(loads(data))
+        for record in records:
+            if isinstance(record.get('milestones'), list):
+                record['milestones'] = milestones.get(record['_id'], [])
+        return records
+
+    # Writes a record (insert or replace) along with its milestones
+    def store(self, name, record, seq=None):
+        columns = COLUMNS[name]
+        data = record
+        milestones = record.get('milestones') if name == 'goals' else None
+        if isinstance(milestones, list):
+            data = dict(record, milestones=[])
+        values = [record['_id']] + [column_value(field, record.get(field)) for field in columns]
+        names = ['id'] + list(columns)
+        if name in SYNC_COLLECTIONS:
+            names.append('seq')
+            values.append(seq)
+        names.append('data')
+        values.append(to_json(data))
+        metrics.count_bytes('written', len(values[-1]))
+
+        # An upsert on id only, so a clash on a unique column still fails
+        db = self.connection()
+        try:
+            db.execute('INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (id) DO UPDATE SET %s'
+                       % (name, ', '.join(names), ', '.join('?' * len(names)),
+                          ', '.join('%s = excluded.%s' % (n, n) for n in names[1:])),
+                       values)
+        except sqlite3.IntegrityError:
+            raise DuplicateKeyError('Duplicate value for %s: %s' % (columns[0], record.get(columns[0])))
+        if name == 'goals':
+            self.store_milestones(record['_id'], milestones if isinstance(milestones, list) else None)
+        return record
+
+    # Replaces the milestone rows of a goal
+    def store_milestones(self, goal_id, milestones):
+        db = self.connection()
+        db.execute('DELETE FROM milestones WHERE goal_id = ?', (goal_id,))
+        if milestones:
+            db.executemany(MILESTONE_INSERT, [milestone_row(goal_id, position, m)
+                                              for position, m in enumerate(milestones) if isinstance(m, dict)])
+
+    def find(self, name, query):
+        sql, params = build_select(name, query)
+        records = self.load(name, self.connection().execute(sql, params))
+        metrics.count_records(name, len(records))
+        next_cursor = None
+        if query['limit'] and len(records) > query['limit']:
+            records = records[:query['limit']]
+            next_cursor = encode_cursor(query, records[-1])
+        return [project(query, record) for record in records], next_cursor
+
+    def iter_find(self, name, query):
+        sql, params = build_select(name, query)
+        rows = self.connection().execute(sql, params)
+        while True:
+            batch = rows.fetchmany(STREAM_BATCH_SIZE)
+            if not batch:
+                return
+            for record in self.load(name, batch):
+                yield project(query, record)
+
+    def all(self, name):
+        return self.load(name, self.connection().execute('SELECT data FROM %s ORDER BY rowid' % name))
+
+    def get(self, name, id):
+        records = self.load(name, self.connection().execute('SELECT data FROM %s WHERE id = ?' % name, (id,)))
+        return records[0] if records else None
+
+    def get_by(self, name, field, value):
+        column = field if field in COLUMNS[name] else "json_extract(data, '$.%s')" % field
+        rows = self.connection().execute('SELECT data FROM %s WHERE %s = ? LIMIT 1' % (name, column), (value,))
+        records = self.load(name, rows)
+        return records[0] if records else None
+
+    def count(self, name):
+        return self.connection().execute('SELECT COUNT(*) FROM %s' % name).fetchone()[0]
+
+    def create(self, name, data):
+        record = with_progress(name, client_fields(data))
+        record['_id'] = str(uuid.uuid4())
+        record['created_at'] = datetime.utcnow()
+        record['updated_at'] = datetime.utcnow()
+        with self.transaction():
+            seq = self.next_seq() if name in SYNC_COLLECTIONS else None
+            self.store(name, record, seq)
+            self.record_changes(name, [(None, record)])
+        return record
+
+    def replace(self, name, id, data):
+        with self.transaction():
+            old = self.get(name, id)
+            if old is None:
+                return None
+            record = with_progress(name, client_fields(data))
+            record['_id'] = id
+            if 'created_at' in old:
+                record['created_at'] = old['created_at']
+            record['updated_at'] = datetime.utcnow()
+            seq = self.next_seq() if name in SYNC_COLLECTIONS else None
+            self.store(name, record, seq)
+            self.record_changes(name, [(old, record)])
+        return record
+
+    # The JSON in `data` is edited with json_set / json_remove and only the
+    # columns of changed fields are rewritten
+    def patch(self, name, id, data, if_match=None):
+        with self.transaction() as db:
+            old = self.get(name, id)
+            if old is None:
+                return None
+            check_if_match(if_match, old)
+            fields, unset = patch_changes(name, old, data)
+            if not fields and not unset:
+                return old
+            fields['updated_at'] = datetime.utcnow()
+            record = dict(old, **fields)
+            for field in unset:
+                del record[field]
+
+            stored = dict(fields)
+            if name == 'goals' and ('milestones' in fields or 'milestones' in unset):
+                milestones = fields.get('milestones')
+                self.store_milestones(id, milestones if isinstance(milestones, list) else None)
+                if isinstance(milestones, list):
+                    stored['milestones'] = []
+            expression, params = 'data', []
+            if stored:
+                expression = 'json_set(data, %s)' % ', '.join('?, json(?)' for _ in stored)
+                for field, value in stored.items():
+                    params += ['$."%s"' % field, to_json(value)]
+            if unset:
+                expression = 'json_remove(%s, %s)' % (expression, ', '.join('?' for _ in unset))
+                params += ['$."%s"' % field for field in unset]
+            assignments = ['data = %s' % expression]
+            for field in COLUMNS[name]:
+                if field in fields or field in unset:
+                    assignments.append('%s = ?' % field)
+                    params.append(column_value(field, record.get(field)))
+            if name in SYNC_COLLECTIONS:
+                assignments.append('seq = ?')
+                params.append(self.next_seq())
+            try:
+                db.execute('UPDATE %s SET %s WHERE id = ?' % (name, ', '.join(assignments)), params + [id])
+            except sqlite3.IntegrityError:
+                raise DuplicateKeyError('Duplicate value for %s: %s' % (COLUMNS[name][0], record.get(COLUMNS[name][0])))
+            self.record_changes(name, [(old, record)])
+        return record
+
+    def delete(self, name, id):
+        with self.transaction() as db:
+            old = self.get(name, id)
+            if old is None:
+                return False
+            db.execute('DELETE FROM %s WHERE id = ?' % name, (id,))
+            self.record_changes(name, [(old, None)])
+        return True
+
+    # The whole batch is a single transaction
+    def batch(self, name, label, operations):
+        results = []
+        with self.transaction():
+            for operation in operations:
+                error = check_operation(operation)
+                if error:
+                    results.append(batch_result(400, error=error))
+                    continue
+
+                if operation['op'] == 'create':
+                    record = self.create(name, operation['data'])
+                    results.append(batch_result(201, _id=record['_id'], record=record))
+                    continue
+
+                id = operation['_id']
+                existing = self.get(name, id)
+                if existing is None:
+                    results.append(batch_result(404, _id=id, error='%s not found' % label))
+                elif operation['op'] == 'delete':
+                    self.delete(name, id)
+                    results.append(batch_result(200, _id=id))
+                else:
+                    if operation['op'] == 'update':
+                        data = operation['data']
+                    else:
+                        data = dict(existing, completed=bool(operation.get('completed', True)))
+                    record = self.replace(name, id, data)
+                    results.append(batch_result(200, _id=id, record=record))
+        return results
+
+    def import_records(self, name, records):
+        if not records:
+            return
+        with self.transaction():
+            seq = self.next_seq(len(records)) if name in SYNC_COLLECTIONS else None
+            records = [with_progress(name, dict(record)) for record in records]
+            for offset, record in enumerate(records):
+                self.store(name, record, seq + offset if seq is not None else None)
+            self.record_changes(name, [(None, record) for record in records])
+
+    # Only the affected milestone rows change; the goal row gets the new
+    # progress and timestamp through json_set instead of being rewritten
+    def update_milestones(self, id, op, milestone_id=None, data=None):
+        with self.transaction() as db:
+            old = self.get('goals', id)
+            if old is None:
+                return None
+            milestones, milestone = apply_operation(milestone_list(old), op, milestone_id, data)
+            if not isinstance(old.get('milestones'), list) or op in ('reorder', 'refresh'):
+                self.store_milestones(id, milestones)
+            elif op == 'add':
+                position = db.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM milestones WHERE goal_id = ?',
+                                      (id,)).fetchone()[0]
+                db.execute(MILESTONE_INSERT, milestone_row(id, position, milestone))
+            elif op == 'update':
+                db.execute('UPDATE milestones SET title = ?, completed = ?, dueDate = ?, data = ? '
+                           'WHERE goal_id = ? AND milestone_id = ?',
+                           milestone_row(id, None, milestone)[3:] + (id, column_value('id', milestone.get('id'))))
+            else:
+                db.execute('DELETE FROM milestones WHERE goal_id = ? AND milestone_id = ?',
+                           (id, column_value('id', milestone.get('id'))))
+
+            record = dict(old, milestones=milestones, progress=goal_progress(milestones), updated_at=datetime.utcnow())
+            db.execute("UPDATE goals SET data = json_set(data, '$.milestones', json('[]'), '$.progress', ?, "
+                       "'$.updated_at', ?), updated_at = ?, seq = ? WHERE id = ?",
+                       (record['progress'], record['updated_at'].isoformat(),
+                        column_value('updated_at', record['updated_at']), self.next_seq(), id))
+            self.record_changes('goals', [(old, record)])
+        return record, milestone
+
+    def get_settings(self, user_id):
+        settings = self.get_by('settings', 'user_id', user_id)
+        if settings is not None:
+            return settings
+        with self.transaction():
+            # Another request may have created them since the check above
+            settings = self.get_by('settings', 'user_id', user_id)
+            if settings is None:
+                settings = self.create('settings', dict(DEFAULT_SETTINGS, user_id=user_id))
+        return settings
+
+    def update_settings(self, user_id, data):
+        with self.transaction():
+            existing = self.get_settings(user_id)
+            record = dict(existing, **settings_fields(data))
+            record['updated_at'] = datetime.utcnow()
+            self.store('settings', record)
+            self.record_changes('settings', [(existing, record)])
+        return record
+
+    def changes(self, user_id, since):
+        if since:
+            try:
+                since = int(since)
+            except ValueError:
+                raise SyncError('Invalid since value')
+
+        db = self.connection()
+        changed = {}
+        deleted = {}
+        # One read transaction, so the sequence and the data agree
+        db.execute('BEGIN')
+        try:
+            row = db.execute("SELECT value FROM counters WHERE name = 'sync'").fetchone()
+            current = row[0] if row else 0
+
+            if not since or since > current:
+                # First sync, or a sequence this database never handed out
+                for name in SYNC_COLLECTIONS:
+                    changed[name] = self.load(name, db.execute(
+                        'SELECT data FROM %s WHERE user_id = ? ORDER BY rowid' % name, (user_id,)))
+                return sync_response(str(current), True, changed, deleted)
+
+            for name in SYNC_COLLECTIONS:
+                changed[name] = self.load(name, db.execute(
+                    'SELECT data FROM %s WHERE user_id = ? AND seq > ? ORDER BY seq' % name, (user_id, since)))
+
+            tombstones = db.execute('SELECT collection, record_id FROM tombstones WHERE user_id = ? AND seq > ? '
+                                    'ORDER BY seq', (user_id, since))
+            for name, record_id in tombstones:
+                # A record that came back to this user since is reported as changed
+                if record_id not in set(record['_id'] for record in changed[name]):
+                    deleted.setdefault(name, []).append(record_id)
+            return sync_response(str(current), False, changed, deleted)
+        finally:
+            db.commit()
+
+    # Counters in the same shape the other backends maintain incrementally,
+    # computed with GROUP BY queries over the (user_id, ...) indexes
+    def statistics(self, user_id):
+        counters = {}
+        rows = self.connection().execute(
+            "SELECT 'tasks', 'by_category', category, COUNT(*), SUM(completed) FROM tasks WHERE user_id = ? "
+            "GROUP BY category "
+            "UNION ALL SELECT 'tasks', 'by_priority', priority, COUNT(*), SUM(completed) FROM tasks WHERE user_id = ? "
+            "GROUP BY priority "
+            "UNION ALL SELECT 'goals', NULL, NULL, COUNT(*), SUM(completed) FROM goals WHERE user_id = ?",
+            (user_id, user_id, user_id)
+        )
+        for section, group, key, total, completed in rows:
+            if group == 'by_category':
+                counters[('tasks', 'total')] = counters.get(('tasks', 'total'), 0) + total
+                counters[('tasks', 'completed')] = counters.get(('tasks', 'completed'), 0) + completed
+                counters[('tasks', 'by_category', key if key is not None else 'Uncategorized')] = total
+            elif group == 'by_priority':
+                counters[('tasks', 'by_priority', key if key is not None else 'medium')] = total
+            else:
+                counters[('goals', 'total')] = total
+                counters[('goals', 'completed')] = completed or 0
+        return format_statistics(counters)
+
+    # Statistics are computed on every request, so there is nothing to drift
+    def verify_statistics(self, rebuild=False):
+        return []
+
+    def explain_queries(self, user_id):
+        statements = []
+        for name, queries in AUDIT_LIST_QUERIES.items():
+            for args in queries:
+                args = dict(args, user_id=user_id)
+                statements.append(('GET /%s?%s' % (name, urlencode(args)),) + build_select(name, parse_list_query(args)))
+            statements.append(('GET /sync (%s)' % name,
+                               'SELECT data FROM %s WHERE user_id = ? AND seq > ? ORDER BY seq' % name, (user_id, 0)))
+        statements.append(('GET /sync (tombstones)',
+                           'SELECT collection, record_id FROM tombstones WHERE user_id = ? AND seq > ? ORDER BY seq',
+                           (user_id, 0)))
+        statements.append(('GET /users/<email>', 'SELECT data FROM users WHERE email = ?', ('user@example.com',)))
+        statements.append(('GET /settings/<user_id>', 'SELECT data FROM settings WHERE user_id = ?', (user_id,)))
+        statements.append(('GET /statistics/<user_id>',
+                           'SELECT category, COUNT(*), SUM(completed) FROM tasks WHERE user_id = ? GROUP BY category',
+                           (user_id,)))
+
+        plans = []
+        db = self.connection()
+        for label, sql, params in statements:
+            details = [row[3] for row in db.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+            # "SCAN <table>" without an index reads every row
+            full_scan = any(detail.startswith('SCAN ') and 'INDEX' not in detail for detail in details)
+            plans.append((label, '; '.join(details), full_scan))
+        return plans
+
+    def close(self):
+        db = getattr(self.local, 'db', None)
+        if db is not None:
+            db.close()
+            self.local.db = None
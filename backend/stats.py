@@ -0,0 +1,153 @@
+import threading
+from urllib.parse import unquote
+
+# Per-user statistics are kept as flat counters keyed by a path tuple such as
+# ('tasks', 'completed') or ('tasks', 'by_category', 'Work'). Every task or
+# goal contributes +1 to a handful of paths; a change is the difference
+# between the new and the old contribution.
+
+def task_contribution(task):
+    if task is None:
+        return {}
+    return {
+        ('tasks', 'total'): 1,
+        ('tasks', 'completed'): 1 if task.get('completed') else 0,
+        ('tasks', 'by_category', task.get('category', 'Uncategorized')): 1,
+        ('tasks', 'by_priority', task.get('priority', 'medium')): 1
+    }
+
+def goal_contribution(goal):
+    if goal is None:
+        return {}
+    return {
+        ('goals', 'total'): 1,
+        ('goals', 'completed'): 1 if goal.get('completed') else 0
+    }
+
+# Returns {user_id: {path: delta}} for a record going from old to new. A
+# record that moved between users is removed from one and added to the other.
+def contribution_delta(contribution, old, new):
+    deltas = {}
+    for record, sign in ((old, -1), (new, 1)):
+        if record is None or record.get('user_id') is None:
+            continue
+        user_delta = deltas.setdefault(record['user_id'], {})
+        for path, count in contribution(record).items():
+            user_delta[path] = user_delta.get(path, 0) + sign * count
+    for user_id, user_delta in deltas.items():
+        deltas[user_id] = {path: n for path, n in user_delta.items() if n}
+    return deltas
+
+def compute_counters(tasks, goals):
+    counters = {}
+    for contribution, records in ((task_contribution, tasks), (goal_contribution, goals)):
+        for record in records:
+            for user_id, delta in contribution_delta(contribution, None, record).items():
+                apply_delta(counters.setdefault(user_id, {}), delta)
+    return counters
+
+def apply_delta(counters, delta):
+    for path, n in delta.items():
+        counters[path] = counters.get(path, 0) + n
+        if not counters[path]:
+            del counters[path]
+
+# Lists every (user_id, path, stored, actual) where two sets of counters disagree
+def diff_counters(stored, actual):
+    drift = []
+    for user_id in sorted(set(stored) | set(actual), key=str):
+        mine = stored.get(user_id, {})
+        theirs = actual.get(user_id, {})
+        for path in sorted(set(mine) | set(theirs), key=str):
+            if mine.get(path, 0) != theirs.get(path, 0):
+                drift.append((user_id, path, mine.get(path, 0), theirs.get(path, 0)))
+    return drift
+
+# Builds the /statistics response from a user's counters
+def format_statistics(counters):
+    tasks_total = counters.get(('tasks', 'total'), 0)
+    tasks_completed = counters.get(('tasks', 'completed'), 0)
+    goals_total = counters.get(('goals', 'total'), 0)
+    goals_completed = counters.get(('goals', 'completed'), 0)
+    return {
+        'tasks': {
+            'total': tasks_total,
+            'completed': tasks_completed,
+            'pending': tasks_total - tasks_completed,
+            'by_category': [{'_id': path[2], 'count': n} for path, n in counters.items()
+                            if path[:2] == ('tasks', 'by_category') and n],
+            'by_priority': [{'_id': path[2], 'count': n} for path, n in counters.items()
+                            if path[:2] == ('tasks', 'by_priority') and n]
+        },
+        'goals': {
+            'total': goals_total,
+            'completed': goals_completed,
+            'in_progress': goals_total - goals_completed
+        }
+    }
+
+# MongoDB stores the counters as a nested document per user, so category and
+# priority names are escaped to be usable as field names
+def escape_key(key):
+    return str(key).replace('%', '%25').replace('.', '%2E').replace('$', '%24')
+
+def to_mongo_path(path):
+    return '.'.join(escape_key(part) for part in path)
+
+def to_mongo_document(user_id, counters):
+    document = {'user_id': user_id}
+    for path, n in counters.items():
+        target = document
+        for part in path[:-1]:
+            target = target.setdefault(escape_key(part), {})
+        target[escape_key(path[-1])] = n
+    return document
+
+def from_mongo_document(document):
+    counters = {}
+    if not document:
+        return counters
+    for section in ('tasks', 'goals'):
+        for key, value in document.get(section, {}).items():
+            if isinstance(value, dict):
+                for name, n in value.items():
+                    if n:
+                        counters[(section, key, unquote(name))] = n
+            elif value:
+                counters[(section, key)] = value
+    return counters
+
+# Keeps the counters for the JSON backend in memory. It listens to the task
+# and goal collections, so the counters are built while the files load and
+# follow every insert, replace and delete after that.
+class StatisticsAggregator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def watch(self, tasks, goals):
+        self.tasks = tasks
+        self.goals = goals
+        tasks.listeners.append(lambda old, new: self._changed(task_contribution, old, new))
+        goals.listeners.append(lambda old, new: self._changed(goal_contribution, old, new))
+
+    def _changed(self, contribution, old, new):
+        with self.lock:
+            for user_id, delta in contribution_delta(contribution, old, new).items():
+                apply_delta(self.counters.setdefault(user_id, {}), delta)
+
+    def statistics(self, user_id):
+        # Touching the collections makes sure both are loaded
+        self.tasks.count()
+        self.goals.count()
+        with self.lock:
+            return format_statistics(dict(self.counters.get(user_id, {})))
+
+    def verify(self, rebuild=False):
+        with self.tasks.batch(), self.goals.batch():
+            actual = compute_counters(self.tasks.all(), self.goals.all())
+            with self.lock:
+                drift = diff_counters(self.counters, actual)
+                if rebuild:
+                    self.counters = actual
+        return drift
@@ -0,0 +1,761 @@
+import atexit
+import bisect
+import os
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import metrics
+from jsoncodec import dumpb, dumps, loads
+from queries import parse_dates
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 'snapshot' rewrites each data file in the background; 'wal' appends every
+# mutation to a per-collection log and folds it into the data file later;
+# 'memory' never touches the disk (for tests and throwaway instances)
+STORAGE_MODE = os.environ.get('TASKX_STORAGE_MODE', 'snapshot')
+
+# Set when several worker processes serve the same data directory. Every
+# change is then written through under an exclusive file lock instead of
+# being flushed in the background.
+MULTIPROCESS = os.environ.get('TASKX_MULTIPROCESS', '').lower() in ('1', 'true', 'yes')
+
+# How long dirty collections may sit in memory before being written back,
+# and how many unflushed mutations force an early flush
+FLUSH_INTERVAL = float(os.environ.get('TASKX_FLUSH_INTERVAL', '1.0'))
+FLUSH_THRESHOLD = int(os.environ.get('TASKX_FLUSH_THRESHOLD', '100'))
+
+# Size in bytes a write-ahead log may reach before it is compacted
+WAL_COMPACT_BYTES = int(os.environ.get('TASKX_WAL_COMPACT_BYTES', str(1024 * 1024)))
+
+# mkstemp creates files readable by their owner only. Rewritten data files
+# keep the mode of the file they replace, and new ones get the default mode
+# for the process umask (read once here, as reading it means setting it).
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def file_mode(file_path):
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+# Helper functions for file operations. Data files are compact JSON (see
+# jsoncodec.py); files written with indentation by earlier versions still load.
+def read_json_file(file_path):
+    if not os.path.exists(file_path):
+        return []
+    with metrics.timed('file', 'read'):
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        metrics.count_bytes('read', len(data))
+        return loads(data)
+
+def write_json_file(file_path, data):
+    # Write to a temporary file and swap it in, so a crash never leaves a
+    # half-written data file behind and readers always see a whole file
+    data = dumpb(data)
+    with metrics.timed('file', 'write'):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', suffix='.tmp')
+        try:
+            os.chmod(tmp_path, file_mode(file_path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    metrics.count_bytes('written', len(data))
+
+def read_log_file(file_path, offset=0):
+    # Returns the entries logged after `offset` plus the offset just past the
+    # last intact one
+    entries = []
+    if not os.path.exists(file_path):
+        return entries, 0
+    start = offset
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                # A torn final line from a crash (or a writer in another
+                # process) mid-append; everything before it is intact
+                break
+            try:
+                entries.append(loads(line))
+            except ValueError:
+                break
+            offset += len(line)
+        metrics.count_bytes('read', f.tell() - start)
+    return entries, offset
+
+# Helper functions for the record a log entry leaves behind, given the one
+# before it. A patch carries only the fields it set and the ones it removed;
+# one whose record is gone leaves nothing.
+def logged_record(entry, current):
+    if entry.get('op') == 'patch':
+        return parse_dates(patched_record(current, entry)) if current is not None else None
+    record = entry.get('record')
+    return parse_dates(record) if record is not None else None
+
+def patched_record(record, change):
+    record = dict(record, **change['fields'])
+    for field in change.get('unset', ()):
+        record.pop(field, None)
+    return record
+
+class DuplicateKeyError(Exception):
+    pass
+
+# A reader-writer lock: any number of threads may read at once, writers get
+# exclusive access. Both sides are re-entrant, and a thread holding the
+# write lock may also read. Waiting writers block new readers so a steady
+# stream of GETs cannot starve mutations.
+class RWLock:
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me and me not in self._readers:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers[me] -= 1
+                if not self._readers[me]:
+                    del self._readers[me]
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                if me in self._readers:
+                    raise RuntimeError('Cannot upgrade a read lock to a write lock')
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._writer_depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+# Advisory lock shared by every process using the same data directory. The
+# lock file also holds two counters: `generation` is bumped on every change
+# and `snapshot` whenever the data file itself is rewritten, so other
+# processes can tell cheaply whether (and how much) to reload.
+class FileLock:
+    SIZE = 40
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError('TASKX_MULTIPROCESS needs fcntl, which this platform lacks')
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire(self, exclusive):
+        fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def release(self):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def read(self):
+        try:
+            generation, snapshot = os.pread(self.fd, self.SIZE, 0).split()
+            return int(generation), int(snapshot)
+        except ValueError:
+            return 0, 0
+
+    def write(self, generation, snapshot):
+        os.pwrite(self.fd, ('%d %d' % (generation, snapshot)).ljust(self.SIZE).encode('ascii'), 0)
+
+# Values kept in order with an id each, split into buckets of at most
+# 2 * BUCKET_SIZE entries; `maxes` holds the last value of every bucket. A
+# flat list would move half of its entries on every insert or delete (O(n)).
+# Here one bisection over `maxes` picks the bucket and one inside it the
+# position, so the only entries moved are those of one bucket. A full bucket
+# is split in two; an empty one is dropped. Equal values keep the order they
+# were added in.
+BUCKET_SIZE = 512
+
+class SortedBuckets:
+    def __init__(self):
+        self.values = []
+        self.ids = []
+        self.maxes = []
+
+    def __len__(self):
+        return len(self.maxes)
+
+    def add(self, value, id):
+        if not self.maxes:
+            self.values.append([value])
+            self.ids.append([id])
+            self.maxes.append(value)
+            return
+        bucket = min(bisect.bisect_right(self.maxes, value), len(self.maxes) - 1)
+        values, ids = self.values[bucket], self.ids[bucket]
+        position = bisect.bisect_right(values, value)
+        values.insert(position, value)
+        ids.insert(position, id)
+        self.maxes[bucket] = values[-1]
+        if len(values) > 2 * BUCKET_SIZE:
+            self.values.insert(bucket + 1, values[BUCKET_SIZE:])
+            self.ids.insert(bucket + 1, ids[BUCKET_SIZE:])
+            del values[BUCKET_SIZE:]
+            del ids[BUCKET_SIZE:]
+            self.maxes[bucket] = values[-1]
+            self.maxes.insert(bucket + 1, self.values[bucket + 1][-1])
+
+    def remove(self, value, id):
+        bucket = bisect.bisect_left(self.maxes, value)
+        # Equal values can run on across buckets
+        while bucket < len(self.maxes):
+            values, ids = self.values[bucket], self.ids[bucket]
+            position = bisect.bisect_left(values, value)
+            while position < len(values) and values[position] == value:
+                if ids[position] == id:
+                    del values[position]
+                    del ids[position]
+                    if values:
+                        self.maxes[bucket] = values[-1]
+                    else:
+                        del self.values[bucket], self.ids[bucket], self.maxes[bucket]
+                    return
+                position += 1
+            if position < len(values):
+                return
+            bucket += 1
+
+    # (bucket, position) of the first entry whose value is above `value`, or
+    # with right=False, not below it
+    def _locate(self, value, right):
+        find = bisect.bisect_right if right else bisect.bisect_left
+        bucket = find(self.maxes, value)
+        if bucket == len(self.maxes):
+            return bucket, 0
+        return bucket, find(self.values[bucket], value)
+
+    # Ids of the entries whose value lies strictly between `after` and
+    # `before` (None for no bound), in value order
+    def between(self, after=None, before=None):
+        start = self._locate(after, True) if after is not None else (0, 0)
+        end = self._locate(before, False) if before is not None else (len(self.maxes), 0)
+        if start >= end:
+            return []
+        if start[0] == end[0]:
+            return self.ids[start[0]][start[1]:end[1]]
+        ids = self.ids[start[0]][start[1]:]
+        for bucket in range(start[0] + 1, end[0]):
+            ids.extend(self.ids[bucket])
+        if end[0] < len(self.maxes):
+            ids.extend(self.ids[end[0]][:end[1]])
+        return ids
+
+# Keeps a field's values sorted per group (the records sharing the value of
+# `group`, or every record when group is None), so range queries on it are
+# bisections instead of a scan, and adding or removing a record costs a
+# bisection plus a move within one bucket (see SortedBuckets). Only string
+# values are indexed, which covers the ISO dates the API compares as strings.
+class SortedIndex:
+    def __init__(self, group, field):
+        self.group = group
+        self.field = field
+        # group value -> SortedBuckets of (value, id)
+        self.groups = {}
+
+    def _entry(self, record):
+        value = record.get(self.field)
+        key = record.get(self.group) if self.group else None
+        if not isinstance(value, str) or (self.group and key is None):
+            return None, None
+        return key, value
+
+    def add(self, id, record):
+        key, value = self._entry(record)
+        if value is None:
+            return
+        if key not in self.groups:
+            self.groups[key] = SortedBuckets()
+        self.groups[key].add(value, id)
+
+    def remove(self, id, record):
+        key, value = self._entry(record)
+        if value is None or key not in self.groups:
+            return
+        entries = self.groups[key]
+        entries.remove(value, id)
+        if not entries:
+            del self.groups[key]
+
+    # Ids of the group's records whose value lies strictly between `after`
+    # and `before` (None for no bound), in value order
+    def between(self, key, after=None, before=None):
+        if key not in self.groups:
+            return []
+        return self.groups[key].between(after, before)
+
+# A single JSON file held in memory. The file is parsed on first access and
+# every read after that is served from the cached records; mutations only
+# mark the collection dirty and the store writes it back in the background.
+#
+# Records are kept in a dict keyed by _id (which preserves file order), and
+# the fields named in `indexes` / `unique` get hash indexes mapping a value
+# to the ids holding it, so point lookups and per-user filters never scan.
+# Each (group, field) pair in `sorted_indexes` gets a SortedIndex for range
+# queries such as the due date filters.
+#
+# When the store is shared between processes, every change is written
+# through under an exclusive file lock, and reads first check the lock
+# file's counters to pick up what other processes wrote.
+class Collection:
+    def __init__(self, store, file_path, indexes=(), unique=(), name=None, sorted_indexes=()):
+        self.store = store
+        self.name = name
+        self.file_path = file_path
+        base_path = os.path.splitext(file_path)[0] if file_path else None
+        self.log_path = base_path + '.log' if base_path else None
+        self.lock = RWLock()
+        self.records = None
+        self.indexes = {field: {} for field in indexes}
+        self.unique = {field: {} for field in unique}
+        self.sorted_indexes = [SortedIndex(group, field) for group, field in sorted_indexes]
+        # Called as listener(old, new) for every change, including the
+        # records read while loading
+        self.listeners = []
+        self.dirty = 0
+        self.log_size = 0
+        self._log_file = None
+        self._batch_depth = 0
+        self._pending = []
+        self._flush_lock = threading.Lock()
+        self._file_lock = FileLock(base_path + '.lock') if store.shared else None
+        self._generation = None
+
+    def _stale(self):
+        if self.records is None:
+            return True
+        return self._file_lock is not None and self._file_lock.read() != self._generation
+
+    # Brings the in-memory records up to date with the files. Called with the
+    # write lock held (and, when shared, the file lock).
+    def _sync(self):
+        if not self._stale():
+            return
+        if self.store.mode == 'memory':
+            self.records = {}
+            return
+        generation = self._file_lock.read() if self._file_lock else None
+
+        if self.records is not None and self.store.mode == 'wal' and generation[1] == self._generation[1]:
+            # Only the log grew since we last looked; replay the new tail
+            entries, self.log_size = read_log_file(self.log_path, self.log_size)
+            for entry in entries:
+                current = self.records.get(entry['_id'])
+                if current is not None or entry.get('op') != 'patch':
+                    self._apply(entry['_id'], logged_record(entry, current))
+            self.dirty += len(entries)
+            self._drop_torn_tail()
+            self._generation = generation
+            return
+
+        # Load (or reload) the data file. Diffing against what is already in
+        # memory keeps the indexes and listeners up to date on a reload.
+        # Timestamps are parsed back into the datetimes they were written as
+        loaded = {record['_id']: parse_dates(record) for record in read_json_file(self.file_path)}
+        self.dirty = 0
+        if self.store.mode == 'wal':
+            # Replay whatever was logged since the last compaction. Entries
+            # are keyed by _id, so replaying one that already made it into
+            # the data file is harmless.
+            entries, size = read_log_file(self.log_path)
+            for entry in entries:
+                record = logged_record(entry, loaded.get(entry['_id']))
+                if record is None:
+                    loaded.pop(entry['_id'], None)
+                else:
+                    loaded[entry['_id']] = record
+            self.dirty = len(entries)
+            if self._log_file is None:
+                self._log_file = open(self.log_path, 'a')
+            self.log_size = size
+            self._drop_torn_tail()
+
+        if self.records is None:
+            self.records = {}
+        for id in [id for id in self.records if id not in loaded]:
+            self._apply(id, None)
+        for id, record in loaded.items():
+            if self.records.get(id) != record:
+                self._apply(id, record)
+        self._generation = generation
+
+    def _drop_torn_tail(self):
+        # A crash mid-append leaves a partial last line; cut it off so new
+        # entries start on a clean line. Writers in other processes hold the
+        # file lock while appending, so anything past log_size is garbage.
+        if os.path.getsize(self.log_path) > self.log_size:
+            self._log_file.truncate(self.log_size)
+
+    # Stores (or with record=None removes) a record, updates the indexes and
+    # tells the listeners what changed
+    def _apply(self, id, record):
+        old = self.records.pop(id, None) if record is None else self.records.get(id)
+        if old is not None:
+            for field, index in self.indexes.items():
+                ids = index.get(old.get(field))
+                if ids is not None:
+                    ids.pop(id, None)
+                    if not ids:
+                        del index[old.get(field)]
+            for field, index in self.unique.items():
+                if index.get(old.get(field)) == id:
+                    del index[old.get(field)]
+            for index in self.sorted_indexes:
+                index.remove(id, old)
+        if record is not None:
+            self.records[id] = record
+            for field, index in self.indexes.items():
+                if record.get(field) is not None:
+                    index.setdefault(record[field], {})[id] = None
+            for field, index in self.unique.items():
+                if record.get(field) is not None:
+                    index.setdefault(record[field], id)
+            for index in self.sorted_indexes:
+                index.add(id, record)
+        for listener in self.listeners:
+            listener(old, record)
+
+    def _check_unique(self, id, record):
+        for field, index in self.unique.items():
+            owner = index.get(record.get(field))
+            if owner is not None and owner != id:
+                raise DuplicateKeyError('Duplicate value for %s: %s' % (field, record[field]))
+
+    def _touch(self, op, id, record=None):
+        if self.store.mode == 'wal':
+            entry = {'op': op, '_id': id}
+            if op == 'patch':
+                entry.update(record)
+            elif record is not None:
+                entry['record'] = record
+            self._pending.append(dumps(entry) + '\n')
+        self.dirty += 1
+
+    # Persists the mutations of the batch that just ended. Other processes
+    # are only made to resync (by bumping the generation) when entries were
+    # appended to the log or, in snapshot mode, records changed; in 'wal'
+    # mode `dirty` stays up until the next compaction, so it cannot tell.
+    def _commit(self):
+        changed = bool(self._pending) or (self._file_lock is not None and self.store.mode == 'snapshot'
+                                          and self.dirty)
+        if self._pending:
+            data = ''.join(self._pending)
+            self._pending = []
+            with metrics.timed('file', 'append'):
+                self._log_file.write(data)
+                self._log_file.flush()
+                os.fsync(self._log_file.fileno())
+            size = len(data.encode('utf-8'))
+            self.log_size += size
+            metrics.count_bytes('written', size)
+        if self._file_lock is not None and changed:
+            generation, snapshot = self._generation
+            if self.store.mode == 'snapshot':
+                # Other processes read the data file, so write it through
+                write_json_file(self.file_path, list(self.records.values()))
+                self.dirty = 0
+                snapshot += 1
+            self._generation = (generation + 1, snapshot)
+            self._file_lock.write(*self._generation)
+        self.store.notify(self)
+
+    @contextmanager
+    def _reading(self):
+        # Inside a batch the records are already in sync (and re-taking the
+        # file lock as shared would downgrade the batch's exclusive lock)
+        if not self._batch_depth and self._stale():
+            with self.lock.write():
+                if self._file_lock is not None:
+                    self._file_lock.acquire(exclusive=False)
+                try:
+                    self._sync()
+                finally:
+                    if self._file_lock is not None:
+                        self._file_lock.release()
+        with self.lock.read():
+            yield self.records
+
+    # Holds the write lock (and, when shared, the exclusive file lock) with
+    # the records up to date. Every mutation runs inside one; grouping
+    # several mutations in an explicit batch persists them together.
+    @contextmanager
+    def batch(self):
+        with self.lock.write():
+            outermost = not self._batch_depth
+            if outermost and self._file_lock is not None:
+                self._file_lock.acquire(exclusive=True)
+            try:
+                if outermost:
+                    self._sync()
+                self._batch_depth += 1
+                try:
+                    yield self
+                finally:
+                    self._batch_depth -= 1
+                    if outermost:
+                        self._commit()
+            finally:
+                if outermost and self._file_lock is not None:
+                    self._file_lock.release()
+
+    def all(self):
+        with self._reading() as records:
+            return list(records.values())
+
+    def find(self, predicate):
+        with self._reading() as records:
+            return [r for r in records.values() if predicate(r)]
+
+    def find_one(self, predicate):
+        with self._reading() as records:
+            return next((r for r in records.values() if predicate(r)), None)
+
+    # Returns the records whose fields equal every value in `filters`,
+    # starting from the smallest index that covers one of them. `between` is
+    # an optional (field, after, before) range; it only narrows the
+    # candidates when a sorted index covers it, so callers still check it.
+    def find_where(self, filters, between=None):
+        with self._reading() as records:
+            candidates = None
+            if between is not None:
+                index = self._sorted_index(filters, between[0])
+                if index is not None:
+                    candidates = index.between(filters.get(index.group), between[1], between[2])
+            for field, value in filters.items():
+                if field in self.unique:
+                    id = self.unique[field].get(value)
+                    ids = [id] if id is not None else []
+                elif field in self.indexes:
+                    ids = self.indexes[field].get(value, {})
+                else:
+                    continue
+                if candidates is None or len(ids) < len(candidates):
+                    candidates = ids
+            if candidates is None:
+                candidates = records
+            matched = [records[id] for id in candidates
+                       if all(records[id].get(f) == v for f, v in filters.items())]
+            metrics.count_records(self.name, len(matched), scanned=len(candidates))
+            return matched
+
+    # The sorted index on `field` for these filters, preferring one grouped
+    # on a filtered field over one spanning the whole collection
+    def _sorted_index(self, filters, field):
+        found = None
+        for index in self.sorted_indexes:
+            if index.field != field:
+                continue
+            if index.group is None:
+                found = found or index
+            elif index.group in filters:
+                return index
+        return found
+
+    def find_by(self, field, value):
+        return self.find_where({field: value})
+
+    def get_by(self, field, value):
+        records = self.find_by(field, value)
+        return records[0] if records else None
+
+    def get(self, id):
+        with self._reading() as records:
+            return records.get(id)
+
+    def count(self):
+        with self._reading() as records:
+            return len(records)
+
+    def insert(self, record):
+        with self.batch():
+            self._check_unique(record['_id'], record)
+            self._apply(record['_id'], record)
+            self._touch('insert', record['_id'], record)
+        return record
+
+    def replace(self, id, record):
+        with self.batch():
+            if id not in self.records:
+                return None
+            self._check_unique(id, record)
+            self._apply(id, record)
+            self._touch('replace', id, record)
+        return record
+
+    # Sets some fields of a record and removes those in `unset`; in 'wal'
+    # mode only the change is logged, not the whole record
+    def patch(self, id, fields, unset=()):
+        with self.batch():
+            if id not in self.records:
+                return None
+            change = {'fields': fields}
+            if unset:
+                change['unset'] = list(unset)
+            record = patched_record(self.records[id], change)
+            self._check_unique(id, record)
+            self._apply(id, record)
+            self._touch('patch', id, change)
+        return record
+
+    def delete(self, id):
+        with self.batch():
+            if id not in self.records:
+                return False
+            self._apply(id, None)
+            self._touch('delete', id)
+        return True
+
+    def needs_flush(self):
+        if self.store.mode == 'memory':
+            return False
+        if self.store.mode == 'wal':
+            return self.log_size >= self.store.compact_bytes
+        return self.dirty >= self.store.flush_threshold
+
+    def flush(self, force=False):
+        if self.store.mode == 'memory':
+            return False
+        if self.store.mode == 'wal' or self._file_lock is not None:
+            with self.batch():
+                if not self.dirty or self.store.mode != 'wal':
+                    return False
+                # The log is already durable, so only compact once it is big
+                # enough to be worth folding into the snapshot
+                if not force and not self.needs_flush():
+                    return False
+                write_json_file(self.file_path, list(self.records.values()))
+                self._log_file.truncate(0)
+                self.log_size = 0
+                self.dirty = 0
+                if self._file_lock is not None:
+                    generation, snapshot = self._generation
+                    self._generation = (generation + 1, snapshot + 1)
+                    self._file_lock.write(*self._generation)
+            return True
+
+        # Snapshot mode in a single process: take a consistent copy under the
+        # lock but serialize it outside, so readers are not held up
+        with self._flush_lock:
+            with self.lock.read():
+                if not self.dirty or self.records is None:
+                    return False
+                records = list(self.records.values())
+                flushed = self.dirty
+            write_json_file(self.file_path, records)
+            with self.lock.write():
+                self.dirty -= flushed
+        return True
+
+# Owns every collection plus the background thread that flushes them. A flush
+# happens every FLUSH_INTERVAL seconds, or sooner once a collection has
+# collected FLUSH_THRESHOLD unflushed mutations, so a burst of writes turns
+# into a single file rewrite. In WAL mode the same thread acts as the
+# compactor.
+class JsonStore:
+    def __init__(self, data_dir, mode=STORAGE_MODE, shared=MULTIPROCESS, flush_interval=FLUSH_INTERVAL,
+                 flush_threshold=FLUSH_THRESHOLD, compact_bytes=WAL_COMPACT_BYTES):
+        if mode not in ('snapshot', 'wal', 'memory'):
+            raise ValueError('Unknown storage mode: %s' % mode)
+        self.data_dir = data_dir
+        self.mode = mode
+        # There is nothing to share without files
+        self.shared = shared and mode != 'memory'
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.compact_bytes = compact_bytes
+        self.collections = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+        if mode != 'memory' and not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+
+    def collection(self, name, indexes=(), unique=(), sorted_indexes=()):
+        if name not in self.collections:
+            file_path = os.path.join(self.data_dir, name + '.json') if self.mode != 'memory' else None
+            self.collections[name] = Collection(self, file_path, indexes, unique, name, sorted_indexes)
+        return self.collections[name]
+
+    def notify(self, collection):
+        if self.mode == 'memory':
+            return
+        self._start()
+        if collection.needs_flush():
+            self._wakeup.set()
+
+    def flush(self, force=False):
+        flushed = 0
+        for collection in list(self.collections.values()):
+            if collection.flush(force):
+                flushed += 1
+        return flushed
+
+    # Stops the flusher and writes everything back. Safe to call more than
+    # once: an explicit close also unregisters the atexit hook, since the
+    # data directory may be gone by the time the interpreter exits.
+    def close(self):
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+        atexit.unregister(self.close)
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush(force=True)
+
+    def _start(self):
+        # The flusher is only started once something has been written, so
+        # processes that never mutate data (e.g. the reloader parent) stay idle
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='json-store-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
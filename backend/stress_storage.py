@@ -0,0 +1,79 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+
+from storage import JsonStore
+
+# Stress test for the JSON storage layer. Several processes, each running
+# several threads, hammer one data directory the way gunicorn workers would:
+# every thread inserts its own tasks and increments a shared counter with a
+# read-modify-write. Afterwards no insert and no increment may be missing.
+#
+#   python stress_storage.py --processes 4 --threads 4 --writes 200 --mode wal
+
+def worker(data_dir, mode, threads, writes, compact_bytes):
+    store = JsonStore(data_dir, mode=mode, shared=True, flush_interval=0.05, compact_bytes=compact_bytes)
+    tasks = store.collection('tasks', indexes=['user_id'])
+    counters = store.collection('counters')
+
+    def run():
+        for i in range(writes):
+            tasks.insert({'_id': str(uuid.uuid4()), 'title': 'stress %d' % i, 'user_id': 'pid-%d' % os.getpid()})
+            with counters.batch():
+                counter = counters.get('counter')
+                counters.replace('counter', dict(counter, value=counter['value'] + 1))
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    store.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent writers against the JSON store')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--writes', type=int, default=100, help='writes per thread')
+    parser.add_argument('--mode', choices=['snapshot', 'wal'], default='snapshot')
+    parser.add_argument('--compact-bytes', type=int, default=16 * 1024,
+                        help='small by default so WAL runs exercise compaction')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='taskx-stress-')
+    setup = JsonStore(data_dir, mode=args.mode, shared=True)
+    setup.collection('counters').insert({'_id': 'counter', 'value': 0})
+    setup.close()
+
+    processes = [multiprocessing.Process(target=worker, args=(data_dir, args.mode, args.threads, args.writes, args.compact_bytes))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode for process in processes):
+        print('A worker process failed')
+        return 1
+
+    # Read everything back through a fresh store
+    check = JsonStore(data_dir, mode=args.mode, shared=True)
+    expected = args.processes * args.threads * args.writes
+    inserted = check.collection('tasks').count()
+    counter = check.collection('counters').get('counter')['value']
+    print('mode=%s data_dir=%s' % (args.mode, data_dir))
+    print('tasks inserted: %d / %d' % (inserted, expected))
+    print('counter value:  %d / %d' % (counter, expected))
+    if inserted != expected or counter != expected:
+        print('FAILED: updates were lost')
+        return 1
+    print('OK')
+    shutil.rmtree(data_dir)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+# Delta sync for GET /sync. Every change to a task or goal gets the next
+# number of a monotonically increasing sequence; a client passes the last
+# sequence it saw and receives only what was created, updated or deleted
+# after it. The response looks like:
+#
+#   {"seq": "...", "reset": false,
+#    "tasks": {"changed": [...], "deleted": [ids]},
+#    "goals": {"changed": [...], "deleted": [ids]}}
+#
+# "reset" tells the client to drop its local copy first: it is set on the
+# first sync and whenever the server can no longer answer from `since`.
+
+SYNC_COLLECTIONS = ('tasks', 'goals')
+
+class SyncError(ValueError):
+    pass
+
+def sync_response(seq, reset, changed, deleted):
+    response = {'seq': seq, 'reset': reset}
+    for name in SYNC_COLLECTIONS:
+        response[name] = {'changed': changed.get(name, []), 'deleted': deleted.get(name, [])}
+    return response
+
+# Per-process change log for the JSON backend. It listens to the task and
+# goal collections and remembers, per user, the last sequence at which each
+# record changed. Sequences are prefixed with a random epoch, so a client
+# holding a sequence from before a restart (or from another worker) gets a
+# reset instead of a wrong answer. Tombstones for deleted records are kept
+# up to MAX_TOMBSTONES; older ones are dropped and clients that are further
+# behind are reset.
+class ChangeLog:
+    MAX_TOMBSTONES = 10000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.horizon = 0
+        self.users = {}
+        self.tombstones = OrderedDict()
+        self.collections = OrderedDict()
+
+    def watch(self, name, collection):
+        self.collections[name] = collection
+        collection.listeners.append(lambda old, new: self._changed(name, old, new))
+
+    def _changed(self, name, old, new):
+        with self.lock:
+            self.seq += 1
+            if old is not None and old.get('user_id') is not None and (
+                    new is None or new.get('user_id') != old.get('user_id')):
+                # Deleted, or moved to another user: a tombstone for the old owner
+                self._record(old['user_id'], (name, old['_id']), True)
+            if new is not None and new.get('user_id') is not None:
+                self._record(new['user_id'], (name, new['_id']), False)
+
+    def _record(self, user_id, key, deleted):
+        changes = self.users.setdefault(user_id, OrderedDict())
+        changes[key] = (self.seq, deleted)
+        changes.move_to_end(key)
+        self.tombstones.pop((user_id, key), None)
+        if deleted:
+            self.tombstones[(user_id, key)] = self.seq
+            if len(self.tombstones) > self.MAX_TOMBSTONES:
+                (old_user, old_key), seq = self.tombstones.popitem(last=False)
+                if self.users[old_user].get(old_key) == (seq, True):
+                    del self.users[old_user][old_key]
+                self.horizon = max(self.horizon, seq)
+
+    def parse_since(self, since):
+        # Returns the sequence number to sync from, or None for a reset
+        if not since:
+            return None
+        epoch, _, seq = since.partition('.')
+        try:
+            seq = int(seq)
+        except ValueError:
+            raise SyncError('Invalid since value')
+        if epoch != self.epoch or seq < self.horizon or seq > self.seq:
+            return None
+        return seq
+
+    def changes(self, user_id, since):
+        # Make sure the collections are loaded and have caught up with other
+        # processes before looking at the log
+        for collection in self.collections.values():
+            collection.count()
+
+        with self.lock:
+            since = self.parse_since(since)
+            current = '%s.%d' % (self.epoch, self.seq)
+            keys = []
+            if since is not None:
+                # Changes are ordered by sequence, so walk back from the newest
+                for key, (seq, deleted) in reversed(self.users.get(user_id, {}).items()):
+                    if seq <= since:
+                        break
+                    keys.append((key, deleted))
+
+        changed = {}
+        deleted = {}
+        if since is None:
+            for name, collection in self.collections.items():
+                changed[name] = collection.find_by('user_id', user_id)
+            return sync_response(current, True, changed, deleted)
+
+        for (name, id), was_deleted in reversed(keys):
+            record = None if was_deleted else self.collections[name].get(id)
+            if record is None or record.get('user_id') != user_id:
+                deleted.setdefault(name, []).append(id)
+            else:
+                changed.setdefault(name, []).append(record)
+        return sync_response(current, False, changed, deleted)
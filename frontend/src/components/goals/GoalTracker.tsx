@@ -35,16 +35,18 @@ import AddIcon from '@mui/icons-material/Add';
 import DeleteIcon from '@mui/icons-material/Delete';
 import EditIcon from '@mui/icons-material/Edit';
 import CheckCircleIcon from '@mui/icons-material/CheckCircle';
-import { Goal, Milestone } from '../../services/api';
+import api, { Goal, Milestone, MilestoneResult } from '../../services/api';
 
 interface GoalTrackerProps {
   goals: Goal[];
   onAddGoal: (goal: Goal) => void;
   onUpdateGoal: (goal: Goal) => void;
+  // Called with a goal whose milestones were already saved on the server
+  onGoalChanged: (goal: Goal) => void;
   onDeleteGoal: (goalId: string) => void;
 }
 
-const GoalTracker: React.FC<GoalTrackerProps> = ({ goals, onAddGoal, onUpdateGoal, onDeleteGoal }) => {
+const GoalTracker: React.FC<GoalTrackerProps> = ({ goals, onAddGoal, onUpdateGoal, onGoalChanged, onDeleteGoal }) => {
   const [openGoalDialog, setOpenGoalDialog] = useState(false);
   const [openMilestoneDialog, setOpenMilestoneDialog] = useState(false);
   const [selectedGoal, setSelectedGoal] = useState<Goal | null>(null);
@@ -65,11 +67,12 @@ const GoalTracker: React.FC<GoalTrackerProps> = ({ goals, onAddGoal, onUpdateGoa
   });
   const [editMode, setEditMode] = useState(false);
 
-  // Calculate progress percentage for a goal
-  const calculateProgress = (goal: Goal) => {
-    if (!goal.milestones || goal.milestones.length === 0) return 0;
-    const completedMilestones = goal.milestones.filter((milestone) => milestone.completed).length;
-    return Math.round((completedMilestones / goal.milestones.length) * 100);
+  // Progress is computed by the server whenever a goal or its milestones change
+  const goalProgress = (goal: Goal) => goal.progress ?? 0;
+
+  // Applies the result of a milestone endpoint to the goal shown locally
+  const applyMilestoneResult = (goal: Goal, result: MilestoneResult, milestones: Milestone[]) => {
+    onGoalChanged({ ...goal, milestones, progress: result.progress, updated_at: result.updated_at });
   };
 
   // Handle opening the goal dialog for adding a new goal
@@ -103,7 +106,7 @@ const GoalTracker: React.FC<GoalTrackerProps> = ({ goals, onAddGoal, onUpdateGoa
   const handleOpenMilestoneDialog = (goal: Goal) => {
     setSelectedGoal(goal);
     setNewMilestone({
-      id: Date.now(), // Generate a unique ID
+      id: 0, // Assigned by the server
       title: '',
       completed: false,
       dueDate: '',
@@ -126,40 +129,42 @@ const GoalTracker: React.FC<GoalTrackerProps> = ({ goals, onAddGoal, onUpdateGoa
     handleCloseGoalDialog();
   };
 
-  // Handle saving a milestone
-  const handleSaveMilestone = () => {
+  // Handle saving a milestone; only the new milestone is sent
+  const handleSaveMilestone = async () => {
     if (selectedGoal && selectedGoal._id) {
-      const updatedGoal = { ...selectedGoal };
-      if (!updatedGoal.milestones) {
-        updatedGoal.milestones = [];
+      const { title, completed, dueDate } = newMilestone;
+      const result = await api.addMilestone(selectedGoal._id, { title, completed, dueDate });
+      if (result && result.milestone) {
+        applyMilestoneResult(selectedGoal, result, [...(selectedGoal.milestones || []), result.milestone]);
       }
-      updatedGoal.milestones.push(newMilestone);
-      onUpdateGoal(updatedGoal);
       handleCloseMilestoneDialog();
     }
   };
 
   // Handle toggling a milestone's completion status
-  const handleToggleMilestone = (goal: Goal, milestoneId: number) => {
-    const updatedGoal = { ...goal };
-    if (updatedGoal.milestones) {
-      updatedGoal.milestones = updatedGoal.milestones.map((milestone) =>
-        milestone.id === milestoneId
-          ? { ...milestone, completed: !milestone.completed }
-          : milestone
+  const handleToggleMilestone = async (goal: Goal, milestone: Milestone) => {
+    if (!goal._id) return;
+    const result = await api.updateMilestone(goal._id, milestone.id, { completed: !milestone.completed });
+    if (result && result.milestone) {
+      const changed = result.milestone;
+      applyMilestoneResult(
+        goal,
+        result,
+        (goal.milestones || []).map((m) => (m.id === changed.id ? changed : m))
       );
-      onUpdateGoal(updatedGoal);
     }
   };
 
   // Handle deleting a milestone
-  const handleDeleteMilestone = (goal: Goal, milestoneId: number) => {
-    const updatedGoal = { ...goal };
-    if (updatedGoal.milestones) {
-      updatedGoal.milestones = updatedGoal.milestones.filter(
-        (milestone) => milestone.id !== milestoneId
+  const handleDeleteMilestone = async (goal: Goal, milestoneId: number) => {
+    if (!goal._id) return;
+    const result = await api.deleteMilestone(goal._id, milestoneId);
+    if (result) {
+      applyMilestoneResult(
+        goal,
+        result,
+        (goal.milestones || []).filter((milestone) => milestone.id !== milestoneId)
       );
-      onUpdateGoal(updatedGoal);
     }
   };
 
@@ -260,11 +265,11 @@ const GoalTracker: React.FC<GoalTrackerProps> = ({ goals, onAddGoal, onUpdateGoa
 
                   <Box mb={1}>
                     <Typography variant="body2" color="text.secondary">
-                      Progress: {calculateProgress(goal)}%
+                      Progress: {goalProgress(goal)}%
                     </Typography>
                     <LinearProgress
                       variant="determinate"
-                      value={calculateProgress(goal)}
+                      value={goalProgress(goal)}
                       sx={{ mt: 1, height: 8, borderRadius: 4 }}
                     />
                   </Box>
@@ -281,7 +286,7 @@ const GoalTracker: React.FC<GoalTrackerProps> = ({ goals, onAddGoal, onUpdateGoa
                               <Checkbox
                                 edge="start"
                                 checked={milestone.completed}
-                                onChange={() => handleToggleMilestone(goal, milestone.id)}
+                                onChange={() => handleToggleMilestone(goal, milestone)}
                                 size="small"
                               />
                             </ListItemIcon>
@@ -602,7 +602,8 @@ const Dashboard: React.FC = () => {
         return;
       }
       
-      await axios.put(`${API_URL}/${taskId}`, { ...task, completed: !task.completed });
+      // Only the changed field is sent
+      await axios.patch(`${API_URL}/${taskId}`, { completed: !task.completed });
       fetchTasks();
     } catch (error) {
       console.error('Error updating task:', error);
@@ -1,12 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import { Container, Typography, Box, Paper, Alert, Snackbar } from '@mui/material';
 import GoalTracker from '../components/goals/GoalTracker';
-import { Goal } from '../services/api';
-import axios from 'axios';
-
-const API_URL = 'http://localhost:5000/goals';
+import api, { Goal } from '../services/api';
+import { useAuth } from '../contexts/AuthContext';
 
 const Goals: React.FC = () => {
+  const { user } = useAuth();
+  const userId = user?._id || 'default';
   const [goals, setGoals] = useState<Goal[]>([]);
   const [loading, setLoading] = useState<boolean>(true);
   const [snackbar, setSnackbar] = useState<{open: boolean, message: string, severity: 'success' | 'error'}>({ 
@@ -15,110 +15,51 @@ const Goals: React.FC = () => {
     severity: 'success' 
   });
 
-  // Fetch goals from API
+  // Fetch the user's goals; their progress is computed by the server
   useEffect(() => {
     const fetchGoals = async () => {
-      try {
-        // For demo purposes, we'll use local storage instead of a real API
-        const savedGoals = localStorage.getItem('goals');
-        if (savedGoals) {
-          setGoals(JSON.parse(savedGoals));
-        } else {
-          // Initialize with sample goals for demonstration
-          const sampleGoals: Goal[] = [
-            {
-              _id: '1',
-              title: 'Complete Project Milestone',
-              description: 'Finish the first phase of the project including all core features',
-              dueDate: new Date(Date.now() + 14 * 24 * 60 * 60 * 1000).toISOString(), // 2 weeks from now
-              color: '#1976d2',
-              category: 'Career',
-              completed: false,
-              milestones: [
-                {
-                  id: 101,
-                  title: 'Finish requirements gathering',
-                  completed: true,
-                  dueDate: new Date(Date.now() + 2 * 24 * 60 * 60 * 1000).toISOString()
-                },
-                {
-                  id: 102,
-                  title: 'Complete UI design',
-                  completed: false,
-                  dueDate: new Date(Date.now() + 5 * 24 * 60 * 60 * 1000).toISOString()
-                },
-                {
-                  id: 103,
-                  title: 'Implement core functionality',
-                  completed: false,
-                  dueDate: new Date(Date.now() + 10 * 24 * 60 * 60 * 1000).toISOString()
-                }
-              ]
-            },
-            {
-              _id: '2',
-              title: 'Improve Fitness',
-              description: 'Work on improving overall fitness and health',
-              dueDate: new Date(Date.now() + 90 * 24 * 60 * 60 * 1000).toISOString(), // 3 months from now
-              color: '#4caf50',
-              category: 'Health',
-              completed: false,
-              milestones: [
-                {
-                  id: 201,
-                  title: 'Start regular workout routine',
-                  completed: true,
-                  dueDate: new Date(Date.now() + 7 * 24 * 60 * 60 * 1000).toISOString()
-                },
-                {
-                  id: 202,
-                  title: 'Run 5km without stopping',
-                  completed: false,
-                  dueDate: new Date(Date.now() + 30 * 24 * 60 * 60 * 1000).toISOString()
-                }
-              ]
-            }
-          ];
-          setGoals(sampleGoals);
-          localStorage.setItem('goals', JSON.stringify(sampleGoals));
-        }
-      } catch (error) {
-        console.error('Error fetching goals:', error);
-        showSnackbar('Error loading goals', 'error');
-      } finally {
-        setLoading(false);
-      }
+      setLoading(true);
+      setGoals(await api.getGoals({ user_id: userId }));
+      setLoading(false);
     };
 
     fetchGoals();
-  }, []);
-
-  // Save goals to local storage whenever they change
-  useEffect(() => {
-    if (!loading) {
-      localStorage.setItem('goals', JSON.stringify(goals));
+  }, [userId]);
+
+  const handleAddGoal = async (goal: Goal) => {
+    const created = await api.createGoal({ ...goal, user_id: userId });
+    if (created) {
+      setGoals(prev => [...prev, created]);
+      showSnackbar('Goal created successfully!', 'success');
+    } else {
+      showSnackbar('Error creating goal', 'error');
     }
-  }, [goals, loading]);
+  };
 
-  const handleAddGoal = (goal: Goal) => {
-    const newGoal = {
-      ...goal,
-      _id: Date.now().toString() // Ensure unique ID
-    };
-    setGoals(prev => [...prev, newGoal]);
-    showSnackbar('Goal created successfully!', 'success');
+  const handleUpdateGoal = async (updatedGoal: Goal) => {
+    const saved = updatedGoal._id ? await api.updateGoal(updatedGoal._id, updatedGoal) : null;
+    if (saved) {
+      handleGoalChanged(saved);
+      showSnackbar('Goal updated successfully!', 'success');
+    } else {
+      showSnackbar('Error updating goal', 'error');
+    }
   };
 
-  const handleUpdateGoal = (updatedGoal: Goal) => {
+  // Replaces a goal the milestone endpoints already saved
+  const handleGoalChanged = (changedGoal: Goal) => {
     setGoals(prev => prev.map(goal => 
-      goal._id === updatedGoal._id ? updatedGoal : goal
+      goal._id === changedGoal._id ? changedGoal : goal
     ));
-    showSnackbar('Goal updated successfully!', 'success');
   };
 
-  const handleDeleteGoal = (goalId: string) => {
-    setGoals(prev => prev.filter(goal => goal._id !== goalId));
-    showSnackbar('Goal deleted', 'success');
+  const handleDeleteGoal = async (goalId: string) => {
+    if (await api.deleteGoal(goalId)) {
+      setGoals(prev => prev.filter(goal => goal._id !== goalId));
+      showSnackbar('Goal deleted', 'success');
+    } else {
+      showSnackbar('Error deleting goal', 'error');
+    }
   };
 
   const showSnackbar = (message: string, severity: 'success' | 'error') => {
@@ -228,6 +169,7 @@ const Goals: React.FC = () => {
           goals={goals}
           onAddGoal={handleAddGoal}
           onUpdateGoal={handleUpdateGoal}
+          onGoalChanged={handleGoalChanged}
           onDeleteGoal={handleDeleteGoal}
         />
       </Box>
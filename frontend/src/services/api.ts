@@ -25,6 +25,8 @@ export interface Goal {
   completed: boolean;
   user_id?: string;
   milestones?: Milestone[];
+  // Percentage of completed milestones, computed by the server
+  progress?: number;
   created_at?: string;
   updated_at?: string;
 }
@@ -36,6 +38,16 @@ export interface Milestone {
   dueDate?: string;
 }
 
+// Result of the milestone endpoints: the milestone that was added, changed
+// or removed (or the reordered list) with the goal's new progress.
+export interface MilestoneResult {
+  _id: string;
+  progress: number;
+  updated_at: string;
+  milestone?: Milestone;
+  milestones?: Milestone[];
+}
+
 export interface User {
   _id?: string;
   name: string;
@@ -75,12 +87,58 @@ export interface Statistics {
   };
 }
 
+export interface SyncChanges<T> {
+  changed: T[];
+  deleted: string[];
+}
+
+// Result of GET /sync. When reset is true the client should replace its
+// local copy instead of merging the changes into it.
+export interface SyncResponse {
+  seq: string;
+  reset: boolean;
+  tasks: SyncChanges<Task>;
+  goals: SyncChanges<Goal>;
+}
+
+// Event sent on the GET /events stream; fetch the data itself with sync().
+export interface ChangeEvent {
+  collection: 'tasks' | 'goals' | 'settings';
+  op: 'created' | 'updated' | 'deleted';
+  _id: string;
+}
+
+// Reminder sent on the GET /events stream when a task comes due, unless the
+// user turned notifications off in their settings.
+export interface ReminderEvent {
+  collection: 'tasks';
+  op: 'due';
+  _id: string;
+  title: string;
+  dueDate: string;
+}
+
+// Optional filters, sorting and paging for the task and goal lists.
+// The cursor for the next page is returned in the X-Next-Cursor header.
+export interface ListQuery {
+  user_id?: string;
+  completed?: boolean;
+  category?: string;
+  priority?: string;
+  due_after?: string;
+  due_before?: string;
+  sort?: string;
+  limit?: number;
+  cursor?: string;
+  fields?: string;
+}
+
 // API service class
 class ApiService {
   // Task endpoints
-  async getTasks(): Promise<Task[]> {
+  async getTasks(query: ListQuery = {}): Promise<Task[]> {
     try {
-      const response: AxiosResponse<Task[]> = await axios.get(`${API_URL}/tasks`);
+      const response: AxiosResponse<Task[]> = await axios.get(`${API_URL}/tasks`, { params: query });
       return response.data;
     } catch (error) {
       console.error('Error fetching tasks:', error);
@@ -118,6 +176,19 @@ class ApiService {
     }
   }
 
+  // Sends only the fields to change (null removes one). With the ETag of the
+  // version last read, the update fails with 412 if someone changed it since.
+  async patchTask(id: string, changes: Partial<Task>, etag?: string): Promise<Task | null> {
+    try {
+      const headers = etag ? { 'If-Match': etag } : undefined;
+      const response: AxiosResponse<Task> = await axios.patch(`${API_URL}/tasks/${id}`, changes, { headers });
+      return response.data;
+    } catch (error) {
+      console.error(`Error patching task ${id}:`, error);
+      return null;
+    }
+  }
+
   async deleteTask(id: string): Promise<boolean> {
     try {
       await axios.delete(`${API_URL}/tasks/${id}`);
@@ -129,9 +200,9 @@ class ApiService {
   }
 
   // Goal endpoints
-  async getGoals(): Promise<Goal[]> {
+  async getGoals(query: ListQuery = {}): Promise<Goal[]> {
     try {
-      const response: AxiosResponse<Goal[]> = await axios.get(`${API_URL}/goals`);
+      const response: AxiosResponse<Goal[]> = await axios.get(`${API_URL}/goals`, { params: query });
       return response.data;
     } catch (error) {
       console.error('Error fetching goals:', error);
@@ -169,6 +240,17 @@ class ApiService {
     }
   }
 
+  async patchGoal(id: string, changes: Partial<Goal>, etag?: string): Promise<Goal | null> {
+    try {
+      const headers = etag ? { 'If-Match': etag } : undefined;
+      const response: AxiosResponse<Goal> = await axios.patch(`${API_URL}/goals/${id}`, changes, { headers });
+      return response.data;
+    } catch (error) {
+      console.error(`Error patching goal ${id}:`, error);
+      return null;
+    }
+  }
+
   async deleteGoal(id: string): Promise<boolean> {
     try {
       await axios.delete(`${API_URL}/goals/${id}`);
@@ -179,6 +261,53 @@ class ApiService {
     }
   }
 
+  // Milestone endpoints; these send only the milestone, not the whole goal
+  async addMilestone(goalId: string, milestone: Omit<Milestone, 'id'>): Promise<MilestoneResult | null> {
+    try {
+      const response: AxiosResponse<MilestoneResult> = await axios.post(`${API_URL}/goals/${goalId}/milestones`, milestone);
+      return response.data;
+    } catch (error) {
+      console.error(`Error adding milestone to goal ${goalId}:`, error);
+      return null;
+    }
+  }
+
+  async updateMilestone(goalId: string, milestoneId: number, changes: Partial<Milestone>): Promise<MilestoneResult | null> {
+    try {
+      const response: AxiosResponse<MilestoneResult> = await axios.patch(
+        `${API_URL}/goals/${goalId}/milestones/${milestoneId}`, changes
+      );
+      return response.data;
+    } catch (error) {
+      console.error(`Error updating milestone ${milestoneId}:`, error);
+      return null;
+    }
+  }
+
+  async deleteMilestone(goalId: string, milestoneId: number): Promise<MilestoneResult | null> {
+    try {
+      const response: AxiosResponse<MilestoneResult> = await axios.delete(
+        `${API_URL}/goals/${goalId}/milestones/${milestoneId}`
+      );
+      return response.data;
+    } catch (error) {
+      console.error(`Error deleting milestone ${milestoneId}:`, error);
+      return null;
+    }
+  }
+
+  async reorderMilestones(goalId: string, order: number[]): Promise<MilestoneResult | null> {
+    try {
+      const response: AxiosResponse<MilestoneResult> = await axios.put(
+        `${API_URL}/goals/${goalId}/milestones/order`, { order }
+      );
+      return response.data;
+    } catch (error) {
+      console.error(`Error reordering milestones of goal ${goalId}:`, error);
+      return null;
+    }
+  }
+
   // User endpoints
   async getUsers(): Promise<User[]> {
     try {
@@ -230,6 +359,17 @@ class ApiService {
     }
   }
 
+  async patchUser(id: string, changes: Partial<User>, etag?: string): Promise<User | null> {
+    try {
+      const headers = etag ? { 'If-Match': etag } : undefined;
+      const response: AxiosResponse<User> = await axios.patch(`${API_URL}/users/${id}`, changes, { headers });
+      return response.data;
+    } catch (error) {
+      console.error(`Error patching user ${id}:`, error);
+      return null;
+    }
+  }
+
   // Settings endpoints
   async getSettings(userId: string): Promise<Settings | null> {
     try {
@@ -251,6 +391,39 @@ class ApiService {
     }
   }
 
+  // Sync endpoint: tasks and goals changed since the given sequence
+  async sync(userId: string, since?: string): Promise<SyncResponse | null> {
+    try {
+      const response: AxiosResponse<SyncResponse> = await axios.get(`${API_URL}/sync`, {
+        params: { user_id: userId, since }
+      });
+      return response.data;
+    } catch (error) {
+      console.error(`Error syncing changes for user ${userId}:`, error);
+      return null;
+    }
+  }
+
+  // Change notifications: calls onChange for every change to the user's data,
+  // and onReminder for due date reminders. Close the returned EventSource to
+  // stop listening.
+  subscribe(
+    userId: string,
+    onChange: (event: ChangeEvent) => void,
+    onReminder?: (event: ReminderEvent) => void
+  ): EventSource {
+    const source = new EventSource(`${API_URL}/events?user_id=${encodeURIComponent(userId)}`);
+    source.addEventListener('change', (event) => {
+      onChange(JSON.parse((event as MessageEvent).data));
+    });
+    if (onReminder) {
+      source.addEventListener('reminder', (event) => {
+        onReminder(JSON.parse((event as MessageEvent).data));
+      });
+    }
+    return source;
+  }
+
   // Statistics endpoints
   async getStatistics(userId: string): Promise<Statistics | null> {
     try {